@@ -0,0 +1,161 @@
+"""睡眠セッションの列指向集計
+
+セッションを日付（序数）と睡眠時間の2本の array にまとめ、
+日別・全期間の平均・グラフ用の間引き・比較値を少ない走査回数で求める。
+平均と比較値は stats.py の calculate_* 関数と完全に同じ値になる（tests/test_stats.py で確認）。
+週別・月別の平均は rollups（集計テーブル）で求める。
+"""
+from array import array
+from bisect import bisect_left
+from datetime import date
+from itertools import islice
+from operator import le
+
+from attendance_system import comparisons as comparisons_module
+from attendance_system.comparisons import SleepIndex
+
+
+class SessionColumns:
+    """睡眠セッションの列データ（ordinals: date.toordinal(), durations: 時間）"""
+
+    __slots__ = ('ordinals', 'durations')
+
+    def __init__(self, ordinals=None, durations=None):
+        self.ordinals = ordinals if ordinals is not None else array('l')
+        self.durations = durations if durations is not None else array('d')
+
+    def __len__(self):
+        return len(self.durations)
+
+    @classmethod
+    def from_rows(cls, rows):
+        """(local_date 文字列, duration_seconds) の行から作る"""
+        ordinal_of = {}
+        for local_date in {row[0] for row in rows}:
+            ordinal_of[local_date] = date.fromisoformat(local_date).toordinal()
+        return cls(array('l', [ordinal_of[row[0]] for row in rows]),
+                   array('d', [row[1] / 3600 for row in rows]))
+
+    @classmethod
+    def from_sleep_times(cls, sleep_times):
+        """calculate_* 関数に渡していた dict のリストから作る"""
+        return cls(array('l', [item['date'].toordinal() for item in sleep_times]),
+                   array('d', [item['duration'] for item in sleep_times]))
+
+    def to_sleep_times(self):
+        """テンプレート表示用の dict のリストに戻す"""
+        sleep_times = []
+        for ordinal, duration in zip(self.ordinals, self.durations):
+            sleep_date = date.fromordinal(ordinal)
+            sleep_times.append({
+                'date': sleep_date,
+                'duration': duration,
+                'hours': int(duration),
+                'minutes': int((duration - int(duration)) * 60),
+                'week': sleep_date.isocalendar()[1],  # ISO週番号
+                'month': sleep_date.month,
+                'year': sleep_date.year
+            })
+        return sleep_times
+
+
+def load_session_columns(conn, user_id):
+    rows = conn.execute('''
+        SELECT local_date, duration_seconds
+        FROM sleep_sessions
+        WHERE user_id = ?
+        ORDER BY wake_ts, wake_record_id
+    ''', (user_id,)).fetchall()
+    return SessionColumns.from_rows(rows)
+
+
+def _split_hours(value):
+    hours = int(value)
+    return hours, int((value - hours) * 60)
+
+
+def _group_durations(columns, key_range):
+    """ordinal から求めたキーごとに睡眠時間をまとめる（キーは初出順）
+
+    key_range(ordinal) は (キー, 同じキーになる ordinal の下限, 上限) を返す。
+    日付順に並んでいれば、各グループの終端を二分探索で求めてスライスで切り出すので、
+    Python のループはセッション数ではなくグループ数だけ回る。
+    合計は従来と同じく組み込みの sum() で取るため、値をグループごとに残しておく。
+    """
+    ordinals = columns.ordinals
+    durations = columns.durations
+    n = len(ordinals)
+    groups = {}
+    if all(map(le, ordinals, islice(ordinals, 1, None))):
+        start = 0
+        while start < n:
+            key, _, hi = key_range(ordinals[start])
+            end = bisect_left(ordinals, hi, start)
+            groups.setdefault(key, []).extend(durations[start:end])
+            start = end
+        return groups
+
+    lo = hi = 0
+    bucket = None
+    for ordinal, duration in zip(ordinals, durations):
+        if not lo <= ordinal < hi:
+            key, lo, hi = key_range(ordinal)
+            bucket = groups.setdefault(key, [])
+        bucket.append(duration)
+    return groups
+
+
+def average(columns, evaluate):
+    """calculate_average と同じ結果を返す"""
+    n = len(columns)
+    if not n:
+        return {'avg_hours': 0, 'avg_minutes': 0, 'evaluation': None}
+    avg_sleep = sum(columns.durations) / n
+    avg_hours, avg_minutes = _split_hours(avg_sleep)
+    return {
+        'avg_hours': avg_hours,
+        'avg_minutes': avg_minutes,
+        'avg_duration': avg_sleep,
+        'evaluation': evaluate(avg_sleep) if n >= 3 else None
+    }
+
+
+def overall_average(columns, evaluate):
+    """calculate_overall_average と同じ結果を返す"""
+    n = len(columns)
+    if not n:
+        return {'avg_hours': 0, 'avg_minutes': 0, 'evaluation': "データなし"}
+    avg_sleep = sum(columns.durations) / n
+    avg_hours, avg_minutes = _split_hours(avg_sleep)
+    return {
+        'avg_hours': avg_hours,
+        'avg_minutes': avg_minutes,
+        'avg_duration': avg_sleep,
+        'evaluation': evaluate(avg_sleep) if n >= 3 else "評価不可"
+    }
+
+
+def downsample(columns, bucket_days, origin=None):
+    """bucket_days 日ごとに睡眠時間をまとめ、(開始 ordinal, 件数, 最小, 最大, 平均) のリストを返す
+
+    区切りは origin（省略時は最も古い日）から数える。結果は日付の昇順。
+    """
+    if not len(columns):
+        return []
+    if origin is None:
+        origin = min(columns.ordinals)
+
+    def bucket_range(ordinal):
+        lo = origin + (ordinal - origin) // bucket_days * bucket_days
+        return lo, lo, lo + bucket_days
+
+    buckets = []
+    for start, durations in sorted(_group_durations(columns, bucket_range).items()):
+        buckets.append((start, len(durations), min(durations), max(durations),
+                        sum(durations) / len(durations)))
+    return buckets
+
+
+def comparisons(columns):
+    """calculate_comparisons と同じ結果を返す（comparisons.SleepIndex の二分探索で探す）"""
+    return comparisons_module.comparisons(SleepIndex.from_columns(columns))
@@ -0,0 +1,149 @@
+"""管理者向けの全体統計
+
+ユーザーごとに睡眠時間を計算し直すのではなく、集計テーブルと
+sleep_sessions に対する集合演算の SQL で全ユーザー分をまとめて求める。
+- ユーザーごとの平均睡眠時間の分布と、evaluate_sleep の評価ごとの人数
+- 日ごとのアクティブユーザー数（その日に起床が記録された睡眠があるユーザー）
+- 連続記録日数（現在の連続と最長の連続）
+"""
+from datetime import timedelta
+
+# 平均睡眠時間の分布の区切り（時間）。最後の区間は上限なし
+HISTOGRAM_EDGES = tuple(range(3, 13))
+
+
+def user_averages(conn):
+    """(user_id, 平均睡眠時間[時間], セッション数) の一覧（管理者は除く）"""
+    # 月別の集計テーブルはユーザーごとに数十行なので、合計し直すだけで全期間の平均になる
+    return conn.execute('''
+        SELECT m.user_id, SUM(m.sum_duration) / SUM(m.count) / 3600.0, SUM(m.count)
+        FROM monthly_rollups m
+        JOIN users u ON u.id = m.user_id
+        WHERE u.is_admin = 0
+        GROUP BY m.user_id
+    ''').fetchall()
+
+
+def _histogram_label(index):
+    if index == 0:
+        return f'{HISTOGRAM_EDGES[0]}時間未満'
+    if index == len(HISTOGRAM_EDGES):
+        return f'{HISTOGRAM_EDGES[-1]}時間以上'
+    return f'{HISTOGRAM_EDGES[index - 1]}～{HISTOGRAM_EDGES[index]}時間'
+
+
+def average_distribution(averages, evaluate):
+    """平均睡眠時間のヒストグラムと評価ごとの人数・割合"""
+    counts = [0] * (len(HISTOGRAM_EDGES) + 1)
+    evaluations = {}
+    for _, avg_sleep, _ in averages:
+        index = 0
+        while index < len(HISTOGRAM_EDGES) and avg_sleep >= HISTOGRAM_EDGES[index]:
+            index += 1
+        counts[index] += 1
+        label = evaluate(avg_sleep)
+        evaluations[label] = evaluations.get(label, 0) + 1
+
+    total = len(averages)
+    histogram = [{'label': _histogram_label(i), 'users': count} for i, count in enumerate(counts)]
+    buckets = [
+        {'evaluation': label, 'users': count, 'share': count / total}
+        for label, count in sorted(evaluations.items(), key=lambda item: -item[1])
+    ]
+    values = sorted(avg_sleep for _, avg_sleep, _ in averages)
+    summary = {
+        'users': total,
+        'mean': sum(values) / total if total else None,
+        'median': _percentile(values, 0.5),
+        'p10': _percentile(values, 0.1),
+        'p90': _percentile(values, 0.9),
+    }
+    return {'summary': summary, 'histogram': histogram, 'evaluations': buckets}
+
+
+def _percentile(values, q):
+    if not values:
+        return None
+    position = (len(values) - 1) * q
+    lower = int(position)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (position - lower)
+
+
+def daily_active_users(conn, date_from, date_to):
+    """date_from～date_to の各日のアクティブユーザー数（記録のない日は 0）"""
+    rows = conn.execute('''
+        SELECT s.local_date, COUNT(DISTINCT s.user_id)
+        FROM sleep_sessions s
+        WHERE s.local_date BETWEEN ? AND ?
+        GROUP BY s.local_date
+    ''', (date_from.isoformat(), date_to.isoformat())).fetchall()
+    counts = dict(rows)
+    days = []
+    day = date_from
+    while day <= date_to:
+        days.append({'date': day.isoformat(), 'users': counts.get(day.isoformat(), 0)})
+        day += timedelta(days=1)
+    return days
+
+
+def streaks(conn, today):
+    """ユーザーごとの (user_id, 現在の連続日数, 最長の連続日数)
+
+    連続した日付は「日付 - 行番号」が同じ値になることを使って1回の走査でまとめる。
+    今日か昨日まで続いている連続を「現在の連続」とする。
+    """
+    return conn.execute('''
+        WITH days AS (
+            SELECT DISTINCT user_id, local_date FROM sleep_sessions
+        ),
+        runs AS (
+            SELECT user_id, local_date,
+                julianday(local_date)
+                    - ROW_NUMBER() OVER (PARTITION BY user_id ORDER BY local_date) AS run
+            FROM days
+        ),
+        lengths AS (
+            SELECT user_id, COUNT(*) AS length, MAX(local_date) AS last_date
+            FROM runs GROUP BY user_id, run
+        )
+        SELECT l.user_id,
+            COALESCE(MAX(CASE WHEN l.last_date >= ? THEN l.length END), 0),
+            MAX(l.length)
+        FROM lengths l
+        JOIN users u ON u.id = l.user_id
+        WHERE u.is_admin = 0
+        GROUP BY l.user_id
+    ''', ((today - timedelta(days=1)).isoformat(),)).fetchall()
+
+
+def streak_summary(conn, rows, top=10):
+    """連続記録日数の集計と、現在の連続が長いユーザーの上位"""
+    active = [row for row in rows if row[1] > 0]
+    ranking = sorted(rows, key=lambda row: (-row[1], -row[2]))[:top]
+    names = {}
+    if ranking:
+        ids = [row[0] for row in ranking]
+        names = dict(conn.execute(
+            f"SELECT id, username FROM users WHERE id IN ({','.join('?' * len(ids))})", ids
+        ).fetchall())
+    return {
+        'users_on_streak': len(active),
+        'average_current': sum(row[1] for row in active) / len(active) if active else 0,
+        'longest': max((row[2] for row in rows), default=0),
+        'top': [
+            {'username': names.get(user_id), 'current': current, 'longest': longest}
+            for user_id, current, longest in ranking if current > 0
+        ],
+    }
+
+
+def build_population_stats(conn, evaluate, today, days=30):
+    """管理者画面の全体統計をまとめて作る"""
+    date_from = today - timedelta(days=days - 1)
+    stats = average_distribution(user_averages(conn), evaluate)
+    stats['daily_active'] = daily_active_users(conn, date_from, today)
+    stats['streaks'] = streak_summary(conn, streaks(conn, today))
+    stats['generated_for'] = today.isoformat()
+    stats['days'] = days
+    return stats
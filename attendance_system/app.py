@@ -8,7 +8,8 @@ def round_decimal(value, precision=0):
 import sys
 import os
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-from flask import Flask, render_template, request, redirect, url_for, session, flash
+from flask import Flask, render_template, request, redirect, url_for, session, flash, g
+from flask import Response, stream_with_context, has_request_context
 from flask_bootstrap import Bootstrap
 from flask import jsonify
 from flask_cors import CORS
@@ -20,26 +21,42 @@ import calendar
 import pytz
 import os
 import psycopg2
-from psycopg2.extras import DictCursor
-
-import subprocess
-
-def backup_and_push():
-    # 例: バックアップファイル作成処理
-
-    # git add & commit
-    subprocess.run(['git', 'add', '.'])
-    result = subprocess.run(['git', 'commit', '-m', 'バックアップ: 自動コミット'], capture_output=True, text=True)
-    if 'nothing to commit' in result.stdout:
-        print('差分がないためプッシュしません')
-        return
-
-    # git push
-    push_result = subprocess.run(['git', 'push', 'origin', 'main'], capture_output=True, text=True)
-    if push_result.returncode == 0:
-        print('Githubにプッシュしました')
-    else:
-        print('Githubへのプッシュに失敗しました:', push_result.stderr)
+from attendance_system.db_pool import (
+    create_sqlite_pool, create_postgres_pool, connect_sqlite, TUNED_SQLITE_PRAGMAS
+)
+from attendance_system.write_queue import WriteQueue
+from attendance_system.likes import (
+    create_like_tables, add_like, fold_like_deltas, reconcile_like_counts, LikeCounter
+)
+from attendance_system.sleep_sessions import (
+    table_exists, create_sleep_sessions_table, refresh_user_sessions,
+    backfill_sleep_sessions
+)
+from attendance_system.query_plans import check_hot_queries
+from attendance_system.pagination import fetch_keyset_page, CountCache, InvalidCursorError
+from attendance_system.data_versions import (
+    create_data_versions, get_version, create_user_versions, get_user_version, bump_user_version
+)
+from attendance_system import rollups
+from attendance_system import analytics
+from attendance_system import archive
+from attendance_system.events import EventBroker, format_sse
+from attendance_system.stats_cache import create_stats_cache
+from attendance_system import aggregation
+from attendance_system.comparisons import SleepIndex, build_comparisons
+from attendance_system.stats import evaluate_sleep
+from attendance_system.ingest import IngestError, parse_rows, ingest_rows, summarize_results
+from attendance_system import export
+from attendance_system.backup import BackupService, online_copy
+from attendance_system.scheduler import Scheduler, CronError
+from attendance_system.metrics import MetricsRegistry, InstrumentedConnection, QueryStats
+from attendance_system.profiler import QueryProfiler
+
+import atexit
+import click
+import hmac
+import tempfile
+import time
 
 # 環境変数からデータベースURLを取得
 DATABASE_URL = os.environ.get('DATABASE_URL')
@@ -65,6 +82,41 @@ app.config.update(
     PERMANENT_SESSION_LIFETIME=timedelta(hours=2)
 )
 
+# 一覧の総件数はページ送りのたびに数え直さず、一定時間キャッシュする
+record_count_cache = CountCache(
+    ttl=float(os.environ.get('RECORD_COUNT_CACHE_TTL', 60)),
+    maxsize=int(os.environ.get('RECORD_COUNT_CACHE_SIZE', 1024))
+)
+
+# 睡眠統計のキャッシュ（記録の追加・削除で無効化する）
+# キーに DB の user_data_versions を含めるので、ほかのワーカーやスケジューラーでの書き込みにも追従する
+stats_cache = create_stats_cache(
+    backend=os.environ.get('STATS_CACHE_BACKEND', 'memory'),
+    path=os.environ.get('STATS_CACHE_PATH', os.path.join(RENDER_DATA_DIR, 'stats_cache.db')),
+    maxsize=int(os.environ.get('STATS_CACHE_SIZE', 256)),
+    ttl=float(os.environ.get('STATS_CACHE_TTL', 300)),
+    version=lambda user_id: get_user_version(get_db_connection(), user_id)
+)
+
+# /api/stream に配るフィード更新イベント（ワーカープロセスごと）
+event_broker = EventBroker(
+    buffer_size=int(os.environ.get('STREAM_BUFFER_SIZE', 100)),
+    max_subscribers=int(os.environ.get('STREAM_MAX_CLIENTS', 16))
+)
+STREAM_HEARTBEAT = float(os.environ.get('STREAM_HEARTBEAT', 15))
+
+# いいね数の足し込みは最短でもこの間隔（秒）でまとめる
+like_counter = LikeCounter(interval=float(os.environ.get('LIKE_FOLD_INTERVAL', 1)))
+
+# オンラインバックアップ（BACKUP_INTERVAL 秒ごと。0 なら自動では取らない）
+# ワーカーごとには動かさず、下の定期ジョブとしてリースを持つ1プロセスだけが取る
+backup_service = BackupService(
+    DATABASE_PATH,
+    os.environ.get('BACKUP_DIR', os.path.join(RENDER_DATA_DIR, 'backups')),
+    interval=float(os.environ.get('BACKUP_INTERVAL', 0)),
+    keep=int(os.environ.get('BACKUP_KEEP', 14))
+)
+
 # ユーティリティ関数
 def hash_password(password):
     return hashlib.sha256(password.encode('utf-8')).hexdigest()
@@ -74,25 +126,203 @@ def ensure_db_directory_exists():
     if not os.path.exists(db_dir):
         os.makedirs(db_dir)
 
+# データベース接続プール（ワーカープロセスごとに使い回す）
+app.config.update(
+    DB_POOL_SIZE=int(os.environ.get('DB_POOL_SIZE', 5)),
+    DB_POOL_TIMEOUT=float(os.environ.get('DB_POOL_TIMEOUT', 10)),
+    DB_POOL_HEALTH_CHECK_INTERVAL=float(os.environ.get('DB_POOL_HEALTH_CHECK_INTERVAL', 30)),
+    # 高並列モード: WAL と調整済み PRAGMA を使い、書き込みを専用スレッドにまとめる
+    SQLITE_HIGH_CONCURRENCY=os.environ.get('SQLITE_HIGH_CONCURRENCY', '0') == '1',
+    WRITE_QUEUE_BATCH_SIZE=int(os.environ.get('WRITE_QUEUE_BATCH_SIZE', 64)),
+    WRITE_QUEUE_MAX_WAIT=float(os.environ.get('WRITE_QUEUE_MAX_WAIT', 0.002))
+)
+
+# 遅いクエリのログ（SLOW_QUERY_MS ミリ秒以上。空なら記録しない）と、ルートごとのクエリ数の上限
+app.config.update(
+    SLOW_QUERY_MS=float(os.environ.get('SLOW_QUERY_MS', 100)) if os.environ.get('SLOW_QUERY_MS') != '' else None,
+    SLOW_QUERY_EXPLAIN=os.environ.get('SLOW_QUERY_EXPLAIN', '1') == '1',
+    # 1 なら上限を超えたリクエストを例外にする（テスト・CI 用）。0 ならログに残すだけ
+    QUERY_BUDGET_STRICT=os.environ.get('QUERY_BUDGET_STRICT', '0') == '1'
+)
+
+_sqlite_pool = None
+_postgres_pool = None
+_write_queue = None
+_write_queue_pid = None
+
+def sqlite_pragmas():
+    return TUNED_SQLITE_PRAGMAS if app.config['SQLITE_HIGH_CONCURRENCY'] else None
+
+def get_sqlite_pool():
+    global _sqlite_pool
+    if _sqlite_pool is None:
+        ensure_db_directory_exists()
+        _sqlite_pool = create_sqlite_pool(
+            DATABASE_PATH,
+            size=app.config['DB_POOL_SIZE'],
+            timeout=app.config['DB_POOL_TIMEOUT'],
+            health_check_interval=app.config['DB_POOL_HEALTH_CHECK_INTERVAL'],
+            pragmas=sqlite_pragmas()
+        )
+    return _sqlite_pool
+
+def get_write_queue():
+    """高並列モードのときだけ書き込みキューを返す（ワーカープロセスごとに1つ）"""
+    global _write_queue, _write_queue_pid
+    if DATABASE_URL or not app.config['SQLITE_HIGH_CONCURRENCY']:
+        return None
+    if _write_queue is None or _write_queue_pid != os.getpid():
+        ensure_db_directory_exists()
+        _write_queue = WriteQueue(
+            lambda: connect_sqlite(DATABASE_PATH, TUNED_SQLITE_PRAGMAS),
+            batch_size=app.config['WRITE_QUEUE_BATCH_SIZE'],
+            max_wait=app.config['WRITE_QUEUE_MAX_WAIT']
+        ).start()
+        _write_queue_pid = os.getpid()
+    return _write_queue
+
+def run_write(fn):
+    """書き込み処理 fn(conn) を実行してコミットし、fn の戻り値を返す
+
+    高並列モードでは書き込みスレッドに渡し、他のリクエストの書き込みとまとめてコミットする。
+    fn の中では commit しないこと。
+    """
+    write_queue = get_write_queue()
+    if write_queue is not None:
+        return write_queue.submit(fn)
+    conn = get_db_connection()
+    try:
+        result = fn(conn)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return result
+
+def get_postgres_pool():
+    global _postgres_pool
+    if _postgres_pool is None:
+        _postgres_pool = create_postgres_pool(
+            DATABASE_URL,
+            size=app.config['DB_POOL_SIZE'],
+            timeout=app.config['DB_POOL_TIMEOUT'],
+            health_check_interval=app.config['DB_POOL_HEALTH_CHECK_INTERVAL']
+        )
+    return _postgres_pool
+
 # データベース接続
+def _current_endpoint():
+    # 遅いクエリのログに出す名前（リクエスト外なら CLI・ジョブからの実行）
+    if has_request_context():
+        return request.endpoint or 'unmatched'
+    return 'background'
+
 def get_db_connection():
-    """環境に応じたデータベース接続を返す"""
+    """環境に応じたデータベース接続を返す
+
+    接続はプールから借りてアプリケーションコンテキストに保持し、
+    同じリクエスト内では同じ接続を返す。返却は teardown_appcontext で行う。
+    """
+    if 'db_conn' in g:
+        return g.db_conn
+
     if DATABASE_URL:
         try:
             # PostgreSQL接続を試みる
-            conn = psycopg2.connect(DATABASE_URL)
-            conn.cursor_factory = DictCursor
-            return conn
+            pool = get_postgres_pool()
+            g.db_conn = InstrumentedConnection(pool.acquire(), profiler=query_profiler,
+                                               endpoint=_current_endpoint())
+            g.db_pool = pool
+            return g.db_conn
         except psycopg2.OperationalError:
             # 接続エラーの場合はSQLiteにフォールバック
             print("PostgreSQL connection failed, falling back to SQLite")
-    
+
     # SQLite接続
-    ensure_db_directory_exists()
-    conn = sqlite3.connect(DATABASE_PATH)
-    conn.row_factory = sqlite3.Row
-    conn.execute("PRAGMA foreign_keys = ON")
-    return conn
+    pool = get_sqlite_pool()
+    # クエリ数と DB 時間を数え、遅いクエリを記録するラッパーで包む
+    g.db_conn = InstrumentedConnection(pool.acquire(), profiler=query_profiler,
+                                       endpoint=_current_endpoint())
+    g.db_pool = pool
+    return g.db_conn
+
+@app.teardown_appcontext
+def release_db_connection(exception):
+    conn = g.pop('db_conn', None)
+    pool = g.pop('db_pool', None)
+    if conn is not None and pool is not None:
+        pool.release(conn.raw)
+
+# リクエストごとの処理時間・DB 時間・クエリ数（ワーカープロセスごとに集計）
+metrics_registry = MetricsRegistry()
+
+# 遅いクエリの記録とクエリ数の上限チェック
+query_profiler = QueryProfiler(
+    threshold=app.config['SLOW_QUERY_MS'] / 1000 if app.config['SLOW_QUERY_MS'] is not None else None,
+    explain=app.config['SLOW_QUERY_EXPLAIN'],
+    log=lambda message: app.logger.warning(message)
+)
+
+# ルートごとの1リクエストあたりのクエリ数の上限（件数に比例して増えるなら N+1 になっている）
+# 書き込みキューを使わない設定での件数。ページの件数やユーザー数には依存しないこと（tests/test_query_budgets.py で確認）
+QUERY_BUDGETS = {
+    'index': 4,
+    'all_records': 5,
+    'api_feed': 4,
+    'day_records': 4,
+    'average_sleep': 5,
+    'sleep_data': 3,
+    'api_calendar': 3,
+    'sleep_comparisons': 3,
+    'record': 10,
+    'like_record': 8,
+    'delete_record': 8,
+    'admin_dashboard': 5,
+    'admin_user_records': 5,
+    'admin_analytics': 6,
+    'admin_archive': 4,
+}
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+    if request.endpoint in QUERY_BUDGETS:
+        g.query_log = query_profiler.start_recording()
+
+@app.after_request
+def check_query_budget(response):
+    queries = g.pop('query_log', None)
+    if queries is not None:
+        query_profiler.stop_recording(queries)
+        error = query_profiler.check_budget(request.endpoint, QUERY_BUDGETS[request.endpoint], queries)
+        if error is not None and app.config['QUERY_BUDGET_STRICT']:
+            raise error
+    return response
+
+@app.teardown_request
+def stop_query_log(exception):
+    # 例外で after_request が呼ばれなかったときも記録をやめる
+    queries = g.pop('query_log', None)
+    if queries is not None:
+        query_profiler.stop_recording(queries)
+
+@app.after_request
+def record_request_metrics(response):
+    started = g.pop('request_started', None)
+    if started is not None:
+        conn = g.get('db_conn')
+        metrics_registry.observe_request(
+            request.endpoint or 'unmatched', request.method, response.status_code,
+            time.perf_counter() - started, conn.stats if conn is not None else QueryStats())
+    return response
+
+def get_db_pool_stats():
+    stats = {'sqlite': get_sqlite_pool().stats()}
+    if _postgres_pool is not None:
+        stats['postgres'] = _postgres_pool.stats()
+    if _write_queue is not None:
+        stats['write_queue'] = _write_queue.stats()
+    return stats
 
 # データベース初期化
 def init_db():
@@ -132,6 +362,7 @@ def init_db():
                 user_id INTEGER NOT NULL,
                 record_id INTEGER NOT NULL,
                 timestamp DATETIME NOT NULL,
+                folded INTEGER NOT NULL DEFAULT 0,
                 FOREIGN KEY(user_id) REFERENCES users(id),
                 FOREIGN KEY(record_id) REFERENCES records(id)
             )
@@ -139,7 +370,11 @@ def init_db():
             # Add missing columns if needed
             columns = [
                 ('users', 'is_private', 'INTEGER DEFAULT 0'),
-                ('records', 'likes_count', 'INTEGER DEFAULT 0')
+                ('records', 'likes_count', 'INTEGER DEFAULT 0'),
+                ('records', 'local_date', 'TEXT'),
+                ('records', 'deleted_at', 'TEXT'),
+                # likes_count に反映済みのいいね（likes.py）
+                ('likes', 'folded', 'INTEGER NOT NULL DEFAULT 0')
             ]
 
             for table, column, definition in columns:
@@ -148,6 +383,40 @@ def init_db():
                 except sqlite3.OperationalError as e:
                     if 'duplicate column name' not in str(e):
                         raise
+
+            # 日本時間の日付（local_date）を既存の記録に埋める
+            cursor.execute('''
+                UPDATE records SET local_date = DATE(timestamp, '+9 hours')
+                WHERE local_date IS NULL
+            ''')
+
+            # 検索用インデックス
+            cursor.execute('CREATE INDEX IF NOT EXISTS idx_records_user_deleted_date ON records (user_id, is_deleted, local_date)')
+            cursor.execute('CREATE INDEX IF NOT EXISTS idx_records_user_action_date ON records (user_id, action, local_date)')
+            cursor.execute('CREATE INDEX IF NOT EXISTS idx_records_timestamp ON records (timestamp)')
+            # 削除済みの記録だけの部分インデックス（アーカイブの対象探し用）
+            cursor.execute('CREATE INDEX IF NOT EXISTS idx_records_deleted ON records (user_id, timestamp) WHERE is_deleted = 1')
+
+            # いいねの一意制約と likes_count の集計用テーブル
+            create_like_tables(conn)
+
+            # フィードの変更カウンター（ETag 用）
+            create_data_versions(conn)
+
+            # 古い記録・削除済みの記録のアーカイブ
+            archive.create_archive_tables(conn)
+
+            # 睡眠セッションの派生テーブル（新規作成時は既存の記録から作る）
+            sessions_existed = table_exists(conn, 'sleep_sessions')
+            create_sleep_sessions_table(cursor)
+            # 週別・月別の集計テーブル（セッションの追加・削除でトリガーが更新する）
+            rollups_created = rollups.create_rollup_tables(conn)
+            # 睡眠統計のキャッシュのキーに使うユーザーごとの変更カウンター
+            create_user_versions(conn)
+            if not sessions_existed:
+                backfill_sleep_sessions(conn)
+            elif rollups_created:
+                rollups.rebuild_rollups(conn)
             conn.commit()
         except sqlite3.Error as e:
             print(f"Database initialization error: {e}")
@@ -197,177 +466,6 @@ def admin_required(f):
 def jst_now():
     return datetime.now(pytz.timezone('Asia/Tokyo'))
 
-# 睡眠評価関数
-def evaluate_sleep(sleep_duration):
-    """睡眠時間の評価を行う"""
-    optimal_sleep = 7.0  # 適正睡眠時間
-    sleep_ratio = sleep_duration / optimal_sleep
-    
-    if sleep_ratio >= 1.5:
-        return "寝すぎ⁉"
-    elif 1.286 <= sleep_ratio < 1.5:
-        return "ちょい寝すぎか。"
-    elif 1.0 <= sleep_ratio < 1.286:
-        return "良好だよ☻"
-    elif 0.858 <= sleep_ratio < 1.0:
-        return "もう少し寝てほしいかも..."
-    elif 0.50 <= sleep_ratio < 0.858:
-        return "頼むこれ以上は..."
-    else:
-        return "いい加減もっと寝ろよ！！"
-
-# 睡眠時間計算関数
-def calculate_average(sleep_times):
-    """全期間の平均睡眠時間を計算"""
-    if not sleep_times:
-        return {'avg_hours': 0, 'avg_minutes': 0, 'evaluation': None}
-    
-    total_sleep = sum(item['duration'] for item in sleep_times)
-    avg_sleep = total_sleep / len(sleep_times)
-    avg_hours = int(avg_sleep)
-    avg_minutes = int((avg_sleep - avg_hours) * 60)
-    
-    # 循環インポートを避けるため、直接evaluate_sleep関数を使用
-    evaluation = evaluate_sleep(avg_sleep)
-    
-    return {
-        'avg_hours': avg_hours,
-        'avg_minutes': avg_minutes,
-        'avg_duration': avg_sleep,
-        'evaluation': evaluation if len(sleep_times) >= 3 else None
-    }
-
-def calculate_weekly_average(sleep_times):
-    if not sleep_times:
-        return []  # ← ここが大事！
-    # 以下略...
-
-    # 週ごとにグループ化
-    weeks = {}
-    for item in sleep_times:
-        week_key = f"{item['year']}-W{item['week']:02d}"
-        if week_key not in weeks:
-            weeks[week_key] = []
-        weeks[week_key].append(item)
-
-    # 各週の平均を計算
-    weekly_avgs = []
-    for week_key, items in weeks.items():
-        total_sleep = sum(item['duration'] for item in items)
-        avg_sleep = total_sleep / len(items)
-        avg_hours = int(avg_sleep)
-        avg_minutes = int((avg_sleep - avg_hours) * 60)
-
-        year, week = week_key.split('-W')
-        start_date = datetime.strptime(f'{year}-{week}-1', '%Y-%W-%w').date()
-        end_date = start_date + timedelta(days=6)
-
-        weekly_avgs.append({
-            'period': f"{start_date.strftime('%Y/%m/%d')}～{end_date.strftime('%Y/%m/%d')}",
-            'avg_hours': avg_hours,
-            'avg_minutes': avg_minutes,
-            'avg_duration': avg_sleep,
-            'evaluation': evaluate_sleep(avg_sleep),
-            'start_date': start_date,
-            'week_key': week_key,
-            'record_days': len(items)  # ✅ 追加ポイント
-        })
-
-    weekly_avgs.sort(key=lambda x: x['start_date'], reverse=True)
-    return weekly_avgs
-
-def calculate_monthly_average(sleep_times):
-    if not sleep_times:
-        return []  # ← 同様にここも！
-    # 以下略...
-
-    # 月ごとにグループ化
-    months = {}
-    for item in sleep_times:
-        month_key = f"{item['year']}-{item['month']:02d}"
-        if month_key not in months:
-            months[month_key] = []
-        months[month_key].append(item)
-
-    # 各月の平均を計算
-    monthly_avgs = []
-    for month_key, items in months.items():
-        total_sleep = sum(item['duration'] for item in items)
-        avg_sleep = total_sleep / len(items)
-        avg_hours = int(avg_sleep)
-        avg_minutes = int((avg_sleep - avg_hours) * 60)
-
-        year, month = map(int, month_key.split('-'))
-        start_date = datetime(year, month, 1).date()
-
-        monthly_avgs.append({
-            'period': f"{year}年{month}月",
-            'avg_hours': avg_hours,
-            'avg_minutes': avg_minutes,
-            'avg_duration': avg_sleep,
-            'evaluation': evaluate_sleep(avg_sleep),
-            'start_date': start_date,
-            'record_days': len(items)  # ✅ 追加
-        })
-
-    monthly_avgs.sort(key=lambda x: x['start_date'], reverse=True)
-    return monthly_avgs
-
-def calculate_comparisons(sleep_times):
-    """前日比、先週比、先月比を計算"""
-    if not sleep_times:
-        return {
-            'yesterday': {'diff_hours': 0, 'diff_minutes': 0, 'is_increase': False},
-            'last_week': {'diff_hours': 0, 'diff_minutes': 0, 'is_increase': False},
-            'last_month': {'diff_hours': 0, 'diff_minutes': 0, 'is_increase': False}
-        }
-    
-    # 日付でソート
-    sorted_times = sorted(sleep_times, key=lambda x: x['date'], reverse=True)
-    
-    # 現在の日付を取得（sorted_times[0]['date']がすでにdatetime.dateオブジェクト）
-    today = sorted_times[0]['date']
-    
-    # 前日比
-    yesterday_diff = calculate_diff(sorted_times, 0, 1)
-    
-    # 先週比（同じ曜日）
-    last_week_idx = next((i for i, item in enumerate(sorted_times) if (today - item['date']).days >= 7 and today.weekday() == item['date'].weekday()), None)
-    last_week_diff = calculate_diff(sorted_times, 0, last_week_idx) if last_week_idx else {'diff_hours': 0, 'diff_minutes': 0, 'is_increase': False}
-    
-    # 先月比（同じ日）
-    last_month_day = today.day
-    last_month = today.month - 1 if today.month > 1 else 12
-    last_month_year = today.year if today.month > 1 else today.year - 1
-    last_month_idx = next((i for i, item in enumerate(sorted_times) if item['date'].year == last_month_year and item['date'].month == last_month and item['date'].day == last_month_day), None)
-    last_month_diff = calculate_diff(sorted_times, 0, last_month_idx) if last_month_idx else {'diff_hours': 0, 'diff_minutes': 0, 'is_increase': False}
-    
-    return {
-        'yesterday': yesterday_diff,
-        'last_week': last_week_diff,
-        'last_month': last_month_diff
-    }
-
-def calculate_diff(sorted_times, current_idx, compare_idx):
-    """2つの睡眠時間の差分を計算"""
-    if not sorted_times or compare_idx is None or current_idx >= len(sorted_times) or compare_idx >= len(sorted_times):
-        return {'diff_hours': 0, 'diff_minutes': 0, 'is_increase': False}
-    
-    current = sorted_times[current_idx]['duration']
-    compare = sorted_times[compare_idx]['duration']
-    diff = current - compare
-    is_increase = diff > 0
-    
-    diff_abs = abs(diff)
-    diff_hours = int(diff_abs)
-    diff_minutes = int((diff_abs - diff_hours) * 60)
-    
-    return {
-        'diff_hours': diff_hours,
-        'diff_minutes': diff_minutes,
-        'is_increase': is_increase
-    }  # 閉じ括弧を追加
-
 def sort_sleep_graph_data(sleep_data):
     sorted_data = sorted(sleep_data, key=lambda x: x['timestamp'], reverse=True)
     return sorted_data
@@ -395,7 +493,7 @@ def index():
             # 総レコード数を取得
             total_records = conn.execute('''
                 SELECT COUNT(*) FROM records
-                WHERE user_id = ? AND is_deleted = 0 AND DATE(timestamp, '+9 hours') = DATE('now', '+9 hours')
+                WHERE user_id = ? AND is_deleted = 0 AND local_date = DATE('now', '+9 hours')
             ''', (session['user_id'],)).fetchone()[0]
             
             # ページネーション付きでレコードを取得
@@ -405,7 +503,7 @@ def index():
                        strftime('%H:%M:%S', datetime(timestamp, '+9 hours')) as formatted_time,
                        memo, likes_count
                 FROM records
-                WHERE user_id = ? AND is_deleted = 0 AND DATE(timestamp, '+9 hours') = DATE('now', '+9 hours')
+                WHERE user_id = ? AND is_deleted = 0 AND local_date = DATE('now', '+9 hours')
                 ORDER BY timestamp DESC
                 LIMIT ? OFFSET ?
             ''', (session['user_id'], per_page, offset)).fetchall()
@@ -428,31 +526,25 @@ def index():
 def like_record(record_id):
     from_page = request.args.get('from_page', 'index')
     
+    user_id = session['user_id']
+
+    def like(conn):
+        # 一意インデックスで重複を防ぐので、確認と登録は1文で済む
+        if not add_like(conn, user_id, record_id, jst_now()):
+            return False
+        # likes_count への足し込みは間隔を空けてまとめて行う
+        if like_counter.due():
+            fold_like_deltas(conn)
+        else:
+            like_counter.schedule(fold_likes_in_background)
+        return True
+
     try:
-        with get_db_connection() as conn:
-            # すでにいいね済みか確認
-            existing_like = conn.execute(
-                'SELECT id FROM likes WHERE user_id = ? AND record_id = ?',
-                (session['user_id'], record_id)
-            ).fetchone()
-            
-            if existing_like:
-                flash('すでにいいね済みです。', 'info')
-            else:
-                # likesテーブルに新しいいいねを追加
-                conn.execute(
-                    'INSERT INTO likes (user_id, record_id, timestamp) VALUES (?, ?, ?)',
-                    (session['user_id'], record_id, jst_now())
-                )
-                
-                # recordsテーブルのlikes_countを更新
-                conn.execute(
-                    'UPDATE records SET likes_count = likes_count + 1 WHERE id = ?',
-                    (record_id,)
-                )
-                
-                conn.commit()
-                flash('いいねしました！', 'success')
+        if run_write(like):
+            event_broker.publish('like', {'record_id': record_id})
+            flash('いいねしました！', 'success')
+        else:
+            flash('すでにいいね済みです。', 'info')
     except sqlite3.Error as e:
         flash(f'エラーが発生しました: {e}', 'error')
     
@@ -464,6 +556,13 @@ def like_record(record_id):
     else:
         return redirect(url_for('index'))
 
+def fold_likes_in_background():
+    try:
+        with app.app_context():
+            run_write(fold_like_deltas)
+    except sqlite3.Error as e:
+        app.logger.error(f'いいね数の反映に失敗しました: {e}')
+
 @app.route('/calendar', methods=['GET'])
 @login_required
 def calendar_view():
@@ -495,6 +594,126 @@ def generate_calendar(year, month):
     cal = calendar.monthcalendar(year, month)
     return cal
 
+def build_calendar_month(conn, user_id, year, month):
+    """/api/calendar の応答データを作る（1か月分を1回のクエリで集計）"""
+    first_day = datetime(year, month, 1).date()
+    last_day = first_day.replace(day=calendar.monthrange(year, month)[1])
+    # wake_ts は日本時間以外のオフセットもありうるので前後1日広げて絞り、local_date で確定させる
+    range_start = (first_day - timedelta(days=1)).isoformat()
+    range_end = (last_day + timedelta(days=2)).isoformat()
+    rows = conn.execute('''
+        WITH day_records AS (
+            SELECT local_date,
+                COUNT(*) AS record_count,
+                SUM(action = 'sleep') AS sleep_count,
+                SUM(action = 'wake_up') AS wake_count
+            FROM records
+            WHERE user_id = ? AND is_deleted = 0 AND local_date BETWEEN ? AND ?
+            GROUP BY local_date
+        ),
+        day_sessions AS (
+            SELECT local_date,
+                COUNT(*) AS session_count,
+                SUM(duration_seconds) AS duration_seconds
+            FROM sleep_sessions
+            WHERE user_id = ? AND wake_ts >= ? AND wake_ts < ?
+            AND local_date BETWEEN ? AND ?
+            GROUP BY local_date
+        )
+        SELECT days.local_date,
+            COALESCE(day_records.record_count, 0) AS record_count,
+            COALESCE(day_records.sleep_count, 0) AS sleep_count,
+            COALESCE(day_records.wake_count, 0) AS wake_count,
+            COALESCE(day_sessions.session_count, 0) AS session_count,
+            day_sessions.duration_seconds
+        FROM (SELECT local_date FROM day_records UNION SELECT local_date FROM day_sessions) AS days
+        LEFT JOIN day_records ON day_records.local_date = days.local_date
+        LEFT JOIN day_sessions ON day_sessions.local_date = days.local_date
+        ORDER BY days.local_date
+    ''', (user_id, first_day.isoformat(), last_day.isoformat(),
+          user_id, range_start, range_end, first_day.isoformat(), last_day.isoformat())).fetchall()
+
+    days = []
+    for row in rows:
+        day = {
+            'date': row['local_date'],
+            'record_count': row['record_count'],
+            'sleep_count': row['sleep_count'],
+            'wake_count': row['wake_count'],
+            'session_count': row['session_count'],
+            'duration': None,
+            'hours': None,
+            'minutes': None,
+            'evaluation': None
+        }
+        if row['duration_seconds'] is not None:
+            sleep_duration = row['duration_seconds'] / 3600
+            day.update({
+                'duration': sleep_duration,
+                'hours': int(sleep_duration),
+                'minutes': int((sleep_duration - int(sleep_duration)) * 60),
+                'evaluation': evaluate_sleep(sleep_duration)
+            })
+        days.append(day)
+    return {'year': year, 'month': month, 'days': days}
+
+@app.route('/api/calendar')
+@login_required
+def api_calendar():
+    """1か月分の日ごとの睡眠時間・評価・記録数を返す"""
+    now = datetime.now(pytz.timezone('Asia/Tokyo'))
+    year = request.args.get('year', now.year, type=int)
+    month = request.args.get('month', now.month, type=int)
+    if not (1 <= month <= 12 and 1900 <= year <= 9999):
+        return jsonify({'error': 'year と month が不正です。'}), 400
+
+    user_id = session['user_id']
+    conn = get_db_connection()
+    data = stats_cache.get_or_compute(
+        user_id, f'calendar:{year:04d}-{month:02d}',
+        lambda: build_calendar_month(conn, user_id, year, month))
+
+    # 内容が変わらない限り同じ ETag になるので、再読み込みは 304 で済む
+    response = jsonify(data)
+    response.add_etag()
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response.make_conditional(request)
+
+COMPARISON_MAX_WINDOWS = 5
+COMPARISON_MAX_DAYS = 366
+
+@app.route('/api/sleep_comparisons')
+@login_required
+def sleep_comparisons():
+    """前日比・先週比・先月比・前年同日比と、N日間の移動平均の比較を返す
+
+    windows: 移動平均の日数（カンマ区切り、既定は 7,30）
+    date: 基準日（YYYY-MM-DD、この日以前で最新の記録の日を基準にする。既定は最新の記録の日）
+    series: 基準日までの何日分の移動平均の推移を返すか（既定は 0 = 返さない）
+    """
+    windows = request.args.get('windows', '7,30').split(',')
+    if not (1 <= len(windows) <= COMPARISON_MAX_WINDOWS
+            and all(w.isdigit() and 1 <= int(w) <= COMPARISON_MAX_DAYS for w in windows)):
+        return jsonify({'error': f'windows は 1～{COMPARISON_MAX_DAYS} の整数を'
+                                 f'{COMPARISON_MAX_WINDOWS}個までカンマ区切りで指定してください。'}), 400
+    today = None
+    if request.args.get('date'):
+        try:
+            today = datetime.strptime(request.args['date'], '%Y-%m-%d').date().toordinal()
+        except ValueError:
+            return jsonify({'error': 'date は YYYY-MM-DD 形式で指定してください。'}), 400
+    series = request.args.get('series', '0')
+    if not series.isdigit() or int(series) > COMPARISON_MAX_DAYS:
+        return jsonify({'error': f'series は 0～{COMPARISON_MAX_DAYS} の整数で指定してください。'}), 400
+
+    user_id = session['user_id']
+    conn = get_db_connection()
+    # 索引は記録が変わるまで使い回す（比較の日付・期間を変えても作り直さない）
+    index = stats_cache.get_or_compute(
+        user_id, 'sleep_index',
+        lambda: SleepIndex.from_columns(aggregation.load_session_columns(conn, user_id)).prepare())
+    return jsonify(build_comparisons(index, [int(w) for w in windows], today, int(series)))
+
 @app.route('/login', methods=['GET', 'POST'])
 def login():
     if request.method == 'POST':
@@ -539,20 +758,22 @@ def register():
             flash('ユーザー名とパスワードを入力してください。', 'error')
             return render_template('register.html')
             
-        with get_db_connection() as conn:
+        def add_user(conn):
+            # 確認と登録を同じ書き込みの中で行う
             existing_user = conn.execute(
                 'SELECT id FROM users WHERE username = ?', (username,)
             ).fetchone()
-            
             if existing_user:
-                flash('このユーザー名は既に使用されています。', 'error')
-                return render_template('register.html')
-                
+                return False
             conn.execute(
                 'INSERT INTO users (username, password, is_private) VALUES (?, ?, ?)',
                 (username, hash_password(password), int(is_private))
             )
-            conn.commit()
+            return True
+
+        if not run_write(add_user):
+            flash('このユーザー名は既に使用されています。', 'error')
+            return render_template('register.html')
             
         flash('登録しました！', 'success')
         return redirect(url_for('login'))
@@ -571,21 +792,15 @@ def reset_password():
         username = request.form.get('username').strip()
         new_password = request.form.get('new_password')
         
-        with get_db_connection() as conn:
-            user = conn.execute(
-                'SELECT * FROM users WHERE username = ?', (username,)
-            ).fetchone()
-            
-            if user:
-                conn.execute(
-                    'UPDATE users SET password = ? WHERE username = ?',
-                    (hash_password(new_password), username)
-                )
-                conn.commit()
-                flash('パスワードが更新されました。ログインしてください。', 'success')
-                return redirect(url_for('login'))
-            else:
-                flash('指定されたユーザー名が見つかりませんでした。', 'error')
+        updated = run_write(lambda conn: conn.execute(
+            'UPDATE users SET password = ? WHERE username = ?',
+            (hash_password(new_password), username)
+        ).rowcount)
+        if updated:
+            flash('パスワードが更新されました。ログインしてください。', 'success')
+            return redirect(url_for('login'))
+        else:
+            flash('指定されたユーザー名が見つかりませんでした。', 'error')
                 
     return render_template('reset_password.html')
 
@@ -610,31 +825,37 @@ def record():
         # 日本時間のタイムスタンプを明示的に生成
         timestamp = datetime.now(pytz.timezone('Asia/Tokyo'))
         
-        with get_db_connection() as conn:
-            # 同じ日に同じアクションの記録があるかチェック
+        user_id = session['user_id']
+
+        def add_record(conn):
+            # 同じ日に同じアクションの記録があるかチェック（確認と挿入を同じトランザクションで行う）
             existing_record = conn.execute('''
                 SELECT * FROM records
-                WHERE user_id = ? AND action = ? AND DATE(timestamp, '+9 hours') = DATE(?, '+9 hours')
+                WHERE user_id = ? AND action = ? AND local_date = DATE(?, '+9 hours')
                 AND is_deleted = 0
-            ''', (session['user_id'], action, timestamp.isoformat())).fetchone()
-
+            ''', (user_id, action, timestamp.isoformat())).fetchone()
             if existing_record:
-                flash('既に本日分は登録されています', 'warning')
-                return redirect(url_for('index'))
+                return None
 
-            conn.execute('BEGIN TRANSACTION')
             # レコード挿入
-            conn.execute(
+            cursor = conn.execute(
                 '''INSERT INTO records
-                (user_id, action, timestamp, memo)
-                VALUES (?, ?, ?, ?)''',
-                (session['user_id'], action, timestamp.isoformat(), memo)
+                (user_id, action, timestamp, memo, local_date)
+                VALUES (?, ?, ?, ?, DATE(?, '+9 hours'))''',
+                (user_id, action, timestamp.isoformat(), memo, timestamp.isoformat())
             )
-            # トランザクションコミット
-            conn.commit()
-            flash('記録が正常に保存されました', 'success')
+            # 睡眠セッションを更新
+            refresh_user_sessions(conn, user_id, timestamp.isoformat())
+            return cursor.lastrowid
+
+        record_id = run_write(add_record)
+        if record_id is None:
+            flash('既に本日分は登録されています', 'warning')
+            return redirect(url_for('index'))
+        stats_cache.invalidate_user(user_id)
+        publish_record_event(record_id)
+        flash('記録が正常に保存されました', 'success')
     except sqlite3.Error as e:
-        conn.rollback()
         error_message = f'データベースエラー: {str(e)}'
         app.logger.error(error_message)
         flash(error_message, 'danger')
@@ -653,89 +874,32 @@ def average_sleep():
         period = request.args.get('period', 'daily')
 
         with get_db_connection() as conn:
-            data = conn.execute('''
-                SELECT date(timestamp, '+9 hours') as date,
-                       action,
-                       timestamp
-                FROM records
-                WHERE user_id = ? AND is_deleted = 0
-                      AND (action = 'sleep' OR action = 'wake_up')
-                ORDER BY timestamp
-            ''', (session['user_id'],)).fetchall()
-
-            if not data:
-                return render_template(
-                    'average_sleep.html',
-                    sleep_times=[],
-                    daily_avg=None,
-                    weekly_avg=None,
-                    monthly_avg=None,
-                    overall_avg=None,
-                    comparisons=None,
-                    period=period,
-                    evaluate_sleep=evaluate_sleep,
-                    round_decimal=round_decimal  # round_decimal関数を渡す
-                )
-
-            # 睡眠時間を計算
-            sleep_times = []
-            sleep_start = None
-
-            for row in data:
-                if row['action'] == 'sleep':
-                    sleep_start = datetime.fromisoformat(row['timestamp'])
-                elif row['action'] == 'wake_up' and sleep_start:
-                    wake_time = datetime.fromisoformat(row['timestamp'])
-                    sleep_duration = (wake_time - sleep_start).total_seconds() / 3600  # 時間単位
-
-                    # 時間と分に分割
-                    sleep_hours = int(sleep_duration)
-                    sleep_minutes = int((sleep_duration - sleep_hours) * 60)
-
-                    sleep_date = datetime.fromisoformat(row['timestamp']).date()
-                    sleep_times.append({
-                        'date': sleep_date,
-                        'duration': sleep_duration,
-                        'hours': sleep_hours,
-                        'minutes': sleep_minutes,
-                        'week': sleep_date.isocalendar()[1],  # ISO週番号
-                        'month': sleep_date.month,
-                        'year': sleep_date.year
-                    })
-
-                    sleep_start = None
-
-            # 各種平均値と比較値を計算
-            daily_avg = calculate_average(sleep_times)
-            overall_avg = calculate_overall_average(sleep_times)
-            weekly_avg = calculate_weekly_average(sleep_times)
-            monthly_avg = calculate_monthly_average(sleep_times)
-            comparisons = calculate_comparisons(sleep_times)
-
-            # 降順にソート
-            sleep_times.sort(key=lambda x: x['date'], reverse=True)
+            user_id = session['user_id']
+            stats = stats_cache.get_or_compute(
+                user_id, 'average_sleep', lambda: compute_sleep_statistics(conn, user_id))
 
+        if not stats:
             return render_template(
                 'average_sleep.html',
-                daily_avg=daily_avg,
-                weekly_avg=weekly_avg,
-                monthly_avg=monthly_avg,
-                overall_avg=overall_avg,
-                comparisons=comparisons,
-                sleep_times=sleep_times,
+                sleep_times=[],
+                daily_avg=None,
+                weekly_avg=None,
+                monthly_avg=None,
+                overall_avg=None,
+                comparisons=None,
                 period=period,
                 evaluate_sleep=evaluate_sleep,
                 round_decimal=round_decimal  # round_decimal関数を渡す
             )
-        
+
         return render_template(
             'average_sleep.html',
-            sleep_times=[],
-            daily_avg=None,
-            weekly_avg=None,
-            monthly_avg=None,
-            overall_avg=None,
-            comparisons=None,
+            daily_avg=stats['daily_avg'],
+            weekly_avg=stats['weekly_avg'],
+            monthly_avg=stats['monthly_avg'],
+            overall_avg=stats['overall_avg'],
+            comparisons=stats['comparisons'],
+            sleep_times=stats['sleep_times'],
             period=period,
             evaluate_sleep=evaluate_sleep,
             round_decimal=round_decimal  # round_decimal関数を渡す
@@ -745,186 +909,27 @@ def average_sleep():
         flash("データの取得に失敗しました。再度お試しください。", "danger")
         return redirect(url_for('index'))
     
-    
-def calculate_overall_average(sleep_times):
-    """全ての記録の平均睡眠時間を計算"""
-    if not sleep_times:
-        return {'avg_hours': 0, 'avg_minutes': 0, 'evaluation': "データなし"}
-    
-    total_sleep = sum(item['duration'] for item in sleep_times)
-    avg_sleep = total_sleep / len(sleep_times)
-    avg_hours = int(avg_sleep)
-    avg_minutes = int((avg_sleep - avg_hours) * 60)
-    evaluation = evaluate_sleep(avg_sleep) if len(sleep_times) >= 3 else "評価不可"
-    
-    return {
-        'avg_hours': avg_hours,
-        'avg_minutes': avg_minutes,
-        'avg_duration': avg_sleep,
-        'evaluation': evaluation
-    }
-
-def calculate_weekly_average(sleep_times):
-    if not sleep_times:
-        return []  # ← ここが大事！
-    # 以下略...
-
-    # 週ごとにグループ化
-    weeks = {}
-    for item in sleep_times:
-        week_key = f"{item['year']}-W{item['week']:02d}"
-        if week_key not in weeks:
-            weeks[week_key] = []
-        weeks[week_key].append(item)
-
-    # 各週の平均を計算
-    weekly_avgs = []
-    for week_key, items in weeks.items():
-        total_sleep = sum(item['duration'] for item in items)
-        avg_sleep = total_sleep / len(items)
-        avg_hours = int(avg_sleep)
-        avg_minutes = int((avg_sleep - avg_hours) * 60)
-
-        year, week = week_key.split('-W')
-        start_date = datetime.strptime(f'{year}-{week}-1', '%Y-%W-%w').date()
-        end_date = start_date + timedelta(days=6)
-
-        weekly_avgs.append({
-            'period': f"{start_date.strftime('%Y/%m/%d')}～{end_date.strftime('%Y/%m/%d')}",
-            'avg_hours': avg_hours,
-            'avg_minutes': avg_minutes,
-            'avg_duration': avg_sleep,
-            'evaluation': evaluate_sleep(avg_sleep),
-            'start_date': start_date,
-            'week_key': week_key,
-            'record_days': len(items)  # ✅ 追加ポイント
-        })
-
-    weekly_avgs.sort(key=lambda x: x['start_date'], reverse=True)
-    return weekly_avgs
-
-def calculate_monthly_average(sleep_times):
-    if not sleep_times:
-        return []  # ← 同様にここも！
-    # 以下略...
-
-    # 月ごとにグループ化
-    months = {}
-    for item in sleep_times:
-        month_key = f"{item['year']}-{item['month']:02d}"
-        if month_key not in months:
-            months[month_key] = []
-        months[month_key].append(item)
-
-    # 各月の平均を計算
-    monthly_avgs = []
-    for month_key, items in months.items():
-        total_sleep = sum(item['duration'] for item in items)
-        avg_sleep = total_sleep / len(items)
-        avg_hours = int(avg_sleep)
-        avg_minutes = int((avg_sleep - avg_hours) * 60)
-
-        year, month = map(int, month_key.split('-'))
-        start_date = datetime(year, month, 1).date()
-
-        monthly_avgs.append({
-            'period': f"{year}年{month}月",
-            'avg_hours': avg_hours,
-            'avg_minutes': avg_minutes,
-            'avg_duration': avg_sleep,
-            'evaluation': evaluate_sleep(avg_sleep),
-            'start_date': start_date,
-            'record_days': len(items)  # ✅ 追加
-        })
-
-    monthly_avgs.sort(key=lambda x: x['start_date'], reverse=True)
-    return monthly_avgs
-
-def calculate_comparisons(sleep_times):
-    """前日比、先週比、先月比を計算"""
-    if not sleep_times:
-        return {
-            'yesterday': {'diff_hours': 0, 'diff_minutes': 0, 'is_increase': False},
-            'last_week': {'diff_hours': 0, 'diff_minutes': 0, 'is_increase': False},
-            'last_month': {'diff_hours': 0, 'diff_minutes': 0, 'is_increase': False}
-        }
-    
-    # 日付でソート
-    sorted_times = sorted(sleep_times, key=lambda x: x['date'], reverse=True)
-    
-    # 現在の日付を取得（sorted_times[0]['date']がすでにdatetime.dateオブジェクト）
-    today = sorted_times[0]['date']
-    
-    # 前日比
-    yesterday_diff = calculate_diff(sorted_times, 0, 1)
-    
-    # 先週比（同じ曜日）
-    last_week_idx = next((i for i, item in enumerate(sorted_times) if (today - item['date']).days >= 7 and today.weekday() == item['date'].weekday()), None)
-    last_week_diff = calculate_diff(sorted_times, 0, last_week_idx) if last_week_idx else {'diff_hours': 0, 'diff_minutes': 0, 'is_increase': False}
-    
-    # 先月比（同じ日）
-    last_month_day = today.day
-    last_month = today.month - 1 if today.month > 1 else 12
-    last_month_year = today.year if today.month > 1 else today.year - 1
-    last_month_idx = next((i for i, item in enumerate(sorted_times) if item['date'].year == last_month_year and item['date'].month == last_month and item['date'].day == last_month_day), None)
-    last_month_diff = calculate_diff(sorted_times, 0, last_month_idx) if last_month_idx else {'diff_hours': 0, 'diff_minutes': 0, 'is_increase': False}
-    
-    return {
-        'yesterday': yesterday_diff,
-        'last_week': last_week_diff,
-        'last_month': last_month_diff
-    }
-
-def calculate_diff(sorted_times, current_idx, compare_idx):
-    """2つの睡眠時間の差分を計算"""
-    if not sorted_times or compare_idx is None or current_idx >= len(sorted_times) or compare_idx >= len(sorted_times):
-        return {'diff_hours': 0, 'diff_minutes': 0, 'is_increase': False}
-    
-    current = sorted_times[current_idx]['duration']
-    compare = sorted_times[compare_idx]['duration']
-    diff = current - compare
-    is_increase = diff > 0
-    
-    diff_abs = abs(diff)
-    diff_hours = int(diff_abs)
-    diff_minutes = int((diff_abs - diff_hours) * 60)
-    
-    return {
-        'diff_hours': diff_hours,
-        'diff_minutes': diff_minutes,
-        'is_increase': is_increase
+def compute_sleep_statistics(conn, user_id):
+    """average_sleep 用の統計をまとめて計算する。記録がなければ None"""
+    # 睡眠時間は sleep_sessions に計算済み（列データとして読み込む）
+    columns = aggregation.load_session_columns(conn, user_id)
+    if not len(columns):
+        return None
+
+    # 各種平均値と比較値を計算（週別・月別は集計テーブルから読む）
+    stats = {
+        'daily_avg': aggregation.average(columns, evaluate_sleep),
+        'overall_avg': aggregation.overall_average(columns, evaluate_sleep),
+        'weekly_avg': rollups.weekly_averages(conn, user_id, evaluate_sleep),
+        'monthly_avg': rollups.monthly_averages(conn, user_id, evaluate_sleep),
+        'comparisons': aggregation.comparisons(columns)
     }
 
-def evaluate_sleep(sleep_duration):
-    """睡眠時間の評価を行う"""
-    optimal_sleep = 7.0  # 適正睡眠時間
-    sleep_ratio = sleep_duration / optimal_sleep
-    
-    if sleep_ratio >= 1.5:
-        return "寝すぎ⁉"
-    elif 1.286 <= sleep_ratio < 1.5:
-        return "ちょい寝すぎか。"
-    elif 1.0 <= sleep_ratio < 1.286:
-        return "良好だよ☻"
-    elif 0.858 <= sleep_ratio < 1.0:
-        return "もう少し寝てほしいかも..."
-    elif 0.50 <= sleep_ratio < 0.858:
-        return "頼むこれ以上は..."
-    else:
-        return "いい加減もっと寝ろよ！！"
-    
-def revise_previous_day_comparison(sleep_times):
-    comparisons = []
-    for i in range(len(sleep_times)):
-        if i == 0:
-            comparisons.append("-")
-        else:
-            diff = sleep_times[i]['duration'] - sleep_times[i-1]['duration']
-            diff_hours = int(abs(diff))
-            diff_minutes = int((abs(diff) - diff_hours) * 60)
-            comparison = f"{'+' if diff > 0 else '-'}{diff_hours}時間{diff_minutes}分"
-            comparisons.append(comparison)
-    return comparisons
+    # 降順にソート
+    sleep_times = columns.to_sleep_times()
+    sleep_times.sort(key=lambda x: x['date'], reverse=True)
+    stats['sleep_times'] = sleep_times
+    return stats
 
 # カレンダーの日付クリック時に「今日の評価」と当日の睡眠時間表示
 @app.route('/day_records/<date>')  # パラメータを明示的に指定
@@ -937,6 +942,9 @@ def day_records(date):  # パラメータを受け取る
         # 年と月の情報を取得して保持
         year = parsed_date.year
         month = parsed_date.month
+        # timestamp の日付部分はタイムゾーンにより前後1日ずれ得るので、その範囲で絞り込む
+        range_start = (parsed_date - timedelta(days=1)).isoformat()
+        range_end = (parsed_date + timedelta(days=2)).isoformat()
     except ValueError:
         flash('無効な日付形式です', 'error')
         return redirect(url_for('calendar_view'))
@@ -954,17 +962,18 @@ def day_records(date):  # パラメータを受け取る
                     strftime('%Y-%m-%d %H:%M:%S', datetime(r.timestamp, '+9 hours')) as formatted_time
                     FROM records r
                     JOIN users u ON r.user_id = u.id
-                    WHERE DATE(r.timestamp, '+9 hours') = ?
+                    WHERE r.timestamp >= ? AND r.timestamp < ?
+                    AND r.local_date = ?
                     ORDER BY r.timestamp ASC
-                ''', (date,)).fetchall()
+                ''', (range_start, range_end, date)).fetchall()
             else:
                 records = conn.execute('''
                     SELECT id, action, memo, is_deleted, likes_count,
                     strftime('%Y-%m-%d %H:%M:%S', datetime(timestamp, '+9 hours')) as formatted_time
                     FROM records
                     WHERE user_id = ?
-                    AND DATE(timestamp, '+9 hours') = ?
                     AND is_deleted = 0
+                    AND local_date = ?
                     ORDER BY timestamp ASC
                 ''', (session['user_id'], date)).fetchall()
             
@@ -973,9 +982,9 @@ def day_records(date):  # パラメータを受け取る
                 SELECT action, timestamp
                 FROM records
                 WHERE user_id = ? 
-                AND DATE(timestamp, '+9 hours') = ?
-                AND (action = 'sleep' OR action = 'wake_up')
                 AND is_deleted = 0
+                AND local_date = ?
+                AND (action = 'sleep' OR action = 'wake_up')
                 ORDER BY timestamp
             ''', (session['user_id'], date)).fetchall()
             
@@ -1031,12 +1040,53 @@ def day_records(date):  # パラメータを受け取る
             flash(f'データベースエラー: {str(e)}', 'error')
             return redirect(url_for('calendar_view'))
         
+@app.errorhandler(InvalidCursorError)
+def handle_invalid_cursor(e):
+    # 一覧・フィードの ?cursor= が読み取れない場合は先頭ページに戻さず 400 にする
+    return jsonify({'error': str(e)}), 400
+
+def fetch_feed_page(conn, viewer_id, user_filter, cursor, per_page):
+    """公開フィード（非公開ユーザーと admin を除く）の1ページを取得する
+
+    (records, next_cursor, prev_cursor, total_records) を返す。
+    """
+    # クエリ条件を構築（adminユーザーも除外）
+    query_conditions = "records.is_deleted=0 AND users.is_private=0 AND users.username != 'admin'"
+    query_params = []
+
+    if user_filter != "all" and user_filter.isdigit():
+        query_conditions += " AND records.user_id=?"
+        query_params.append(int(user_filter))
+
+    # 総レコード数を取得（キャッシュ）
+    count_query = f"SELECT COUNT(*) FROM records JOIN users ON records.user_id=users.id WHERE {query_conditions}"
+    total_records = record_count_cache.get(conn, count_query, query_params)
+
+    # レコードを取得（カーソル方式）
+    # いいね済みかどうかは表示する行の分だけ likes の一意インデックスで確認する
+    records_query = """
+        SELECT users.username, users.id as user_id, records.id, records.action,
+            records.timestamp,
+            strftime('%Y-%m-%d', datetime(records.timestamp, '+9 hours')) as formatted_date,
+            strftime('%H:%M:%S', datetime(records.timestamp, '+9 hours')) as formatted_time,
+            records.memo, records.likes_count,
+            EXISTS (
+                SELECT 1 FROM likes WHERE likes.user_id = ? AND likes.record_id = records.id
+            ) as liked,
+            records.timestamp as cursor_ts, records.id as cursor_id
+        FROM records JOIN users ON records.user_id=users.id"""
+
+    records, next_cursor, prev_cursor = fetch_keyset_page(
+        conn, records_query, query_conditions, [viewer_id] + query_params,
+        cursor, per_page, timestamp_column='records.timestamp', id_column='records.id'
+    )
+    return records, next_cursor, prev_cursor, total_records
+
 @app.route('/all_records')
 @login_required
 def all_records():
-    page = request.args.get("page", 1, type=int)
+    cursor = request.args.get("cursor")
     per_page = 20
-    offset = (page - 1) * per_page
     user_filter = request.args.get("user_id", "all")
 
     with get_db_connection() as conn:
@@ -1045,35 +1095,9 @@ def all_records():
             "SELECT id, username FROM users WHERE is_admin = 0 AND is_private = 0 ORDER BY username"
         ).fetchall()
 
-        # クエリ条件を構築（adminユーザーも除外）
-        query_conditions = "records.is_deleted=0 AND users.is_private=0 AND users.username != 'admin'"
-        query_params = []
-
-        if user_filter != "all" and user_filter.isdigit():
-            query_conditions += " AND records.user_id=?"
-            query_params.append(int(user_filter))
-
-        # 総レコード数を取得
-        count_query = f"SELECT COUNT(*) FROM records JOIN users ON records.user_id=users.id WHERE {query_conditions}"
-        total_records = conn.execute(count_query, query_params).fetchone()[0]
-
-        # レコードを取得
-        records_query = f"""
-            SELECT users.username, users.id as user_id, records.id, records.action,
-                strftime('%Y-%m-%d', datetime(records.timestamp, '+9 hours')) as formatted_date,
-                strftime('%H:%M:%S', datetime(records.timestamp, '+9 hours')) as formatted_time,
-                records.memo, records.likes_count
-            FROM records JOIN users ON records.user_id=users.id
-            WHERE {query_conditions}
-            ORDER BY records.timestamp DESC LIMIT ? OFFSET ?"""
-
-        records = conn.execute(records_query, query_params + [per_page, offset]).fetchall()
-
-        # いいね情報を取得
-        liked_ids = [row["record_id"] for row in conn.execute(
-            "SELECT record_id FROM likes WHERE user_id=?",
-            (session["user_id"],)
-        ).fetchall()]
+        records, next_cursor, prev_cursor, total_records = fetch_feed_page(
+            conn, session["user_id"], user_filter, cursor, per_page
+        )
 
         formatted_records = []
         for record in records:
@@ -1086,17 +1110,121 @@ def all_records():
                 "memo": record["memo"],
                 "likes_count": record["likes_count"],
                 "id": record["id"],
-                "liked": record["id"] in liked_ids
+                "liked": bool(record["liked"])
             })
 
-        total_pages = (total_records + per_page - 1) // per_page
-
         return render_template("all_records.html",
                               records=formatted_records,
                               users=users,
                               current_user=user_filter,
-                              page=page,
-                              total_pages=total_pages)
+                              cursor=cursor,
+                              next_cursor=next_cursor,
+                              prev_cursor=prev_cursor,
+                              total_records=total_records)
+
+@app.route('/api/feed')
+@login_required
+def api_feed():
+    """公開フィードの JSON 版（ETag が一致すれば 304 を返す）"""
+    cursor = request.args.get("cursor") or ""
+    user_filter = request.args.get("user_id", "all")
+    per_page = min(max(request.args.get("limit", 20, type=int), 1), 100)
+    viewer_id = session["user_id"]
+
+    conn = get_db_connection()
+    # いいね済みの表示は見る人ごとに違うので、ユーザーIDも ETag に含める
+    etag_source = f"{get_version(conn)}:{viewer_id}:{user_filter}:{cursor}:{per_page}"
+    etag = hashlib.sha256(etag_source.encode('utf-8')).hexdigest()[:32]
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = 'private, no-cache'
+        return response
+
+    records, next_cursor, prev_cursor, total_records = fetch_feed_page(
+        conn, viewer_id, user_filter, cursor or None, per_page
+    )
+    response = jsonify({
+        "records": [{
+            "id": record["id"],
+            "user_id": record["user_id"],
+            "username": record["username"],
+            "action": record["action"],
+            "timestamp": record["timestamp"],
+            "memo": record["memo"],
+            "likes_count": record["likes_count"],
+            "liked": bool(record["liked"])
+        } for record in records],
+        "next_cursor": next_cursor,
+        "prev_cursor": prev_cursor,
+        "total": total_records
+    })
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+def publish_record_event(record_id):
+    """新しい記録が公開フィードに載るものなら購読者に配る"""
+    record = get_db_connection().execute('''
+        SELECT records.id, records.user_id, users.username, records.action,
+            records.timestamp, records.memo, records.likes_count
+        FROM records JOIN users ON records.user_id = users.id
+        WHERE records.id = ? AND records.is_deleted = 0
+        AND users.is_private = 0 AND users.username != 'admin'
+    ''', (record_id,)).fetchone()
+    if record:
+        event_broker.publish('record', dict(record))
+
+def current_feed_version():
+    # ストリームの間ずっと接続を借りたままにしないよう、確認のたびに新しいアプリケーション
+    # コンテキストで借り、抜けるときに teardown_appcontext で返す
+    with app.app_context():
+        return get_version(get_db_connection())
+
+@app.route('/api/stream')
+@login_required
+def api_stream():
+    """フィードの更新を Server-Sent Events で送る
+
+    イベントは record / like / delete。他のワーカーでの書き込みや
+    バッファ溢れで取りこぼした可能性があるときは resync を送るので、
+    クライアントは /api/feed を取り直す。
+    """
+    last_event_id = request.headers.get('Last-Event-ID')
+    subscription = event_broker.subscribe(last_event_id)
+    if subscription is None:
+        return jsonify({'error': '接続数が上限に達しています'}), 503
+    heartbeat = STREAM_HEARTBEAT
+
+    def generate():
+        try:
+            version = current_feed_version()
+            yield 'retry: 5000\n\n'
+            while True:
+                events, overflowed = subscription.get(timeout=heartbeat)
+                if subscription.closed:
+                    return
+                if overflowed:
+                    yield format_sse('resync', {})
+                for event in events:
+                    yield format_sse(event['type'], event['data'], event['id'])
+                if events:
+                    version = current_feed_version()
+                    continue
+                # 何も届かなかった間に他のワーカーで変更があれば取り直してもらう
+                latest = current_feed_version()
+                if latest != version:
+                    version = latest
+                    yield format_sse('resync', {})
+                else:
+                    yield ': keepalive\n\n'
+        finally:
+            subscription.close()
+
+    return Response(generate(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
 
 @app.route('/toggle_privacy', methods=['POST'])
 @login_required
@@ -1107,12 +1235,11 @@ def toggle_privacy():
     is_private = request.form.get('is_private') == 'on'
     
     try:
-        with get_db_connection() as conn:
-            conn.execute(
-                'UPDATE users SET is_private = ? WHERE id = ?',
-                (int(is_private), session['user_id'])
-            )
-            conn.commit()
+        user_id = session['user_id']
+        run_write(lambda conn: conn.execute(
+            'UPDATE users SET is_private = ? WHERE id = ?',
+            (int(is_private), user_id)
+        ))
             
         # セッションの値も更新
         session['is_private'] = is_private
@@ -1135,41 +1262,49 @@ def delete_record(record_id):  # パラメータを受け取る
         # リダイレクト先を取得（デフォルトはday_records）
         redirect_to = request.form.get('redirect_to', 'day_records')
         
-        with get_db_connection() as conn:
+        user_id = session['user_id']
+
+        def soft_delete(conn):
             # 記録が自分のものかチェック
             record = conn.execute('''
                 SELECT * FROM records
                 WHERE id = ? AND user_id = ?
-            ''', (record_id, session['user_id'])).fetchone()
-            
+            ''', (record_id, user_id)).fetchone()
             if not record:
-                flash('記録が見つからないか、削除権限がありません。', 'error')
-                return redirect(url_for('index'))
-            
-            # 記録の日付を取得
-            record_date = datetime.fromisoformat(record['timestamp']).date()
-            
+                return None
+
             # 記録を論理削除
             conn.execute('''
                 UPDATE records
-                SET is_deleted = 1
+                SET is_deleted = 1, deleted_at = ?
                 WHERE id = ? AND user_id = ?
-            ''', (record_id, session['user_id']))
-            conn.commit()
-            
-            flash('記録が削除されました。', 'success')
-            
-            # リダイレクト先の判断
-            if redirect_to == 'index':
-                return redirect(url_for('index'))
-            elif redirect_to == 'all_records':
-                # ページ番号とユーザーフィルターを保持
-                page = request.form.get('page', 1)
-                user_filter = request.form.get('user_filter', 'all')
-                return redirect(url_for('all_records', page=page, user_id=user_filter))
-            else:
-                return redirect(url_for('day_records', date=record_date.strftime('%Y-%m-%d')))
-                
+            ''', (jst_now().isoformat(), record_id, user_id))
+            refresh_user_sessions(conn, user_id, record['timestamp'])
+            return record['timestamp']
+
+        deleted_timestamp = run_write(soft_delete)
+        if deleted_timestamp is None:
+            flash('記録が見つからないか、削除権限がありません。', 'error')
+            return redirect(url_for('index'))
+        stats_cache.invalidate_user(user_id)
+        event_broker.publish('delete', {'id': record_id})
+
+        # 記録の日付を取得
+        record_date = datetime.fromisoformat(deleted_timestamp).date()
+
+        flash('記録が削除されました。', 'success')
+
+        # リダイレクト先の判断
+        if redirect_to == 'index':
+            return redirect(url_for('index'))
+        elif redirect_to == 'all_records':
+            # 表示中のページとユーザーフィルターを保持
+            cursor = request.form.get('cursor') or None
+            user_filter = request.form.get('user_filter', 'all')
+            return redirect(url_for('all_records', cursor=cursor, user_id=user_filter))
+        else:
+            return redirect(url_for('day_records', date=record_date.strftime('%Y-%m-%d')))
+
     except sqlite3.Error as e:
         flash(f'記録の削除中にエラーが発生しました: {e}', 'error')
         return redirect(url_for('index'))
@@ -1178,9 +1313,8 @@ def delete_record(record_id):  # パラメータを受け取る
 @app.route('/admin_dashboard')
 @admin_required
 def admin_dashboard():
-    page = request.args.get('page', 1, type=int)
+    cursor = request.args.get('cursor')
     per_page = 20
-    offset = (page - 1) * per_page
     
     with get_db_connection() as conn:
         # 一般ユーザーのみ取得（管理者以外）
@@ -1190,36 +1324,31 @@ def admin_dashboard():
             "ORDER BY created_at DESC"
         ).fetchall()
         
-        # 総レコード数を取得
-        total_records = conn.execute('''
-        SELECT COUNT(*) FROM records
-        ''').fetchone()[0]
+        # 総レコード数を取得（キャッシュ）
+        total_records = record_count_cache.get(conn, 'SELECT COUNT(*) FROM records')
         
-        # 記録リスト取得（ページネーション付き）
-        records = conn.execute('''
+        # 記録リスト取得（カーソル方式）
+        records, next_cursor, prev_cursor = fetch_keyset_page(conn, '''
         SELECT r.*, u.username, u.is_private,
-        strftime('%Y-%m-%d %H:%M:%S', datetime(r.timestamp, '+9 hours')) as formatted_time
+        strftime('%Y-%m-%d %H:%M:%S', datetime(r.timestamp, '+9 hours')) as formatted_time,
+        r.timestamp as cursor_ts, r.id as cursor_id
         FROM records r
         JOIN users u ON r.user_id = u.id
-        ORDER BY r.timestamp DESC
-        LIMIT ? OFFSET ?
-        ''', (per_page, offset)).fetchall()
-        
-        total_pages = (total_records + per_page - 1) // per_page
+        ''', '1', [], cursor, per_page, timestamp_column='r.timestamp', id_column='r.id')
         
         return render_template("admin_dashboard.html",
                               users=users,
                               records=records,
-                              page=page,
-                              total_pages=total_pages)
+                              next_cursor=next_cursor,
+                              prev_cursor=prev_cursor,
+                              total_records=total_records)
 
 @app.route('/admin/user_records/<int:user_id>')  # パラメータを明示的に指定
 @admin_required
 def admin_user_records(user_id):  # パラメータを受け取る
     # 既存のコード
-    page = request.args.get('page', 1, type=int)
+    cursor = request.args.get('cursor')
     per_page = 20
-    offset = (page - 1) * per_page
     
     with get_db_connection() as conn:
         # ユーザー情報を取得
@@ -1228,32 +1357,29 @@ def admin_user_records(user_id):  # パラメータを受け取る
             flash('ユーザーが見つかりません', 'error')
             return redirect(url_for('admin_dashboard'))
             
-        # 総レコード数を取得
-        total_records = conn.execute('''
+        # 総レコード数を取得（キャッシュ）
+        total_records = record_count_cache.get(conn, '''
             SELECT COUNT(*) FROM records
             WHERE user_id = ? AND is_deleted = 0
-        ''', (user_id,)).fetchone()[0]
+        ''', (user_id,))
         
-        # ページネーション付きでレコードを取得
-        records = conn.execute('''
+        # カーソル方式でレコードを取得
+        records, next_cursor, prev_cursor = fetch_keyset_page(conn, '''
             SELECT id, action,
             strftime('%Y-%m-%d', datetime(timestamp, '+9 hours')) as formatted_date,
             strftime('%H:%M:%S', datetime(timestamp, '+9 hours')) as formatted_time,
-            memo, likes_count, is_deleted
+            memo, likes_count, is_deleted,
+            timestamp as cursor_ts, id as cursor_id
             FROM records
-            WHERE user_id = ?
-            ORDER BY timestamp DESC
-            LIMIT ? OFFSET ?
-        ''', (user_id, per_page, offset)).fetchall()
-        
-        total_pages = (total_records + per_page - 1) // per_page
+        ''', 'user_id = ?', [user_id], cursor, per_page)
         
         return render_template('admin_user_records.html',
                               user=user,
                               user_id=user_id,
                               records=records,
-                              page=page,
-                              total_pages=total_pages)
+                              next_cursor=next_cursor,
+                              prev_cursor=prev_cursor,
+                              total_records=total_records)
     
 @app.route('/admin/add_record', methods=['GET', 'POST'])
 @admin_required
@@ -1282,13 +1408,17 @@ def admin_add_record():
         else:
             timestamp = jst_now()  # フォーム未入力の場合は現在時刻
 
-        with get_db_connection() as conn:
-            conn.execute('''
-                INSERT INTO records (user_id, action, timestamp, memo)
-                VALUES (?, ?, ?, ?)
-            ''', (user_id, action, timestamp.isoformat(), memo))  # JST のタイムスタンプを保存
-            
-            conn.commit()
+        def add_record(conn):
+            cursor = conn.execute('''
+                INSERT INTO records (user_id, action, timestamp, memo, local_date)
+                VALUES (?, ?, ?, ?, DATE(?, '+9 hours'))
+            ''', (user_id, action, timestamp.isoformat(), memo, timestamp.isoformat()))  # JST のタイムスタンプを保存
+            refresh_user_sessions(conn, int(user_id), timestamp.isoformat())
+            return cursor.lastrowid
+
+        record_id = run_write(add_record)
+        stats_cache.invalidate_user(int(user_id))
+        publish_record_event(record_id)
 
         # 該当ユーザーに通知メッセージを設定
         session[f'user_{user_id}_message'] = "管理者が記録を追加しました。"
@@ -1303,18 +1433,26 @@ def admin_add_record():
 @admin_required
 def admin_delete_record(record_id):
     try:
-        with get_db_connection() as conn:
+        def soft_delete(conn):
             # 記録が存在するか確認
             record = conn.execute('SELECT * FROM records WHERE id = ?', (record_id,)).fetchone()
             if not record:
-                flash('記録が見つかりません。', 'error')
-                return redirect(url_for('admin_dashboard'))
+                return None
 
             # 記録を論理削除
-            conn.execute('UPDATE records SET is_deleted = 1 WHERE id = ?', (record_id,))
-            conn.commit()
+            conn.execute('UPDATE records SET is_deleted = 1, deleted_at = ? WHERE id = ?',
+                         (jst_now().isoformat(), record_id))
+            refresh_user_sessions(conn, record['user_id'], record['timestamp'])
+            return record
+
+        record = run_write(soft_delete)
+        if not record:
+            flash('記録が見つかりません。', 'error')
+            return redirect(url_for('admin_dashboard'))
+        stats_cache.invalidate_user(record['user_id'])
+        event_broker.publish('delete', {'id': record_id})
 
-            flash('記録が削除されました。', 'success')
+        flash('記録が削除されました。', 'success')
 
         # 削除後、ユーザーの「記録を見る」画面にリダイレクト
         return redirect(url_for('admin_user_records', user_id=record['user_id']))
@@ -1322,6 +1460,63 @@ def admin_delete_record(record_id):
         flash(f'記録削除中にエラーが発生しました: {e}', 'danger')
         return redirect(url_for('admin_dashboard'))
 
+@app.route('/admin/archive')
+@admin_required
+def admin_archive():
+    """アーカイブの一覧（user_id で絞り込み、before でページ送り）"""
+    user_id = request.args.get('user_id', type=int)
+    before = request.args.get('before', type=int)
+    per_page = 20
+    with get_db_connection() as conn:
+        archives = archive.list_archives(conn, user_id, before, per_page + 1)
+        users = conn.execute(
+            'SELECT id, username FROM users WHERE is_admin = 0 ORDER BY username').fetchall()
+    next_before = archives[per_page - 1]['id'] if len(archives) > per_page else None
+    return render_template('admin_archive.html', archives=archives[:per_page], users=users,
+                           user_id=user_id, next_before=next_before, detail=None)
+
+@app.route('/admin/archive/<int:archive_id>')
+@admin_required
+def admin_archive_detail(archive_id):
+    """アーカイブの中身（圧縮を解いて表示する）"""
+    with get_db_connection() as conn:
+        detail = archive.load_archive(conn, archive_id)
+        if detail is None:
+            flash('アーカイブが見つかりません。', 'error')
+            return redirect(url_for('admin_archive'))
+        info = conn.execute('''
+            SELECT a.id, a.user_id, u.username, a.reason, a.archived_at, a.row_count
+            FROM record_archive a LEFT JOIN users u ON u.id = a.user_id WHERE a.id = ?
+        ''', (archive_id,)).fetchone()
+    likes = {}
+    for like in detail['likes']:
+        likes[like['record_id']] = likes.get(like['record_id'], 0) + 1
+    return render_template('admin_archive.html', detail=detail, info=info, likes=likes)
+
+@app.route('/admin/archive/<int:archive_id>/restore', methods=['POST'])
+@admin_required
+def admin_restore_archive(archive_id):
+    with get_db_connection() as conn:
+        row = conn.execute('SELECT user_id FROM record_archive WHERE id = ?', (archive_id,)).fetchone()
+    restored = run_write(lambda conn: archive.restore_archive(conn, archive_id)) if row else 0
+    if not restored:
+        flash('復元できる記録がありません。', 'error')
+        return redirect(url_for('admin_archive'))
+    stats_cache.invalidate_user(row['user_id'])
+    flash(f'{restored}件の記録を復元しました。', 'success')
+    return redirect(url_for('admin_user_records', user_id=row['user_id']))
+
+@app.route('/admin/archive/<int:archive_id>/record/<int:record_id>/restore', methods=['POST'])
+@admin_required
+def admin_restore_archived_record(archive_id, record_id):
+    user_id = run_write(lambda conn: archive.restore_record(conn, archive_id, record_id))
+    if user_id is None:
+        flash('アーカイブに記録が見つかりません。', 'error')
+        return redirect(url_for('admin_archive'))
+    stats_cache.invalidate_user(user_id)
+    flash('記録を復元しました。', 'success')
+    return redirect(url_for('admin_user_records', user_id=user_id))
+
 @app.route('/delete_user/<int:user_id>', methods=['POST'])  # パラメータを明示的に指定
 @admin_required
 def delete_user(user_id):  # パラメータを受け取る
@@ -1332,37 +1527,41 @@ def delete_user(user_id):  # パラメータを受け取る
         flash('自分自身を削除することはできません。', 'error')
         return redirect(url_for('admin_dashboard'))
         
-    with get_db_connection() as conn:
+    def delete(conn):
         # 削除対象が管理者かチェック
         target_user = conn.execute('SELECT is_admin FROM users WHERE id = ?', (user_id,)).fetchone()
         if target_user and target_user['is_admin']:
+            return False
+
+        # ユーザーのいいねを削除し、いいねされていた記録の件数を数え直す
+        liked_record_ids = [row[0] for row in conn.execute(
+            'SELECT record_id FROM likes WHERE user_id = ?', (user_id,)).fetchall()]
+        conn.execute('DELETE FROM likes WHERE user_id = ?', (user_id,))
+        reconcile_like_counts(conn, liked_record_ids)
+        
+        # ユーザーの記録に対するいいねも削除
+        conn.execute('DELETE FROM likes WHERE record_id IN (SELECT id FROM records WHERE user_id = ?)', (user_id,))
+        
+        # ユーザーの睡眠セッションを削除
+        conn.execute('DELETE FROM sleep_sessions WHERE user_id = ?', (user_id,))
+        
+        # ユーザーの記録を削除
+        conn.execute('DELETE FROM records WHERE user_id = ?', (user_id,))
+        archive.delete_user_archives(conn, user_id)
+        
+        # ユーザーを削除
+        conn.execute('DELETE FROM users WHERE id = ?', (user_id,))
+        return True
+
+    try:
+        # 1つのトランザクションで削除し、失敗したらすべて戻す（run_write がロールバックする）
+        if not run_write(delete):
             flash('管理者ユーザーは削除できません。', 'error')
             return redirect(url_for('admin_dashboard'))
-            
-        try:
-            # トランザクション開始
-            conn.execute('BEGIN TRANSACTION')
-            
-            # ユーザーのいいねを削除
-            conn.execute('DELETE FROM likes WHERE user_id = ?', (user_id,))
-            
-            # ユーザーの記録に対するいいねも削除
-            conn.execute('DELETE FROM likes WHERE record_id IN (SELECT id FROM records WHERE user_id = ?)', (user_id,))
-            
-            # ユーザーの記録を削除
-            conn.execute('DELETE FROM records WHERE user_id = ?', (user_id,))
-            
-            # ユーザーを削除
-            conn.execute('DELETE FROM users WHERE id = ?', (user_id,))
-            
-            # トランザクションコミット
-            conn.commit()
-            
-            flash('ユーザーが削除されました。', 'success')
-        except sqlite3.Error as e:
-            # エラー時はロールバック
-            conn.rollback()
-            flash(f'ユーザー削除中にエラーが発生しました: {e}', 'error')
+        stats_cache.invalidate_user(user_id)
+        flash('ユーザーが削除されました。', 'success')
+    except sqlite3.Error as e:
+        flash(f'ユーザー削除中にエラーが発生しました: {e}', 'error')
             
     return redirect(url_for('admin_dashboard'))
 
@@ -1372,115 +1571,532 @@ def sleep_data():
     try:
         # 選択された期間（日別、週別、月別）を取得
         period = request.args.get('period', 'daily')  # デフォルトは日別
-        
+        # rows: 従来どおりの dict のリスト / columns: キーごとの配列
+        response_format = request.args.get('format', 'rows')
+        try:
+            options = parse_sleep_data_options()
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        if response_format not in ('rows', 'columns'):
+            return jsonify({'error': 'format は rows か columns を指定してください。'}), 400
+
         with get_db_connection() as conn:
-            if period == 'daily':
-                # 日別データを取得
-                data = conn.execute('''
-                    SELECT date(timestamp, '+9 hours') as date,
-                           action,
-                           timestamp
-                    FROM records
-                    WHERE user_id = ? AND is_deleted = 0
-                    AND (action = 'sleep' OR action = 'wake_up')
-                    ORDER BY timestamp
-                ''', (session['user_id'],)).fetchall()
-                
-                # 睡眠時間を計算
-                sleep_times = []
-                sleep_start = None
-                
-                for row in data:
-                    if row['action'] == 'sleep':
-                        sleep_start = datetime.fromisoformat(row['timestamp'])
-                    elif row['action'] == 'wake_up' and sleep_start:
-                        wake_time = datetime.fromisoformat(row['timestamp'])
-                        sleep_duration = (wake_time - sleep_start).total_seconds() / 3600  # 時間単位
-                        
-                        # 時間と分に分割
-                        sleep_hours = int(sleep_duration)
-                        sleep_minutes = int((sleep_duration - sleep_hours) * 60)
-                        
-                        sleep_times.append({
-                            'date': row['date'],
-                            'duration': sleep_duration,
-                            'hours': sleep_hours,
-                            'minutes': sleep_minutes
-                        })
-                        sleep_start = None
-                
-            elif period == 'weekly':
-                # 週別平均データを取得
-                weekly_avg = calculate_weekly_average(get_sleep_times(conn, session['user_id']))
-                sleep_times = []
-                
-                for item in weekly_avg:
-                    sleep_times.append({
-                        'period': item['period'],
-                        'avg_duration': item['avg_duration'],
-                        'avg_hours': item['avg_hours'],
-                        'avg_minutes': item['avg_minutes']
-                    })
-                
-            elif period == 'monthly':
-                # 月別平均データを取得
-                monthly_avg = calculate_monthly_average(get_sleep_times(conn, session['user_id']))
-                sleep_times = []
-                
-                for item in monthly_avg:
-                    sleep_times.append({
-                        'period': item['period'],
-                        'avg_duration': item['avg_duration'],
-                        'avg_hours': item['avg_hours'],
-                        'avg_minutes': item['avg_minutes']
-                    })
+            user_id = session['user_id']
+            if period == 'daily' and (options or response_format == 'columns'):
+                # 期間・件数・間引きの指定があるときは、その範囲だけを読む
+                return jsonify(build_daily_sleep_data(conn, user_id, response_format, **options))
+            if period in ('daily', 'weekly', 'monthly'):
+                sleep_times = stats_cache.get_or_compute(
+                    user_id, f'sleep_data:{period}', lambda: build_sleep_data(conn, user_id, period))
+                if response_format == 'columns':
+                    sleep_times = to_columns(sleep_times, ('period', 'avg_duration', 'avg_hours', 'avg_minutes'))
         
         return jsonify(sleep_times)
     except Exception as e:
         app.logger.error(f"エラーが発生しました: {str(e)}")
         return jsonify({'error': 'データ取得中にエラーが発生しました。'}), 500
 
-# 睡眠時間データを取得するヘルパー関数
-def get_sleep_times(conn, user_id):
-    data = conn.execute('''
-        SELECT date(timestamp, '+9 hours') as date,
-               action,
-               timestamp
-        FROM records
-        WHERE user_id = ? AND is_deleted = 0
-        AND (action = 'sleep' OR action = 'wake_up')
-        ORDER BY timestamp
-    ''', (user_id,)).fetchall()
-    
+SLEEP_DATA_MAX_LIMIT = 5000
+
+def parse_sleep_data_options():
+    """/api/sleep_data の from / to / limit / max_points / bucket_days を読み取る（指定されたものだけ）"""
+    options = {}
+    for name, key in (('from', 'date_from'), ('to', 'date_to')):
+        value = request.args.get(name)
+        if value:
+            try:
+                options[key] = datetime.strptime(value, '%Y-%m-%d').date()
+            except ValueError:
+                raise ValueError(f'{name} は YYYY-MM-DD 形式で指定してください。')
+    for name, upper in (('limit', SLEEP_DATA_MAX_LIMIT), ('max_points', SLEEP_DATA_MAX_LIMIT), ('bucket_days', 3660)):
+        value = request.args.get(name)
+        if value:
+            if not value.isdigit() or not 1 <= int(value) <= upper:
+                raise ValueError(f'{name} は 1～{upper} の整数で指定してください。')
+            options[name] = int(value)
+    return options
+
+def to_columns(items, keys):
+    """dict のリストをキーごとの配列にする"""
+    return {key: [item[key] for item in items] for key in keys}
+
+def build_daily_sleep_data(conn, user_id, response_format='rows', date_from=None, date_to=None,
+                           limit=None, max_points=None, bucket_days=None):
+    """日別の睡眠時間（指定があれば期間・件数を絞り、bucket_days 日ごとに間引く）"""
+    conditions = ['user_id = ?']
+    params = [user_id]
+    # wake_ts は前後1日広げて絞り、local_date で確定させる
+    if date_from:
+        conditions.append('wake_ts >= ? AND local_date >= ?')
+        params += [(date_from - timedelta(days=1)).isoformat(), date_from.isoformat()]
+    if date_to:
+        conditions.append('wake_ts < ? AND local_date <= ?')
+        params += [(date_to + timedelta(days=2)).isoformat(), date_to.isoformat()]
+    sql = f'''
+        SELECT local_date, duration_seconds
+        FROM sleep_sessions
+        WHERE {' AND '.join(conditions)}
+    '''
+    if limit:
+        # 新しい方から limit 件を取り、古い順に戻す
+        rows = conn.execute(sql + ' ORDER BY wake_ts DESC, wake_record_id DESC LIMIT ?',
+                            params + [limit]).fetchall()[::-1]
+    else:
+        rows = conn.execute(sql + ' ORDER BY wake_ts, wake_record_id', params).fetchall()
+
+    columns = aggregation.SessionColumns.from_rows(rows)
+    # 区切りは downsample と同じ起点（date_from があればそこ、なければ最も古い日）から数える
+    origin = date_from.toordinal() if date_from else None
+    downsampled = bool(bucket_days and bucket_days > 1)
+    if not bucket_days and max_points and len(rows) > max_points:
+        # 起点から最後の日までを max_points 個以下の区切りに収める（同じ日の複数件も1つにまとめる）
+        span = max(columns.ordinals) - (origin if origin is not None else min(columns.ordinals)) + 1
+        bucket_days = -(-span // max_points)
+        downsampled = True
+
+    if downsampled:
+        items = []
+        for start, count, shortest, longest, mean in aggregation.downsample(columns, bucket_days, origin):
+            items.append({
+                'date': datetime.fromordinal(start).date().isoformat(),
+                'end': datetime.fromordinal(start + bucket_days - 1).date().isoformat(),
+                'count': count,
+                'min': shortest,
+                'max': longest,
+                'mean': mean,
+                'duration': mean,
+                'hours': int(mean),
+                'minutes': int((mean - int(mean)) * 60)
+            })
+        if response_format == 'columns':
+            data = to_columns(items, ('date', 'end', 'count', 'min', 'max', 'mean'))
+            data['bucket_days'] = bucket_days
+            return data
+        return items
+
+    if response_format == 'columns':
+        return {
+            'bucket_days': 1,
+            'date': [row['local_date'] for row in rows],
+            'duration': list(columns.durations)
+        }
     sleep_times = []
-    sleep_start = None
-    
-    for row in data:
-        if row['action'] == 'sleep':
-            sleep_start = datetime.fromisoformat(row['timestamp'])
-        elif row['action'] == 'wake_up' and sleep_start:
-            wake_time = datetime.fromisoformat(row['timestamp'])
-            sleep_duration = (wake_time - sleep_start).total_seconds() / 3600  # 時間単位
-            
-            sleep_date = datetime.fromisoformat(row['timestamp']).date()
+    for row, sleep_duration in zip(rows, columns.durations):
+        # 時間と分に分割
+        sleep_hours = int(sleep_duration)
+        sleep_minutes = int((sleep_duration - sleep_hours) * 60)
+
+        sleep_times.append({
+            'date': row['local_date'],
+            'duration': sleep_duration,
+            'hours': sleep_hours,
+            'minutes': sleep_minutes
+        })
+    return sleep_times
+
+def build_sleep_data(conn, user_id, period):
+    """/api/sleep_data の応答データを作る"""
+    if period == 'daily':
+        # 日別データを取得（sleep_sessions に計算済み）
+        sleep_times = build_daily_sleep_data(conn, user_id)
+        
+    elif period == 'weekly':
+        # 週別平均データを取得（集計テーブルの範囲読み）
+        weekly_avg = rollups.weekly_averages(conn, user_id, evaluate_sleep)
+        sleep_times = []
+        
+        for item in weekly_avg:
             sleep_times.append({
-                'date': sleep_date,
-                'duration': sleep_duration,
-                'hours': int(sleep_duration),
-                'minutes': int((sleep_duration - int(sleep_duration)) * 60),
-                'week': sleep_date.isocalendar()[1],  # ISO週番号
-                'month': sleep_date.month,
-                'year': sleep_date.year
+                'period': item['period'],
+                'avg_duration': item['avg_duration'],
+                'avg_hours': item['avg_hours'],
+                'avg_minutes': item['avg_minutes']
+            })
+        
+    elif period == 'monthly':
+        # 月別平均データを取得（集計テーブルの範囲読み）
+        monthly_avg = rollups.monthly_averages(conn, user_id, evaluate_sleep)
+        sleep_times = []
+        
+        for item in monthly_avg:
+            sleep_times.append({
+                'period': item['period'],
+                'avg_duration': item['avg_duration'],
+                'avg_hours': item['avg_hours'],
+                'avg_minutes': item['avg_minutes']
             })
-            sleep_start = None
-    
     return sleep_times
 
+def detect_import_format(filename=None, content_type=None):
+    """ファイル名や Content-Type から取り込み形式（csv / jsonl）を推測する"""
+    filename = (filename or '').lower()
+    content_type = (content_type or '').lower()
+    if filename.endswith(('.jsonl', '.ndjson')) or 'ndjson' in content_type or 'jsonl' in content_type:
+        return 'jsonl'
+    return 'csv'
+
+@app.route('/api/records/bulk', methods=['POST'])
+@login_required
+def bulk_import_records():
+    """CSV / JSON Lines の記録をまとめて登録する"""
+    upload = request.files.get('file')
+    try:
+        if upload:
+            text = upload.read().decode('utf-8-sig')
+            fmt = request.args.get('format') or detect_import_format(upload.filename, upload.mimetype)
+        else:
+            text = request.get_data().decode('utf-8-sig')
+            fmt = request.args.get('format') or detect_import_format(content_type=request.content_type)
+        rows = parse_rows(text, fmt)
+    except UnicodeDecodeError:
+        return jsonify({'error': 'UTF-8 のテキストを送信してください。'}), 400
+    except IngestError as e:
+        return jsonify({'error': str(e)}), 400
+
+    # 一般ユーザーは自分の記録のみ。管理者は行ごと、または ?user_id= で対象を指定する
+    if session.get('is_admin'):
+        default_user_id = request.args.get('user_id', type=int)
+        allowed_user_id = None
+    else:
+        default_user_id = allowed_user_id = session['user_id']
+
+    with get_db_connection() as conn:
+        try:
+            results, touched = ingest_rows(conn, rows, default_user_id, allowed_user_id, write=run_write)
+        except sqlite3.Error as e:
+            conn.rollback()
+            app.logger.error(f'一括登録中にデータベースエラーが発生しました: {e}')
+            return jsonify({'error': 'データベースエラーが発生しました。'}), 500
+
+    for user_id in touched:
+        stats_cache.invalidate_user(user_id)
+
+    return jsonify({'summary': summarize_results(results), 'results': results})
+
+@app.cli.command('import-records')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--user-id', type=int, help='user_id 列がない行の登録先ユーザー')
+@click.option('--format', 'fmt', type=click.Choice(['csv', 'jsonl']), help='省略時は拡張子から判定')
+def import_records_command(path, user_id, fmt):
+    """CSV / JSON Lines ファイルから記録を一括登録する"""
+    with open(path, encoding='utf-8-sig') as f:
+        text = f.read()
+    try:
+        rows = parse_rows(text, fmt or detect_import_format(path))
+    except IngestError as e:
+        raise click.ClickException(str(e))
+
+    with get_db_connection() as conn:
+        results, touched = ingest_rows(conn, rows, default_user_id=user_id, write=run_write)
+    for uid in touched:
+        stats_cache.invalidate_user(uid)
+
+    for result in results:
+        if result['status'] != 'inserted':
+            print(f"{result['line']}行目: {result['status']} {result.get('error', '')}".rstrip())
+    summary = summarize_results(results)
+    print(f"登録 {summary['inserted']}件 / 重複 {summary['duplicate']}件 / 不正 {summary['invalid']}件")
+
+def parse_export_args():
+    """エクスポートの共通パラメータ（形式・期間・対象ユーザー）を読み取る"""
+    fmt = request.args.get('format', 'csv')
+    if fmt not in ('csv', 'jsonl'):
+        raise ValueError('format は csv か jsonl を指定してください。')
+    date_from = request.args.get('from') or None
+    date_to = request.args.get('to') or None
+    for value in (date_from, date_to):
+        if value:
+            datetime.strptime(value, '%Y-%m-%d')
+    user_id = session['user_id']
+    if session.get('is_admin') and request.args.get('user_id', type=int):
+        user_id = request.args.get('user_id', type=int)
+    return fmt, date_from, date_to, user_id
+
+def export_response(columns, sql, params, fmt, filename):
+    conn = get_db_connection()
+    chunks = export.iter_chunks(conn, sql, params)
+    if fmt == 'jsonl':
+        body, mimetype = export.stream_jsonl(columns, chunks), 'application/x-ndjson'
+    else:
+        body, mimetype = export.stream_csv(columns, chunks), 'text/csv'
+    return Response(
+        stream_with_context(body),
+        mimetype=mimetype,
+        headers={'Content-Disposition': f'attachment; filename={filename}.{fmt}'}
+    )
+
+@app.route('/api/export/records')
+@login_required
+def export_records():
+    """自分の記録を CSV / JSON Lines でストリーミング出力する"""
+    try:
+        fmt, date_from, date_to, user_id = parse_export_args()
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    action = request.args.get('action') or None
+    if action and action not in ('sleep', 'wake_up'):
+        return jsonify({'error': 'action は sleep か wake_up を指定してください。'}), 400
+
+    sql, params = export.build_records_query(user_id, date_from, date_to, action)
+    return export_response(export.RECORD_COLUMNS, sql, params, fmt, 'records')
+
+@app.route('/api/export/sessions')
+@login_required
+def export_sessions():
+    """自分の睡眠セッションを CSV / JSON Lines でストリーミング出力する"""
+    try:
+        fmt, date_from, date_to, user_id = parse_export_args()
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    sql, params = export.build_sessions_query(user_id, date_from, date_to)
+    return export_response(export.SESSION_COLUMNS, sql, params, fmt, 'sleep_sessions')
+
+@app.cli.command('backfill-sleep-sessions')
+def backfill_sleep_sessions_command():
+    """records から sleep_sessions を作り直す"""
+    with get_db_connection() as conn:
+        total = backfill_sleep_sessions(conn)
+        # トリガーの足し引きで生じた誤差もここで作り直して解消する
+        rollups.rebuild_rollups(conn)
+        conn.commit()
+    print(f'{total}件の睡眠セッションを作成しました')
+
+@app.cli.command('reconcile-likes')
+def reconcile_likes_command():
+    """likes テーブルから全記録の likes_count を数え直す"""
+    with get_db_connection() as conn:
+        changed = reconcile_like_counts(conn)
+        conn.commit()
+    print(f'{changed}件の記録のいいね数を修正しました')
+
+@app.cli.command('check-query-plans')
+def check_query_plans_command():
+    """主要クエリが records を全件スキャンしていないか確認する"""
+    with get_db_connection() as conn:
+        failures = check_hot_queries(conn)
+    for name, plan in failures.items():
+        print(f'全件スキャン: {name}: {plan}')
+    if failures:
+        sys.exit(1)
+    print('すべてのクエリがインデックスを使用しています')
+
+@app.route('/admin/db_pool_stats')
+@admin_required
+def db_pool_stats():
+    return jsonify(get_db_pool_stats())
+
+def collect_app_metrics():
+    """キャッシュ・接続プール・書き込みキュー・イベント配信の統計を /metrics 用にまとめる"""
+    groups = [('stats_cache', {}, stats_cache.stats())]
+    for backend, stats in get_db_pool_stats().items():
+        if backend == 'write_queue':
+            groups.append(('write_queue', {}, stats))
+        else:
+            groups.append(('db_pool', {'backend': backend}, stats))
+    groups.append(('stream', {}, event_broker.stats()))
+
+    metrics = {}
+    for group, labels, stats in groups:
+        for key, value in stats.items():
+            if isinstance(value, (int, float)):
+                name = f'{group}_{key}'
+                metrics.setdefault(name, []).append((labels, value))
+    return [(name, 'gauge', name.replace('_', ' '), samples) for name, samples in metrics.items()]
+
+def collect_query_metrics():
+    """遅いクエリの件数とクエリ数の上限超えの件数（エンドポイント別）"""
+    stats = query_profiler.stats()
+    return [
+        ('slow_queries_total', 'counter', '遅いクエリの件数',
+         [({'endpoint': endpoint}, count) for endpoint, count in sorted(stats['slow_queries'].items())]),
+        ('query_budget_exceeded_total', 'counter', 'クエリ数の上限を超えたリクエストの件数',
+         [({'endpoint': endpoint}, count) for endpoint, count in sorted(stats['budget_violations'].items())]),
+    ]
+
+metrics_registry.add_collector(collect_app_metrics)
+metrics_registry.add_collector(collect_query_metrics)
+
+@app.route('/metrics')
+def metrics():
+    """Prometheus 形式の計測値（管理者か、METRICS_TOKEN を Bearer で渡した場合のみ）
+
+    format=json でエンドポイントごとの平均（合計時間の多い順）を返す。
+    """
+    token = os.environ.get('METRICS_TOKEN')
+    authorization = request.headers.get('Authorization', '')
+    authorized = session.get('is_admin') or (
+        token and hmac.compare_digest(authorization.encode(), f'Bearer {token}'.encode()))
+    if not authorized:
+        return Response('forbidden\n', status=403, mimetype='text/plain')
+    if request.args.get('format') == 'json':
+        return jsonify(metrics_registry.summary())
+    return Response(metrics_registry.render(), mimetype='text/plain; version=0.0.4; charset=utf-8')
+
+@app.route('/admin/cache_stats')
+@admin_required
+def cache_stats():
+    return jsonify(stats_cache.stats())
+
+@app.route('/admin/slow_queries')
+@admin_required
+def slow_queries():
+    """記録した遅いクエリ（新しい順）。?endpoint= で絞り込める"""
+    return jsonify({
+        **query_profiler.stats(),
+        'budgets': QUERY_BUDGETS,
+        'queries': query_profiler.slow_queries(request.args.get('endpoint')),
+    })
+
+# 全体統計は特定のユーザーに属さないので、キャッシュ上はユーザー ID 0 として扱う
+ANALYTICS_CACHE_OWNER = 0
+
+@app.route('/admin/analytics')
+@admin_required
+def admin_analytics():
+    """全ユーザーの睡眠統計（STATS_CACHE_TTL 秒キャッシュ。refresh=1 で作り直す）"""
+    days = min(max(request.args.get('days', 30, type=int), 1), 365)
+    if request.args.get('refresh') == '1':
+        # ほかのワーカーのキャッシュも読まれなくなるよう、DB 側の値も進める
+        run_write(lambda conn: bump_user_version(conn, ANALYTICS_CACHE_OWNER))
+        stats_cache.invalidate_user(ANALYTICS_CACHE_OWNER)
+
+    today = jst_now().date()
+    conn = get_db_connection()
+    stats = stats_cache.get_or_compute(
+        ANALYTICS_CACHE_OWNER, f'analytics:{today.isoformat()}:{days}',
+        lambda: analytics.build_population_stats(conn, evaluate_sleep, today, days))
+
+    if request.args.get('format') == 'json':
+        return jsonify(stats)
+    return render_template('admin_analytics.html', stats=stats)
+
+@app.route('/admin/backup', methods=['GET', 'POST'])
+@admin_required
+def admin_backup():
+    """GET でバックアップの状態を、POST でその場でスナップショットを取る"""
+    if request.method == 'POST':
+        path = backup_service.run_once()
+        if path is None and backup_service.last_error:
+            return jsonify({'error': backup_service.last_error}), 500
+    return jsonify(backup_service.status())
+
+@app.cli.command('backup-db')
+def backup_db_command():
+    """稼働中の DB の圧縮スナップショットを作成する"""
+    path = backup_service.run_once()
+    if path is None:
+        raise click.ClickException(backup_service.last_error or '別のプロセスがバックアップ中です')
+    print(path)
+
+# 定期ジョブ。通常は gunicorn.conf.py が flask run-scheduler を別プロセスで1つだけ起動する
+# （SCHEDULER_ENABLED=1 にすると、gunicorn を使わない場合などにこのプロセスの中でも動かす）
+app.config.update(
+    SCHEDULER_ENABLED=os.environ.get('SCHEDULER_ENABLED', '0') == '1',
+    SCHEDULER_TICK=float(os.environ.get('SCHEDULER_TICK', 15)),
+    ARCHIVE_DELETED_AFTER_DAYS=int(os.environ.get('ARCHIVE_DELETED_AFTER_DAYS', 30)),
+    # 0 なら削除されていない記録は古くてもアーカイブしない
+    ARCHIVE_AFTER_YEARS=int(os.environ.get('ARCHIVE_AFTER_YEARS', 0)),
+    BACKUP_SCHEDULE=os.environ.get('BACKUP_SCHEDULE', '')
+)
+
+def run_write_job(fn):
+    # ジョブはリクエストの外で動くので、アプリケーションコンテキストを用意して書き込む
+    with app.app_context():
+        return run_write(fn)
+
+def archive_records_job():
+    """削除から ARCHIVE_DELETED_AFTER_DAYS 日たった記録（と ARCHIVE_AFTER_YEARS 年より古い記録）をアーカイブする"""
+    now = jst_now()
+    targets = [(archive.DELETED, now - timedelta(days=app.config['ARCHIVE_DELETED_AFTER_DAYS']))]
+    if app.config['ARCHIVE_AFTER_YEARS'] > 0:
+        targets.append((archive.OLD, now - timedelta(days=365 * app.config['ARCHIVE_AFTER_YEARS'])))
+    total = 0
+    for reason, cutoff in targets:
+        # 書き込みロックを長く持たないよう、少しずつ移す
+        while True:
+            count, user_ids = run_write_job(
+                lambda conn: archive.archive_records(conn, reason, cutoff.isoformat(), now.isoformat()))
+            for user_id in user_ids:
+                stats_cache.invalidate_user(user_id)
+            total += count
+            if count < 500:
+                break
+    return total
+
+def backup_job():
+    if backup_service.run_once() is None and backup_service.last_error:
+        raise RuntimeError(backup_service.last_error)
+
+job_scheduler = Scheduler(
+    lambda: connect_sqlite(DATABASE_PATH, sqlite_pragmas()),
+    now=jst_now,
+    tick=app.config['SCHEDULER_TICK']
+)
+# いいね数の足し込み漏れを拾う
+job_scheduler.register('fold-likes', '* * * * *', lambda: run_write_job(fold_like_deltas))
+job_scheduler.register('reconcile-likes', '30 4 * * *', lambda: run_write_job(reconcile_like_counts))
+# 週別・月別の集計テーブルを作り直し、足し引きの誤差を解消する
+job_scheduler.register('rebuild-rollups', '0 4 * * *', lambda: run_write_job(rollups.rebuild_rollups))
+job_scheduler.register('archive-records', '0 5 * * *', archive_records_job)
+if app.config['BACKUP_SCHEDULE']:
+    try:
+        job_scheduler.register('backup', app.config['BACKUP_SCHEDULE'], backup_job)
+    except CronError as e:
+        print(f'BACKUP_SCHEDULE が不正なため、バックアップのジョブを登録しません: {e}', file=sys.stderr)
+if backup_service.interval > 0:
+    # 毎分確かめて、最新のスナップショットから BACKUP_INTERVAL 秒たっていれば取る（再起動しても間隔を保つ）
+    job_scheduler.register('backup-interval', '* * * * *', lambda: backup_service.due() and backup_job())
+
+if app.config['SCHEDULER_ENABLED'] and not DATABASE_URL:
+    job_scheduler.start()
+    atexit.register(job_scheduler.stop)
+
+@app.route('/admin/jobs', methods=['GET', 'POST'])
+@admin_required
+def admin_jobs():
+    """GET でジョブの状態を、POST（name=ジョブ名）でその場で1回実行する"""
+    if request.method == 'POST':
+        name = request.form.get('name') or request.args.get('name')
+        if name not in job_scheduler.jobs:
+            return jsonify({'error': 'ジョブが見つかりません。'}), 404
+        job_scheduler.run_job(name)
+    return jsonify(job_scheduler.status())
+
+@app.cli.command('run-scheduler')
+def run_scheduler_command():
+    """ジョブのスケジューラーを前面で動かす（gunicorn.conf.py がマスターから1つだけ起動する）"""
+    print(f'スケジューラーを開始します: {", ".join(job_scheduler.jobs)}')
+    job_scheduler.start()
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        job_scheduler.stop()
+
+@app.cli.command('run-job')
+@click.argument('name')
+def run_job_command(name):
+    """ジョブを1回実行する"""
+    if name not in job_scheduler.jobs:
+        raise click.ClickException(f'ジョブが見つかりません: {name}（{", ".join(job_scheduler.jobs)}）')
+    print(job_scheduler.run_job(name))
+
 from flask import send_file
 
 @app.route('/download_db')
+@admin_required
 def download_db():
-    return send_file(DATABASE_PATH, as_attachment=True)
+    # 書き込み途中のファイルを渡さないよう、バックアップ API で取ったコピーを送る
+    fd, path = tempfile.mkstemp(suffix='.db')
+    os.close(fd)
+    try:
+        online_copy(DATABASE_PATH, path)
+        f = open(path, 'rb')
+    finally:
+        # 開いたまま削除しておけば、送信後に自動で消える
+        os.remove(path)
+    return send_file(f, as_attachment=True, download_name='attendance.db')
 
 # その他のルートと関数は変更なし（適切なwith文を使用してデータベース接続を管理）
 
@@ -0,0 +1,214 @@
+"""古い記録のアーカイブ
+
+論理削除されてから一定期間たった記録（と、任意で一定年数より古い記録）を
+records から取り除き、ユーザーごとにまとめて zlib 圧縮した JSON として
+record_archive に保存する。その記録へのいいねも一緒に移す。
+record_archive_index に (アーカイブ ID, 記録 ID) と一覧表示用の最小限の列を残すので、
+圧縮を解かずに検索でき、管理画面から1件ずつでも、アーカイブ単位でも元に戻せる。
+削除済みとしてアーカイブした記録は、削除を取り消した状態で戻る。
+ただし同じ日に同じ行動の有効な記録が既にある場合は、削除済みのまま戻す。
+"""
+import json
+import zlib
+
+from attendance_system.likes import reconcile_like_counts
+from attendance_system.sleep_sessions import refresh_user_sessions
+
+DELETED = 'deleted'
+OLD = 'old'
+
+
+def create_archive_tables(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS record_archive (
+            id INTEGER PRIMARY KEY,
+            user_id INTEGER NOT NULL,
+            reason TEXT NOT NULL,
+            archived_at TEXT NOT NULL,
+            row_count INTEGER NOT NULL,
+            first_timestamp TEXT,
+            last_timestamp TEXT,
+            payload BLOB NOT NULL
+        )
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_record_archive_user ON record_archive (user_id, id)')
+    # records の id は AUTOINCREMENT ではなく使い回されるので、同じ記録 ID が
+    # 別のアーカイブに入ることがある。アーカイブ ID と組にして一意にする
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS record_archive_index (
+            archive_id INTEGER NOT NULL,
+            record_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            action TEXT NOT NULL,
+            timestamp TEXT NOT NULL,
+            is_deleted INTEGER NOT NULL,
+            PRIMARY KEY (archive_id, record_id)
+        )
+    ''')
+
+
+def _pack(records, likes):
+    return zlib.compress(json.dumps(
+        {'records': records, 'likes': likes}, ensure_ascii=False, separators=(',', ':')
+    ).encode('utf-8'), 6)
+
+
+def _unpack(payload):
+    return json.loads(zlib.decompress(payload).decode('utf-8'))
+
+
+def _archive_user_rows(conn, user_id, record_ids, reason, archived_at):
+    placeholders = ','.join('?' * len(record_ids))
+    records = [dict(row) for row in conn.execute(
+        f'SELECT * FROM records WHERE id IN ({placeholders}) ORDER BY timestamp, id', record_ids)]
+    likes = [dict(row) for row in conn.execute(
+        f'SELECT * FROM likes WHERE record_id IN ({placeholders}) ORDER BY id', record_ids)]
+    archive_id = conn.execute('''
+        INSERT INTO record_archive
+        (user_id, reason, archived_at, row_count, first_timestamp, last_timestamp, payload)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    ''', (user_id, reason, archived_at, len(records), records[0]['timestamp'],
+          records[-1]['timestamp'], _pack(records, likes))).lastrowid
+    conn.executemany('''
+        INSERT INTO record_archive_index (record_id, archive_id, user_id, action, timestamp, is_deleted)
+        VALUES (?, ?, ?, ?, ?, ?)
+    ''', [(r['id'], archive_id, user_id, r['action'], r['timestamp'], r['is_deleted'] or 0)
+          for r in records])
+    conn.execute(f'DELETE FROM likes WHERE record_id IN ({placeholders})', record_ids)
+    conn.execute(f'DELETE FROM records WHERE id IN ({placeholders})', record_ids)
+
+
+def archive_records(conn, reason, cutoff, archived_at, batch_size=500):
+    """条件に合う記録を batch_size 件までアーカイブし、(件数, 影響したユーザー ID の集合) を返す
+
+    reason が DELETED なら cutoff より前に論理削除された記録、
+    OLD なら記録の時刻が cutoff より前の記録（削除されていないものも含む）が対象。
+    OLD の場合は対象ユーザーの睡眠セッションを作り直す。呼び出し側でコミットすること。
+    """
+    if reason == DELETED:
+        # deleted_at がない（列を追加する前に削除された）記録は記録の時刻で判断する
+        where_sql = 'is_deleted = 1 AND COALESCE(deleted_at, timestamp) < ?'
+    else:
+        where_sql = 'timestamp < ?'
+    rows = conn.execute(f'''
+        SELECT id, user_id FROM records WHERE {where_sql}
+        ORDER BY user_id, timestamp, id LIMIT ?
+    ''', (cutoff, batch_size)).fetchall()
+
+    by_user = {}
+    for record_id, user_id in rows:
+        by_user.setdefault(user_id, []).append(record_id)
+    for user_id, record_ids in by_user.items():
+        _archive_user_rows(conn, user_id, record_ids, reason, archived_at)
+        if reason == OLD:
+            refresh_user_sessions(conn, user_id)
+    return len(rows), set(by_user)
+
+
+def list_archives(conn, user_id=None, before_id=None, limit=20):
+    """アーカイブの一覧（新しい順）。payload は含めない"""
+    conditions, params = [], []
+    if user_id is not None:
+        conditions.append('a.user_id = ?')
+        params.append(user_id)
+    if before_id is not None:
+        conditions.append('a.id < ?')
+        params.append(before_id)
+    where_sql = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+    return conn.execute(f'''
+        SELECT a.id, a.user_id, u.username, a.reason, a.archived_at, a.row_count,
+            a.first_timestamp, a.last_timestamp, LENGTH(a.payload) AS compressed_size
+        FROM record_archive a LEFT JOIN users u ON u.id = a.user_id
+        {where_sql}
+        ORDER BY a.id DESC LIMIT ?
+    ''', params + [limit]).fetchall()
+
+
+def load_archive(conn, archive_id):
+    """アーカイブの中身 {'records': [...], 'likes': [...]}。なければ None"""
+    row = conn.execute('SELECT payload FROM record_archive WHERE id = ?', (archive_id,)).fetchone()
+    return _unpack(row[0]) if row else None
+
+
+def _restore(conn, archive_id, record_ids=None):
+    row = conn.execute(
+        'SELECT user_id, reason, archived_at, payload FROM record_archive WHERE id = ?', (archive_id,)).fetchone()
+    if row is None:
+        return 0
+    user_id = row['user_id']
+    # 退会したユーザーの記録は戻さない（delete_user_archives で消える）
+    if not conn.execute('SELECT 1 FROM users WHERE id = ?', (user_id,)).fetchone():
+        return 0
+    data = _unpack(row['payload'])
+    restoring = [r for r in data['records'] if record_ids is None or r['id'] in record_ids]
+    if not restoring:
+        return 0
+
+    new_ids = {}
+    for record in restoring:
+        values = dict(record)
+        if row['reason'] == DELETED:
+            # 削除済みとしてアーカイブした記録は、削除を取り消した状態で戻す
+            values.update(is_deleted=0, deleted_at=None)
+        if not values.get('is_deleted') and conn.execute('''
+            SELECT 1 FROM records
+            WHERE user_id = ? AND action = ? AND local_date = ? AND is_deleted = 0
+        ''', (values['user_id'], values['action'], values['local_date'])).fetchone():
+            # 同じ日に同じ行動の記録が既にあれば（/record と同じく1日1件まで）、削除済みのまま戻す
+            values.update(is_deleted=1, deleted_at=record.get('deleted_at') or row['archived_at'])
+        if conn.execute('SELECT 1 FROM records WHERE id = ?', (record['id'],)).fetchone():
+            # アーカイブ後に同じ ID が使われていたら新しい ID で戻す
+            del values['id']
+        cursor = conn.execute(
+            f"INSERT INTO records ({', '.join(values)}) VALUES ({', '.join('?' * len(values))})",
+            list(values.values()))
+        new_ids[record['id']] = cursor.lastrowid
+    for like in data['likes']:
+        if like['record_id'] not in new_ids:
+            continue
+        # 退会したユーザーのいいねは戻さない
+        conn.execute('''
+            INSERT INTO likes (user_id, record_id, timestamp)
+            SELECT ?, ?, ? WHERE EXISTS (SELECT 1 FROM users WHERE id = ?)
+            ON CONFLICT (user_id, record_id) DO NOTHING
+        ''', (like['user_id'], new_ids[like['record_id']], like['timestamp'], like['user_id']))
+    # 戻したいいねは未反映（folded = 0）で入るので、反映済みの範囲で数え直し、残りは次の足し込みに任せる
+    reconcile_like_counts(conn, new_ids.values())
+    refresh_user_sessions(conn, user_id, min(r['timestamp'] for r in restoring))
+
+    restored_ids = set(new_ids)
+    placeholders = ','.join('?' * len(restored_ids))
+    conn.execute(f'DELETE FROM record_archive_index WHERE archive_id = ? AND record_id IN ({placeholders})',
+                 [archive_id] + list(restored_ids))
+    remaining = [r for r in data['records'] if r['id'] not in restored_ids]
+    if not remaining:
+        conn.execute('DELETE FROM record_archive WHERE id = ?', (archive_id,))
+    else:
+        likes = [like for like in data['likes'] if like['record_id'] not in restored_ids]
+        conn.execute('''
+            UPDATE record_archive SET row_count = ?, first_timestamp = ?, last_timestamp = ?, payload = ?
+            WHERE id = ?
+        ''', (len(remaining), remaining[0]['timestamp'], remaining[-1]['timestamp'],
+              _pack(remaining, likes), archive_id))
+    return len(restoring)
+
+
+def restore_archive(conn, archive_id):
+    """アーカイブの記録をすべて records に戻し、戻した件数を返す"""
+    return _restore(conn, archive_id)
+
+
+def restore_record(conn, archive_id, record_id):
+    """アーカイブ済みの記録1件を records に戻す。戻せたらそのユーザー ID、なければ None"""
+    row = conn.execute(
+        'SELECT user_id FROM record_archive_index WHERE archive_id = ? AND record_id = ?',
+        (archive_id, record_id)
+    ).fetchone()
+    if row is None or not _restore(conn, archive_id, {record_id}):
+        return None
+    return row['user_id']
+
+
+def delete_user_archives(conn, user_id):
+    conn.execute('DELETE FROM record_archive_index WHERE user_id = ?', (user_id,))
+    conn.execute('DELETE FROM record_archive WHERE user_id = ?', (user_id,))
@@ -0,0 +1,299 @@
+"""SQLite のオンラインバックアップ
+
+sqlite3 のバックアップ API で数百ページずつコピーし、ステップの合間に
+ロックを手放すので、書き込み中のアプリを止めずに整合したスナップショットが取れる。
+スナップショットは gzip 圧縮し、sha256 のチェックサムファイルを横に置く。
+古いものは keep 件を残して削除する。
+
+アプリを読み込まずに使えるよう標準ライブラリだけに依存する:
+
+    python -m attendance_system.backup snapshot --db attendance.db --dir backups
+    python -m attendance_system.backup restore --db attendance.db --dir backups
+    python -m attendance_system.backup copy attendance.db attendance_2024-01-01.db
+"""
+import argparse
+import fcntl
+import gzip
+import hashlib
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+
+JST = timezone(timedelta(hours=9))
+SNAPSHOT_PREFIX = 'attendance_'
+SNAPSHOT_SUFFIX = '.db.gz'
+CHECKSUM_SUFFIX = '.sha256'
+PAGES_PER_STEP = 256
+STEP_SLEEP = 0.005
+MAX_RESTARTS = 3
+KEEP = 14
+
+
+class BackupError(Exception):
+    """スナップショットの作成・検証・復元に失敗した"""
+
+
+class _Restarted(Exception):
+    pass
+
+
+def _stepped_backup(src, dst, pages, sleep, max_restarts):
+    """ページ単位でコピーする。他の接続の書き込みでやり直しが続いたら _Restarted"""
+    state = {'remaining': None, 'restarts': 0}
+
+    def progress(status, remaining, total):
+        if state['remaining'] is not None and remaining > state['remaining']:
+            state['restarts'] += 1
+            if state['restarts'] > max_restarts:
+                raise _Restarted()
+        state['remaining'] = remaining
+
+    src.backup(dst, pages=pages, sleep=sleep, progress=progress)
+
+
+def online_copy(db_path, dest_path, pages=PAGES_PER_STEP, sleep=STEP_SLEEP, max_restarts=MAX_RESTARTS):
+    """db_path の整合したコピーを dest_path に作る（ページ単位で少しずつコピー）
+
+    WAL モードでは読み取りトランザクションを開いたままコピーするので、
+    書き込みは止まらず、コピーもやり直しにならない。
+    ロールバックジャーナルでは他の接続が書き込むとコピーが最初からやり直しになるため、
+    max_restarts 回を超えたら残りを1ステップでコピーする（その間だけ書き込みが待たされる）。
+    """
+    tmp_path = dest_path + '.tmp'
+    src = sqlite3.connect(f'file:{db_path}?mode=ro', uri=True, isolation_level=None, timeout=30)
+    try:
+        dst = sqlite3.connect(tmp_path)
+        try:
+            if src.execute('PRAGMA journal_mode').fetchone()[0] == 'wal':
+                src.execute('BEGIN')
+                src.execute('SELECT COUNT(*) FROM sqlite_master').fetchone()
+                try:
+                    src.backup(dst, pages=pages, sleep=sleep)
+                finally:
+                    src.execute('COMMIT')
+            else:
+                try:
+                    _stepped_backup(src, dst, pages, sleep, max_restarts)
+                except _Restarted:
+                    src.backup(dst, pages=-1)
+        finally:
+            dst.close()
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    finally:
+        src.close()
+    os.replace(tmp_path, dest_path)
+    return dest_path
+
+
+def _sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _integrity_check(path):
+    conn = sqlite3.connect(f'file:{path}?mode=ro', uri=True)
+    try:
+        result = conn.execute('PRAGMA integrity_check').fetchone()[0]
+    finally:
+        conn.close()
+    if result != 'ok':
+        raise BackupError(f'整合性チェックに失敗しました: {path}: {result}')
+
+
+def list_snapshots(backup_dir):
+    """スナップショットのパスを新しい順に返す"""
+    if not os.path.isdir(backup_dir):
+        return []
+    names = [
+        name for name in os.listdir(backup_dir)
+        if name.startswith(SNAPSHOT_PREFIX) and name.endswith(SNAPSHOT_SUFFIX)
+    ]
+    # ファイル名に時刻が入っているので名前順がそのまま時系列になる
+    return [os.path.join(backup_dir, name) for name in sorted(names, reverse=True)]
+
+
+def verify_snapshot(path):
+    """チェックサムファイルと照合する。一致しなければ BackupError"""
+    checksum_path = path + CHECKSUM_SUFFIX
+    if not os.path.exists(checksum_path):
+        raise BackupError(f'チェックサムファイルがありません: {checksum_path}')
+    with open(checksum_path, encoding='ascii') as f:
+        expected = f.read().split()[0]
+    if _sha256(path) != expected:
+        raise BackupError(f'チェックサムが一致しません: {path}')
+
+
+def prune_snapshots(backup_dir, keep=KEEP):
+    """新しい keep 件を残して削除し、削除したパスを返す"""
+    removed = []
+    for path in list_snapshots(backup_dir)[keep:]:
+        for target in (path, path + CHECKSUM_SUFFIX):
+            if os.path.exists(target):
+                os.remove(target)
+        removed.append(path)
+    return removed
+
+
+def snapshot(db_path, backup_dir, keep=KEEP, pages=PAGES_PER_STEP, sleep=STEP_SLEEP):
+    """圧縮・チェックサム付きのスナップショットを作り、そのパスを返す
+
+    複数のワーカーから同時に呼ばれても1つだけが実行されるよう、
+    バックアップ先のロックファイルを取れなかった場合は None を返す。
+    """
+    os.makedirs(backup_dir, exist_ok=True)
+    with open(os.path.join(backup_dir, '.lock'), 'w') as lock:
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return None
+
+        stamp = datetime.now(JST).strftime('%Y-%m-%d_%H%M%S_%f')
+        path = os.path.join(backup_dir, f'{SNAPSHOT_PREFIX}{stamp}{SNAPSHOT_SUFFIX}')
+        fd, raw_path = tempfile.mkstemp(dir=backup_dir, suffix='.db')
+        os.close(fd)
+        try:
+            online_copy(db_path, raw_path, pages=pages, sleep=sleep)
+            with open(raw_path, 'rb') as src, gzip.open(path + '.tmp', 'wb', compresslevel=6) as dst:
+                shutil.copyfileobj(src, dst, 1024 * 1024)
+        finally:
+            if os.path.exists(raw_path):
+                os.remove(raw_path)
+        os.replace(path + '.tmp', path)
+        with open(path + CHECKSUM_SUFFIX, 'w', encoding='ascii') as f:
+            f.write(f'{_sha256(path)}  {os.path.basename(path)}\n')
+
+        prune_snapshots(backup_dir, keep)
+    return path
+
+
+def restore(db_path, backup_dir=None, snapshot_path=None, force=False):
+    """スナップショットから db_path を復元し、使ったスナップショットのパスを返す
+
+    snapshot_path を省略すると、チェックサムと整合性チェックが通る最新のものを使う。
+    db_path が既にある場合は force=True のときだけ置き換える。
+    """
+    if os.path.exists(db_path) and not force:
+        raise BackupError(f'{db_path} は既に存在します（置き換えるには force を指定）')
+    candidates = [snapshot_path] if snapshot_path else list_snapshots(backup_dir or '')
+    if not candidates:
+        raise BackupError('スナップショットが見つかりません')
+
+    db_dir = os.path.dirname(os.path.abspath(db_path))
+    os.makedirs(db_dir, exist_ok=True)
+    errors = []
+    for path in candidates:
+        fd, tmp_path = tempfile.mkstemp(dir=db_dir, suffix='.restore')
+        os.close(fd)
+        try:
+            verify_snapshot(path)
+            with gzip.open(path, 'rb') as src, open(tmp_path, 'wb') as dst:
+                shutil.copyfileobj(src, dst, 1024 * 1024)
+            _integrity_check(tmp_path)
+        except (BackupError, OSError, sqlite3.DatabaseError) as e:
+            os.remove(tmp_path)
+            errors.append(str(e))
+            continue
+        # 古い WAL が残っていると復元後のファイルに適用されてしまうので消しておく
+        for suffix in ('-wal', '-shm'):
+            if os.path.exists(db_path + suffix):
+                os.remove(db_path + suffix)
+        os.replace(tmp_path, db_path)
+        return path
+    raise BackupError('復元できるスナップショットがありません: ' + '; '.join(errors))
+
+
+class BackupService:
+    """スナップショットの設定と直近の結果（定期実行はジョブスケジューラーから run_once を呼ぶ）"""
+
+    def __init__(self, db_path, backup_dir, interval, keep=KEEP):
+        self.db_path = db_path
+        self.backup_dir = backup_dir
+        self.interval = interval
+        self.keep = keep
+        self.last_snapshot = None
+        self.last_error = None
+
+    def run_once(self):
+        try:
+            path = snapshot(self.db_path, self.backup_dir, keep=self.keep)
+        except (BackupError, OSError, sqlite3.Error) as e:
+            self.last_error = str(e)
+            print(f'バックアップに失敗しました: {e}', file=sys.stderr)
+            return None
+        if path:
+            self.last_snapshot = path
+            self.last_error = None
+        return path
+
+    def due(self):
+        """最新のスナップショットから interval 秒以上たっていれば True（interval が 0 なら常に False）"""
+        if self.interval <= 0:
+            return False
+        snapshots = list_snapshots(self.backup_dir)
+        return not snapshots or time.time() - os.path.getmtime(snapshots[0]) >= self.interval
+
+    def status(self):
+        snapshots = list_snapshots(self.backup_dir)
+        return {
+            'interval': self.interval,
+            'keep': self.keep,
+            'last_snapshot': self.last_snapshot,
+            'last_error': self.last_error,
+            'snapshots': [os.path.basename(path) for path in snapshots],
+        }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m attendance_system.backup')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    snap = commands.add_parser('snapshot', help='圧縮スナップショットを作成する')
+    snap.add_argument('--db', required=True)
+    snap.add_argument('--dir', required=True)
+    snap.add_argument('--keep', type=int, default=KEEP)
+
+    rest = commands.add_parser('restore', help='最新の正常なスナップショットから復元する')
+    rest.add_argument('--db', required=True)
+    rest.add_argument('--dir')
+    rest.add_argument('--snapshot')
+    rest.add_argument('--force', action='store_true')
+
+    copy = commands.add_parser('copy', help='稼働中の DB の整合したコピーを作る')
+    copy.add_argument('db')
+    copy.add_argument('dest')
+
+    listing = commands.add_parser('list', help='スナップショットを新しい順に表示する')
+    listing.add_argument('--dir', required=True)
+
+    args = parser.parse_args(argv)
+    try:
+        if args.command == 'snapshot':
+            path = snapshot(args.db, args.dir, keep=args.keep)
+            print(path or '別のプロセスがバックアップ中のためスキップしました')
+        elif args.command == 'restore':
+            if not args.dir and not args.snapshot:
+                parser.error('--dir か --snapshot を指定してください')
+            print(restore(args.db, args.dir, args.snapshot, force=args.force))
+        elif args.command == 'copy':
+            print(online_copy(args.db, args.dest))
+        else:
+            for path in list_snapshots(args.dir):
+                print(path)
+    except (BackupError, sqlite3.Error, OSError) as e:
+        print(f'エラー: {e}', file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,234 @@
+"""睡眠時間の比較（前日比・先週比・先月比・前年比・移動平均）
+
+セッションを日付順に並べた索引 SleepIndex を一度作っておけば、
+- ある日の睡眠時間・その前に記録のある日は二分探索で O(log n)
+- 「n 日以上前の同じ曜日で記録のある日」は曜日ごとに並べた配列の二分探索で O(log n)
+- 任意の期間の件数・合計（移動平均）は累積和の二分探索で O(log n)
+で求められる（従来は比較のたびに全件を並べ替えて先頭から探していた）。索引は pickle できるので stats_cache にそのまま置ける。
+comparisons() は stats.calculate_comparisons と同じ結果を返す。
+"""
+from array import array
+from bisect import bisect_left, bisect_right
+from datetime import date
+from itertools import accumulate, islice
+from operator import le
+
+NO_DIFF = {'diff_hours': 0, 'diff_minutes': 0, 'is_increase': False}
+
+
+def _diff(current, compare):
+    diff = current - compare
+    diff_abs = abs(diff)
+    diff_hours = int(diff_abs)
+    return {'diff_hours': diff_hours, 'diff_minutes': int((diff_abs - diff_hours) * 60),
+            'is_increase': diff > 0}
+
+
+def _versus(current, compare):
+    return _diff(current, compare) if compare is not None else dict(NO_DIFF)
+
+
+def one_year_before(ordinal):
+    """前年の同じ日（2月29日は前年にないので None）"""
+    d = date.fromordinal(ordinal)
+    try:
+        return d.replace(year=d.year - 1).toordinal()
+    except ValueError:
+        return None
+
+
+def one_month_before(ordinal):
+    """前月の同じ日（3月31日の前月などは存在しないので None）"""
+    d = date.fromordinal(ordinal)
+    year, month = (d.year, d.month - 1) if d.month > 1 else (d.year - 1, 12)
+    try:
+        return date(year, month, d.day).toordinal()
+    except ValueError:
+        return None
+
+
+class SleepIndex:
+    """睡眠セッションの日付索引
+
+    ordinals / durations: セッションを日付の昇順に並べたもの（同じ日付の中は入力順）
+    期間の集計に使う累積和と、曜日ごとに並べた配列は最初に必要になったときに作る
+    （前日比などを1回求めるだけなら作らない）。キャッシュに置く前には prepare() で作っておく。
+    並べ替え・累積は組み込み関数で行うので、Python のループはセッション数だけ回らない。
+    """
+
+    __slots__ = ('ordinals', 'durations', '_cum_sums', '_by_weekday', '_weekday_starts')
+
+    # same_weekday_before で、曜日ごとの配列を使う前に直接確かめる週数
+    PROBE_WEEKS = 4
+
+    def __init__(self, ordinals, durations):
+        if all(map(le, ordinals, islice(ordinals, 1, None))):
+            self.ordinals = array('l', ordinals)
+            self.durations = array('d', durations)
+        else:
+            # sorted は安定なので、同じ日付の中は入力順のまま
+            order = sorted(range(len(ordinals)), key=ordinals.__getitem__)
+            self.ordinals = array('l', map(ordinals.__getitem__, order))
+            self.durations = array('d', map(durations.__getitem__, order))
+        self._cum_sums = None
+        self._by_weekday = None
+        self._weekday_starts = None
+
+    @classmethod
+    def from_columns(cls, columns):
+        """aggregation.SessionColumns から作る"""
+        return cls(columns.ordinals, columns.durations)
+
+    def prepare(self):
+        """累積和と曜日ごとの配列を作って self を返す"""
+        self._prefix_sums()
+        self._weekday_index()
+        return self
+
+    def _prefix_sums(self):
+        # durations の先頭からの累積（長さ len(durations) + 1）
+        if self._cum_sums is None:
+            self._cum_sums = array('d', accumulate(self.durations, initial=0.0))
+        return self._cum_sums
+
+    def _weekday_index(self):
+        # ordinals を ordinal % 7 ごとにまとめて昇順に並べたものと、各曜日の開始位置
+        if self._by_weekday is None:
+            weekday = (7).__rmod__
+            self._by_weekday = array('l', sorted(self.ordinals, key=weekday))
+            self._weekday_starts = tuple(bisect_left(self._by_weekday, w, key=weekday) for w in range(8))
+        return self._by_weekday, self._weekday_starts
+
+    def __len__(self):
+        return len(self.ordinals)
+
+    def latest(self, on_or_before=None):
+        """on_or_before 以前で最後に記録のある日（省略時は最新の日）。なければ None"""
+        if on_or_before is None:
+            return self.ordinals[-1] if self.ordinals else None
+        i = bisect_right(self.ordinals, on_or_before)
+        return self.ordinals[i - 1] if i else None
+
+    def on(self, ordinal, nth=0):
+        """その日の nth 件目（0 始まり）のセッションの睡眠時間（ordinal が None か、なければ None）"""
+        if ordinal is None:
+            return None
+        i = bisect_left(self.ordinals, ordinal) + nth
+        return self.durations[i] if i < len(self.ordinals) and self.ordinals[i] == ordinal else None
+
+    def same_weekday_before(self, ordinal, min_days=7):
+        """ordinal の min_days 日以上前で、同じ曜日の記録のある最後の日"""
+        latest = ordinal - -(-min_days // 7) * 7
+        # 毎日記録していれば直近の数週で見つかる
+        for candidate in range(latest, latest - self.PROBE_WEEKS * 7, -7):
+            i = bisect_left(self.ordinals, candidate)
+            if i < len(self.ordinals) and self.ordinals[i] == candidate:
+                return candidate
+            if not i:
+                return None
+        by_weekday, starts = self._weekday_index()
+        w = ordinal % 7
+        i = bisect_right(by_weekday, latest, starts[w], starts[w + 1])
+        return by_weekday[i - 1] if i > starts[w] else None
+
+    def window(self, first, last):
+        """first～last 日（両端を含む）の (セッション数, 睡眠時間の合計)"""
+        lo = bisect_left(self.ordinals, first)
+        hi = bisect_right(self.ordinals, last)
+        if hi <= lo:
+            return 0, 0.0
+        cum_sums = self._prefix_sums()
+        return hi - lo, cum_sums[hi] - cum_sums[lo]
+
+    def moving_average(self, last, days):
+        """last 日までの days 日間の平均睡眠時間（記録がなければ None）"""
+        count, total = self.window(last - days + 1, last)
+        return total / count if count else None
+
+
+def comparisons(index, today=None):
+    """前日比・先週比・先月比（today 以前で最新の記録の日を基準にする）
+
+    today を省略したときは stats.calculate_comparisons と同じ結果になる。
+    """
+    anchor = index.latest(today)
+    if anchor is None:
+        return {'yesterday': dict(NO_DIFF), 'last_week': dict(NO_DIFF), 'last_month': dict(NO_DIFF)}
+    current = index.on(anchor)
+
+    # 同じ日に2件目があればそれと、なければ前に記録のある日の1件目と比べる
+    compare = index.on(anchor, 1)
+    if compare is None:
+        previous = index.latest(anchor - 1)
+        compare = index.on(previous) if previous is not None else None
+    return {
+        'yesterday': _versus(current, compare),
+        'last_week': _versus(current, index.on(index.same_weekday_before(anchor))),
+        'last_month': _versus(current, index.on(one_month_before(anchor))),
+    }
+
+
+def _average(index, first, last):
+    count, total = index.window(first, last)
+    return {'from': date.fromordinal(first).isoformat(), 'to': date.fromordinal(last).isoformat(),
+            'sessions': count, 'avg_duration': total / count if count else None}
+
+
+def window_comparison(index, days, last):
+    """last 日までの days 日間の平均を、直前の days 日間・前年の同じ期間と比べる"""
+    current = _average(index, last - days + 1, last)
+    previous = _average(index, last - 2 * days + 1, last - days)
+    # 2月29日で終わる期間は、前年の2月28日で終わる期間と比べる
+    last_year_end = one_year_before(last) or last - 366
+    last_year = _average(index, last_year_end - days + 1, last_year_end)
+
+    def versus(other):
+        if current['avg_duration'] is None or other['avg_duration'] is None:
+            return None
+        return _diff(current['avg_duration'], other['avg_duration'])
+
+    return {
+        'days': days,
+        'current': current,
+        'previous': previous,
+        'last_year': last_year,
+        'vs_previous': versus(previous),
+        'vs_last_year': versus(last_year),
+    }
+
+
+def moving_average_series(index, days, first, last):
+    """first～last の各日について、その日までの days 日間の移動平均"""
+    series = []
+    for ordinal in range(first, last + 1):
+        count, total = index.window(ordinal - days + 1, ordinal)
+        series.append({'date': date.fromordinal(ordinal).isoformat(), 'sessions': count,
+                       'avg_duration': total / count if count else None})
+    return series
+
+
+def build_comparisons(index, windows=(7, 30), today=None, series_days=0):
+    """/api/sleep_comparisons の応答
+
+    today（ordinal）以前で最新の記録の日を基準に、前日比・先週比・先月比・前年同日比と、
+    windows の各日数の移動平均の比較を返す。series_days > 0 なら基準日までの
+    その日数分の移動平均の推移も付ける。
+    """
+    anchor = index.latest(today)
+    if anchor is None:
+        return {'date': None, 'comparisons': comparisons(index, today), 'windows': [], 'series': {}}
+
+    result = comparisons(index, anchor)
+    result['last_year'] = _versus(index.on(anchor), index.on(one_year_before(anchor)))
+    response = {
+        'date': date.fromordinal(anchor).isoformat(),
+        'comparisons': result,
+        'windows': [window_comparison(index, days, anchor) for days in windows],
+        'series': {},
+    }
+    if series_days > 0:
+        response['series'] = {
+            str(days): moving_average_series(index, days, anchor - series_days + 1, anchor)
+            for days in windows
+        }
+    return response
@@ -0,0 +1,86 @@
+"""データの変更カウンター
+
+フィードに関わるテーブル（records・likes・users）が変わるたびに
+トリガーで data_versions の 'feed' を1つ進める。ETag はこの値から作るので、
+どの経路（画面・一括登録・CLI）で書き込んでも必ず変わる。
+
+同じように、ユーザーの記録・睡眠セッションが変わるたびに user_data_versions の
+そのユーザーの値を進める。睡眠統計のキャッシュ（stats_cache.py）はこの値をキーに含めるので、
+別のワーカーやスケジューラーのプロセスでの書き込みでも古い統計は読まれなくなる。
+"""
+
+FEED = 'feed'
+
+# (トリガー名, 対象のイベント)
+_FEED_TRIGGERS = (
+    ('trg_feed_records_insert', 'AFTER INSERT ON records'),
+    ('trg_feed_records_update', 'AFTER UPDATE ON records'),
+    ('trg_feed_records_delete', 'AFTER DELETE ON records'),
+    ('trg_feed_likes_insert', 'AFTER INSERT ON likes'),
+    ('trg_feed_likes_delete', 'AFTER DELETE ON likes'),
+    ('trg_feed_users_update', 'AFTER UPDATE OF username, is_private ON users'),
+    ('trg_feed_users_delete', 'AFTER DELETE ON users'),
+)
+
+# (トリガー名, 対象のイベント, ユーザー ID)。いいね数（likes_count）だけの更新では進めない
+_USER_TRIGGERS = (
+    ('trg_user_records_insert', 'AFTER INSERT ON records', 'NEW.user_id'),
+    ('trg_user_records_update',
+     'AFTER UPDATE OF user_id, action, timestamp, memo, is_deleted, local_date ON records', 'NEW.user_id'),
+    ('trg_user_records_delete', 'AFTER DELETE ON records', 'OLD.user_id'),
+    ('trg_user_sessions_insert', 'AFTER INSERT ON sleep_sessions', 'NEW.user_id'),
+    ('trg_user_sessions_delete', 'AFTER DELETE ON sleep_sessions', 'OLD.user_id'),
+)
+
+
+def create_data_versions(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS data_versions (
+            name TEXT PRIMARY KEY,
+            version INTEGER NOT NULL
+        )
+    ''')
+    conn.execute('INSERT OR IGNORE INTO data_versions (name, version) VALUES (?, 0)', (FEED,))
+    for name, event in _FEED_TRIGGERS:
+        conn.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS {name} {event}
+            BEGIN
+                UPDATE data_versions SET version = version + 1 WHERE name = '{FEED}';
+            END
+        ''')
+
+
+def create_user_versions(conn):
+    """user_data_versions とトリガーを作る（records・sleep_sessions を作った後に呼ぶ）"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS user_data_versions (
+            user_id INTEGER PRIMARY KEY,
+            version INTEGER NOT NULL
+        )
+    ''')
+    for name, event, user_id in _USER_TRIGGERS:
+        conn.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS {name} {event}
+            BEGIN
+                INSERT INTO user_data_versions (user_id, version) VALUES ({user_id}, 1)
+                ON CONFLICT (user_id) DO UPDATE SET version = version + 1;
+            END
+        ''')
+
+
+def get_user_version(conn, user_id):
+    row = conn.execute('SELECT version FROM user_data_versions WHERE user_id = ?', (user_id,)).fetchone()
+    return row[0] if row else 0
+
+
+def bump_user_version(conn, user_id):
+    """記録の変更以外の理由（全体統計の作り直しなど）でユーザーのキャッシュを無効にする"""
+    conn.execute('''
+        INSERT INTO user_data_versions (user_id, version) VALUES (?, 1)
+        ON CONFLICT (user_id) DO UPDATE SET version = version + 1
+    ''', (user_id,))
+
+
+def get_version(conn, name=FEED):
+    row = conn.execute('SELECT version FROM data_versions WHERE name = ?', (name,)).fetchone()
+    return row[0] if row else 0
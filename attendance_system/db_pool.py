@@ -0,0 +1,235 @@
+"""データベース接続プール
+
+ワーカープロセスごとに接続を使い回し、リクエストのたびに
+connect / PRAGMA をやり直すコストをなくす。
+"""
+import os
+import queue
+import sqlite3
+import threading
+import time
+
+
+class PoolExhaustedError(Exception):
+    """タイムアウトまでに接続を確保できなかった"""
+
+
+class ConnectionPool:
+    """スレッドセーフな汎用接続プール
+
+    factory で接続を生成し、最大 size 本までを保持する。
+    fork 後（gunicorn のワーカー）に親プロセスの接続を使い回さないよう、
+    PID が変わったらプールを作り直す。
+    """
+
+    def __init__(self, factory, size=5, timeout=10.0, health_check=None,
+                 health_check_interval=30.0, reset=None):
+        self.factory = factory
+        self.size = size
+        self.timeout = timeout
+        self.health_check = health_check
+        self.health_check_interval = health_check_interval
+        self.reset = reset
+        self._lock = threading.Lock()
+        self._init_state()
+
+    def _init_state(self):
+        self._pid = os.getpid()
+        self._idle = queue.LifoQueue()
+        self._created = 0
+        self._last_used = {}
+        self._stats = {
+            'checkouts': 0,
+            'created': 0,
+            'discarded': 0,
+            'exhausted': 0,
+            'health_check_failures': 0,
+            'wait_time_total': 0.0,
+            'wait_time_max': 0.0,
+        }
+
+    def _ensure_pid(self):
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    # 親プロセスの接続は閉じずに捨てる（親側で使われている可能性があるため）
+                    self._init_state()
+
+    def _new_connection(self):
+        conn = self.factory()
+        self._last_used[id(conn)] = time.monotonic()
+        with self._lock:
+            self._stats['created'] += 1
+        return conn
+
+    def _is_healthy(self, conn):
+        if self.health_check is None:
+            return True
+        last_used = self._last_used.get(id(conn), 0)
+        if time.monotonic() - last_used < self.health_check_interval:
+            return True
+        try:
+            self.health_check(conn)
+            return True
+        except Exception:
+            with self._lock:
+                self._stats['health_check_failures'] += 1
+            return False
+
+    def _discard(self, conn):
+        self._last_used.pop(id(conn), None)
+        try:
+            conn.close()
+        except Exception:
+            pass
+        with self._lock:
+            self._created -= 1
+            self._stats['discarded'] += 1
+
+    def acquire(self):
+        """接続を1本借りる。空きがなく上限に達していれば timeout 秒まで待つ"""
+        self._ensure_pid()
+        started = time.monotonic()
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                conn = None
+                with self._lock:
+                    can_create = self._created < self.size
+                    if can_create:
+                        self._created += 1
+                if can_create:
+                    try:
+                        conn = self._new_connection()
+                    except Exception:
+                        with self._lock:
+                            self._created -= 1
+                        raise
+                else:
+                    remaining = self.timeout - (time.monotonic() - started)
+                    if remaining <= 0:
+                        with self._lock:
+                            self._stats['exhausted'] += 1
+                        raise PoolExhaustedError(
+                            f'{self.timeout}秒以内にDB接続を確保できませんでした (size={self.size})')
+                    try:
+                        conn = self._idle.get(timeout=remaining)
+                    except queue.Empty:
+                        continue
+
+            if not self._is_healthy(conn):
+                self._discard(conn)
+                continue
+
+            waited = time.monotonic() - started
+            with self._lock:
+                self._stats['checkouts'] += 1
+                self._stats['wait_time_total'] += waited
+                self._stats['wait_time_max'] = max(self._stats['wait_time_max'], waited)
+            return conn
+
+    def release(self, conn, broken=False):
+        """接続を返却する。未確定のトランザクションはロールバックする"""
+        self._ensure_pid()
+        if id(conn) not in self._last_used:
+            # fork 前に親プロセスで借りた接続はこのプールのものではない
+            return
+        if not broken and self.reset is not None:
+            try:
+                self.reset(conn)
+            except Exception:
+                broken = True
+        if broken:
+            self._discard(conn)
+            return
+        self._last_used[id(conn)] = time.monotonic()
+        self._idle.put(conn)
+
+    def close_all(self):
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._discard(conn)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['size'] = self.size
+            stats['open'] = self._created
+        stats['idle'] = self._idle.qsize()
+        stats['in_use'] = stats['open'] - stats['idle']
+        stats['wait_time_avg'] = (
+            stats['wait_time_total'] / stats['checkouts'] if stats['checkouts'] else 0.0)
+        return stats
+
+
+def _sqlite_health_check(conn):
+    conn.execute('SELECT 1').fetchone()
+
+
+def _sqlite_reset(conn):
+    if conn.in_transaction:
+        conn.rollback()
+
+
+def _postgres_health_check(conn):
+    with conn.cursor() as cur:
+        cur.execute('SELECT 1')
+        cur.fetchone()
+
+
+def _postgres_reset(conn):
+    if conn.closed:
+        raise RuntimeError('connection closed')
+    conn.rollback()
+
+
+# 高並列モードで使う設定（WAL なら読み込みと書き込みが互いを待たない）
+TUNED_SQLITE_PRAGMAS = (
+    ('journal_mode', 'WAL'),
+    ('synchronous', 'NORMAL'),
+    ('busy_timeout', 5000),
+    ('mmap_size', 256 * 1024 * 1024),
+    ('cache_size', -16000),  # 負の値は KiB 単位（約16MB）
+)
+
+
+def connect_sqlite(database_path, pragmas=None):
+    """アプリ共通の設定で SQLite に接続する。pragmas は (名前, 値) の並び"""
+    db_dir = os.path.dirname(database_path)
+    if db_dir and not os.path.exists(db_dir):
+        os.makedirs(db_dir)
+    conn = sqlite3.connect(database_path, check_same_thread=False)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA foreign_keys = ON")
+    for name, value in pragmas or ():
+        conn.execute(f"PRAGMA {name} = {value}")
+    return conn
+
+
+def create_sqlite_pool(database_path, size=5, timeout=10.0, health_check_interval=30.0, pragmas=None):
+    def factory():
+        return connect_sqlite(database_path, pragmas)
+
+    return ConnectionPool(factory, size=size, timeout=timeout,
+                          health_check=_sqlite_health_check,
+                          health_check_interval=health_check_interval,
+                          reset=_sqlite_reset)
+
+
+def create_postgres_pool(database_url, size=5, timeout=10.0, health_check_interval=30.0):
+    import psycopg2
+    from psycopg2.extras import DictCursor
+
+    def factory():
+        conn = psycopg2.connect(database_url)
+        conn.cursor_factory = DictCursor
+        return conn
+
+    return ConnectionPool(factory, size=size, timeout=timeout,
+                          health_check=_postgres_health_check,
+                          health_check_interval=health_check_interval,
+                          reset=_postgres_reset)
@@ -0,0 +1,138 @@
+"""フィード更新のプロセス内 pub/sub
+
+書き込み側（記録・いいね・削除）が publish したイベントを、
+/api/stream に接続している各クライアントのバッファに配る。
+バッファは接続ごとに上限があり、溢れた場合は古いものから捨てて
+クライアントに「全体を取り直す」（resync）よう知らせる。
+直近のイベントは履歴として残し、再接続時の Last-Event-ID から続きを送る。
+
+イベント ID は "<エポック>-<連番>"。連番はプロセスごとなので、別のワーカーや
+再起動前のプロセスが出した ID（エポックが違う）や履歴の範囲外の ID で
+再接続してきた場合は、続きを送れないので resync を知らせる。
+"""
+import itertools
+import json
+import os
+import threading
+import uuid
+from collections import deque
+
+
+class Subscription:
+    def __init__(self, broker, buffer_size):
+        self._broker = broker
+        self._events = deque(maxlen=buffer_size)
+        self._cond = threading.Condition(broker._lock)
+        self.overflowed = False
+        self.closed = False
+
+    def _push(self, event):
+        # broker のロックを持った状態で呼ばれる
+        if len(self._events) == self._events.maxlen:
+            self.overflowed = True
+        self._events.append(event)
+        self._cond.notify()
+
+    def get(self, timeout=None):
+        """イベントを待って (events, overflowed) を返す。timeout なら ([], False)"""
+        with self._cond:
+            if not self._events and not self.closed:
+                self._cond.wait(timeout)
+            events = list(self._events)
+            self._events.clear()
+            overflowed, self.overflowed = self.overflowed, False
+        return events, overflowed
+
+    def close(self):
+        self._broker.unsubscribe(self)
+
+
+class EventBroker:
+    def __init__(self, buffer_size=100, history_size=500, max_subscribers=100):
+        self.buffer_size = buffer_size
+        self.max_subscribers = max_subscribers
+        self._lock = threading.Lock()
+        self._subscribers = set()
+        self._history = deque(maxlen=history_size)
+        self._counters = {'published': 0, 'overflows': 0, 'rejected': 0}
+        self._pid = None
+        self._reset()
+
+    def _reset(self):
+        # fork した子プロセスが親と同じエポックを使わないよう、プロセスごとに作り直す
+        self._pid = os.getpid()
+        self.epoch = uuid.uuid4().hex[:12]
+        self._ids = itertools.count(1)
+        self._last_seq = 0
+        self._history.clear()
+
+    def _check_process(self):
+        if self._pid != os.getpid():
+            self._subscribers = set()
+            self._reset()
+
+    def _parse_id(self, event_id):
+        """このプロセスの ID なら連番、それ以外（別のエポック・不正な値）は None"""
+        epoch, _, seq = str(event_id).rpartition('-')
+        if epoch != self.epoch or not seq.isdigit():
+            return None
+        return int(seq)
+
+    def subscribe(self, last_event_id=None):
+        """購読を開始する。上限に達していれば None
+
+        last_event_id より後のイベントが履歴に残っていれば最初に受け取れる。
+        別のプロセスの ID や履歴から消えた範囲の ID なら overflowed が立ち、取り直しが必要になる。
+        """
+        with self._lock:
+            self._check_process()
+            if len(self._subscribers) >= self.max_subscribers:
+                self._counters['rejected'] += 1
+                return None
+            subscription = Subscription(self, self.buffer_size)
+            if last_event_id is not None:
+                seq = self._parse_id(last_event_id)
+                oldest = self._history[0]['seq'] if self._history else self._last_seq + 1
+                if seq is None or seq > self._last_seq or seq < oldest - 1:
+                    subscription.overflowed = True
+                else:
+                    for event in self._history:
+                        if event['seq'] > seq:
+                            subscription._push(event)
+            self._subscribers.add(subscription)
+            return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscribers.discard(subscription)
+            subscription.closed = True
+            subscription._cond.notify_all()
+
+    def publish(self, event_type, data):
+        with self._lock:
+            self._check_process()
+            seq = self._last_seq = next(self._ids)
+            event = {'id': f'{self.epoch}-{seq}', 'seq': seq, 'type': event_type, 'data': data}
+            self._history.append(event)
+            self._counters['published'] += 1
+            for subscription in self._subscribers:
+                if len(subscription._events) == subscription._events.maxlen:
+                    self._counters['overflows'] += 1
+                subscription._push(event)
+        return event['id']
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+            stats['subscribers'] = len(self._subscribers)
+        return stats
+
+
+def format_sse(event_type, data, event_id=None):
+    """1件のイベントを text/event-stream の形式にする"""
+    lines = []
+    if event_id is not None:
+        lines.append(f'id: {event_id}')
+    lines.append(f'event: {event_type}')
+    lines.append('data: ' + json.dumps(data, ensure_ascii=False, separators=(',', ':')))
+    return '\n'.join(lines) + '\n\n'
@@ -0,0 +1,79 @@
+"""記録・睡眠セッションのストリーミング出力
+
+カーソルから fetchmany で少しずつ読み出し、CSV / JSON Lines の文字列として
+順に返すジェネレーター。履歴の長さに関係なくメモリ使用量は一定になる。
+"""
+import csv
+import io
+import json
+
+CHUNK_SIZE = 500
+
+RECORD_COLUMNS = ['id', 'action', 'timestamp', 'local_date', 'memo', 'likes_count']
+SESSION_COLUMNS = ['sleep_ts', 'wake_ts', 'duration_seconds', 'local_date']
+
+
+def build_records_query(user_id, date_from=None, date_to=None, action=None):
+    sql = f'''
+        SELECT {', '.join(RECORD_COLUMNS)} FROM records
+        WHERE user_id = ? AND is_deleted = 0
+    '''
+    params = [user_id]
+    if action:
+        sql += ' AND action = ?'
+        params.append(action)
+    if date_from:
+        sql += ' AND local_date >= ?'
+        params.append(date_from)
+    if date_to:
+        sql += ' AND local_date <= ?'
+        params.append(date_to)
+    return sql + ' ORDER BY timestamp, id', params
+
+
+def build_sessions_query(user_id, date_from=None, date_to=None):
+    sql = f'''
+        SELECT {', '.join(SESSION_COLUMNS)} FROM sleep_sessions
+        WHERE user_id = ?
+    '''
+    params = [user_id]
+    if date_from:
+        sql += ' AND local_date >= ?'
+        params.append(date_from)
+    if date_to:
+        sql += ' AND local_date <= ?'
+        params.append(date_to)
+    return sql + ' ORDER BY wake_ts, wake_record_id', params
+
+
+def iter_chunks(conn, sql, params, chunk_size=CHUNK_SIZE):
+    """クエリ結果を chunk_size 行ずつ返す"""
+    cursor = conn.execute(sql, params)
+    try:
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            yield rows
+    finally:
+        cursor.close()
+
+
+def stream_csv(columns, chunks):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    for rows in chunks:
+        writer.writerows(tuple(row) for row in rows)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def stream_jsonl(columns, chunks):
+    for rows in chunks:
+        yield ''.join(
+            json.dumps(dict(zip(columns, row)), ensure_ascii=False) + '\n' for row in rows
+        )
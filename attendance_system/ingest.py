@@ -0,0 +1,183 @@
+"""睡眠・起床記録の一括取り込み
+
+CSV（ヘッダー: action,timestamp,memo[,user_id]）または JSON Lines を読み込み、
+検証・重複排除（同じ日に同じ行動は1件まで）をしてから
+executemany でまとめて挿入する。sleep_sessions も同じトランザクションで更新する。
+"""
+import csv
+import io
+import json
+from datetime import datetime
+
+import pytz
+
+from attendance_system.sleep_sessions import refresh_user_sessions
+
+JST = pytz.timezone('Asia/Tokyo')
+VALID_ACTIONS = ('sleep', 'wake_up')
+BATCH_SIZE = 500
+
+
+class IngestError(ValueError):
+    """入力全体を読み込めない（形式が不明など）"""
+
+
+def parse_rows(text, fmt):
+    """テキストを (行番号, dict) のリストにする"""
+    if fmt == 'csv':
+        reader = csv.DictReader(io.StringIO(text))
+        if not reader.fieldnames or 'action' not in reader.fieldnames or 'timestamp' not in reader.fieldnames:
+            raise IngestError('CSVには action と timestamp の列が必要です')
+        # ヘッダーが1行目なのでデータは2行目から
+        return [(line, row) for line, row in enumerate(reader, start=2)]
+    if fmt == 'jsonl':
+        rows = []
+        for line, raw in enumerate(text.splitlines(), start=1):
+            if not raw.strip():
+                continue
+            try:
+                row = json.loads(raw)
+            except ValueError:
+                row = None
+            rows.append((line, row if isinstance(row, dict) else None))
+        return rows
+    raise IngestError(f'未対応の形式です: {fmt}')
+
+
+def normalize_row(row, default_user_id=None, allowed_user_id=None):
+    """1行を検証して (user_id, action, timestamp, memo, local_date) を返す。不正なら ValueError"""
+    if row is None:
+        raise ValueError('JSONとして読み込めません')
+
+    action = str(row.get('action') or '').strip()
+    if action not in VALID_ACTIONS:
+        raise ValueError(f'action は sleep か wake_up を指定してください: {action!r}')
+
+    raw_user_id = row.get('user_id')
+    if raw_user_id in (None, ''):
+        user_id = default_user_id
+    else:
+        try:
+            user_id = int(raw_user_id)
+        except (TypeError, ValueError):
+            raise ValueError(f'user_id が不正です: {raw_user_id!r}')
+    if user_id is None:
+        raise ValueError('user_id がありません')
+    if allowed_user_id is not None and user_id != allowed_user_id:
+        raise ValueError('他のユーザーの記録は登録できません')
+
+    raw_timestamp = str(row.get('timestamp') or '').strip()
+    try:
+        timestamp = datetime.fromisoformat(raw_timestamp)
+    except ValueError:
+        raise ValueError(f'timestamp が不正です: {raw_timestamp!r}')
+    if timestamp.tzinfo is None:
+        # タイムゾーンなしは日本時間とみなす（/admin/add_record と同じ扱い）
+        timestamp = JST.localize(timestamp)
+    else:
+        # 並び順が既存の記録とそろうよう、日本時間に変換して保存する
+        timestamp = timestamp.astimezone(JST)
+
+    memo = row.get('memo') or ''
+    return user_id, action, timestamp.isoformat(), str(memo), timestamp.date().isoformat()
+
+
+def _existing_keys(conn, user_id, first_date, last_date):
+    rows = conn.execute('''
+        SELECT action, local_date FROM records
+        WHERE user_id = ? AND is_deleted = 0
+        AND local_date BETWEEN ? AND ?
+    ''', (user_id, first_date, last_date)).fetchall()
+    return {(user_id, action, local_date) for action, local_date in rows}
+
+
+def _insert_rows(conn, rows):
+    """検証済みの行をまとめて挿入し、睡眠セッションを作り直したユーザーIDの集合を返す"""
+    conn.executemany('''
+        INSERT INTO records (user_id, action, timestamp, memo, local_date)
+        VALUES (?, ?, ?, ?, ?)
+    ''', rows)
+    # 睡眠セッションも同じトランザクションで、ユーザーごとにバッチ内で最も古い時刻から作り直す
+    since = {}
+    for user_id, _, timestamp, _, _ in rows:
+        if user_id not in since or timestamp < since[user_id]:
+            since[user_id] = timestamp
+    for user_id, timestamp in since.items():
+        refresh_user_sessions(conn, user_id, timestamp)
+    return set(since)
+
+
+def ingest_batch(conn, batch):
+    """検証済みの (行番号, 値) を取り込み、(行ごとの結果, 更新したユーザーIDの集合) を返す（コミットはしない）
+
+    ユーザーの存在と同じ日の記録の確認を挿入と同じトランザクションで行うので、
+    確認の後にほかのリクエストが同じ日の記録を登録して重複することはない。
+    """
+    user_ids = sorted({values[0] for _, values in batch})
+    placeholders = ','.join('?' * len(user_ids))
+    known_users = {row[0] for row in conn.execute(
+        f'SELECT id FROM users WHERE id IN ({placeholders})', user_ids).fetchall()}
+
+    # 既存の記録（ユーザーごとに対象期間だけ読む）
+    seen = set()
+    date_ranges = {}
+    for _, (user_id, _, _, _, local_date) in batch:
+        first, last = date_ranges.get(user_id, (local_date, local_date))
+        date_ranges[user_id] = (min(first, local_date), max(last, local_date))
+    for user_id, (first, last) in date_ranges.items():
+        if user_id in known_users:
+            seen |= _existing_keys(conn, user_id, first, last)
+
+    results = []
+    to_insert = []
+    for line, values in batch:
+        user_id, action, _, _, local_date = values
+        if user_id not in known_users:
+            results.append({'line': line, 'status': 'invalid', 'error': f'ユーザーが存在しません: {user_id}'})
+            continue
+        key = (user_id, action, local_date)
+        if key in seen:
+            results.append({'line': line, 'status': 'duplicate'})
+            continue
+        seen.add(key)
+        to_insert.append(values)
+        results.append({'line': line, 'status': 'inserted'})
+    return results, _insert_rows(conn, to_insert) if to_insert else set()
+
+
+def ingest_rows(conn, rows, default_user_id=None, allowed_user_id=None, batch_size=BATCH_SIZE, write=None):
+    """パース済みの行を取り込み、(行ごとの結果, 更新したユーザーIDの集合) を返す
+
+    batch_size 行ごとに ingest_batch を1つのトランザクションで実行する。
+    前のバッチはコミット済みなので、バッチをまたぐ重複も既存の記録として見つかる。
+    write(fn) を渡すと、バッチごとの fn(conn) の実行とコミットをそれに任せる（アプリの run_write）。
+    省略すると conn で実行し、バッチごとにコミットする。
+    """
+    results = []
+    valid = []
+    for line, row in rows:
+        try:
+            valid.append((line, normalize_row(row, default_user_id, allowed_user_id)))
+        except ValueError as e:
+            results.append({'line': line, 'status': 'invalid', 'error': str(e)})
+
+    touched = set()
+    for start in range(0, len(valid), batch_size):
+        batch = valid[start:start + batch_size]
+        if write is None:
+            batch_results, batch_touched = ingest_batch(conn, batch)
+            conn.commit()
+        else:
+            batch_results, batch_touched = write(lambda write_conn: ingest_batch(write_conn, batch))
+        results.extend(batch_results)
+        touched |= batch_touched
+
+    results.sort(key=lambda r: r['line'])
+    return results, touched
+
+
+def summarize_results(results):
+    summary = {'inserted': 0, 'duplicate': 0, 'invalid': 0}
+    for result in results:
+        summary[result['status']] += 1
+    return summary
@@ -0,0 +1,117 @@
+"""いいねの登録と likes_count の集計
+
+likes は (user_id, record_id) の一意インデックスで重複を防ぎ、
+INSERT ... ON CONFLICT DO NOTHING で1文で登録する。
+records.likes_count はいいねのたびに更新せず、まだ反映していない行（likes.folded = 0）を
+まとめて数えて足し込む。likes の id は AUTOINCREMENT ではなく、最大の id の行が消えると
+使い回されるので、「どの id まで反映したか」ではなく行ごとに反映済みかを持つ。
+反映待ちの分は likes テーブル自体に残っているので、プロセスが落ちても失われない。
+ずれた場合は reconcile_like_counts で数え直す。
+"""
+import threading
+import time
+
+
+def create_like_tables(conn):
+    """一意インデックスと反映待ちの行のインデックスを作る（既存の重複いいねは古い方を残して削除）"""
+    has_unique = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = 'idx_likes_user_record'"
+    ).fetchone()
+    if not has_unique:
+        conn.execute('''
+            DELETE FROM likes WHERE id NOT IN (
+                SELECT MIN(id) FROM likes GROUP BY user_id, record_id
+            )
+        ''')
+        conn.execute('CREATE UNIQUE INDEX idx_likes_user_record ON likes (user_id, record_id)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_likes_record ON likes (record_id, id)')
+
+    # 反映待ちの行だけの部分インデックス
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_likes_unfolded ON likes (record_id) WHERE folded = 0')
+    if not has_unique:
+        # 重複を消した直後（初回）は、すべての件数を数え直して既存の行を反映済みにする
+        reconcile_like_counts(conn)
+
+
+def add_like(conn, user_id, record_id, timestamp):
+    """いいねを登録する。新しく登録できたら True、既にあれば False"""
+    cursor = conn.execute('''
+        INSERT INTO likes (user_id, record_id, timestamp) VALUES (?, ?, ?)
+        ON CONFLICT (user_id, record_id) DO NOTHING
+    ''', (user_id, record_id, timestamp))
+    return cursor.rowcount == 1
+
+
+def fold_like_deltas(conn):
+    """未反映のいいねを records.likes_count に足し込み、反映した件数を返す"""
+    if not conn.execute('SELECT 1 FROM likes WHERE folded = 0 LIMIT 1').fetchone():
+        return 0
+    # 最初の UPDATE で書き込みのトランザクションが始まるので、数えてから反映済みにするまでに
+    # ほかの接続のいいねが入り込むことはない
+    conn.execute('''
+        UPDATE records SET likes_count = COALESCE(likes_count, 0) + (
+            SELECT COUNT(*) FROM likes WHERE likes.record_id = records.id AND likes.folded = 0
+        )
+        WHERE id IN (SELECT record_id FROM likes WHERE folded = 0)
+    ''')
+    return conn.execute('UPDATE likes SET folded = 1 WHERE folded = 0').rowcount
+
+
+def reconcile_like_counts(conn, record_ids=None):
+    """likes テーブルから likes_count を数え直し、値が変わった記録の件数を返す
+
+    record_ids を省略するとすべての記録が対象で、未反映のいいねもまとめて反映する。
+    指定した場合は反映済みの範囲だけで数え直す（反映待ちの分は次の足し込みで入る）。
+    """
+    if record_ids is None:
+        conn.execute('UPDATE likes SET folded = 1 WHERE folded = 0')
+        where_sql, params = '', []
+    else:
+        record_ids = list(record_ids)
+        if not record_ids:
+            return 0
+        where_sql = f" AND id IN ({','.join('?' * len(record_ids))})"
+        params = record_ids
+    count_sql = 'SELECT COUNT(*) FROM likes WHERE likes.record_id = records.id AND likes.folded = 1'
+    cursor = conn.execute(f'''
+        UPDATE records SET likes_count = ({count_sql})
+        WHERE likes_count IS NOT ({count_sql}){where_sql}
+    ''', params)
+    return cursor.rowcount
+
+
+class LikeCounter:
+    """likes_count への足し込みをどのくらいの間隔でまとめるかを管理する
+
+    前回から interval 秒経っていればいいねと同じトランザクションで足し込み、
+    そうでなければタイマーで後からまとめて足し込む。
+    """
+
+    def __init__(self, interval=1.0):
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._last_fold = 0.0
+        self._timer = None
+
+    def due(self):
+        """足し込むべきなら True を返し、足し込んだものとして時刻を更新する"""
+        with self._lock:
+            now = time.monotonic()
+            if now - self._last_fold < self.interval:
+                return False
+            self._last_fold = now
+            return True
+
+    def schedule(self, fold):
+        """interval 秒後に fold() を1回だけ実行する（予約済みなら何もしない）"""
+        with self._lock:
+            if self._timer is not None and self._timer.is_alive():
+                return
+            self._timer = threading.Timer(self.interval, self._run, args=(fold,))
+            self._timer.daemon = True
+            self._timer.start()
+
+    def _run(self, fold):
+        with self._lock:
+            self._last_fold = time.monotonic()
+        fold()
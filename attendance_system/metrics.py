@@ -0,0 +1,279 @@
+"""リクエストの計測と Prometheus 形式での出力
+
+エンドポイントごとに
+- 応答時間のヒストグラム
+- 1リクエストあたりの DB 時間・クエリ数のヒストグラム
+- ステータスコード別のリクエスト数
+を集計する。DB 時間とクエリ数は InstrumentedConnection（接続のラッパー）で数える。
+キャッシュや接続プールの統計は add_collector で登録した関数から出力時に読む。
+値はワーカープロセスごとに持つ。
+"""
+import math
+import threading
+import time
+
+# 秒
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+
+class QueryStats:
+    """1つの接続（＝1リクエスト）で実行したクエリの件数と合計時間"""
+
+    __slots__ = ('queries', 'seconds')
+
+    def __init__(self):
+        self.queries = 0
+        self.seconds = 0.0
+
+
+class InstrumentedCursor:
+    """fetch* と行の読み出しにかかった時間も DB 時間に含めるためのラッパー
+
+    SQLite は行を読み出すときに実際の処理を進めるので、execute だけでは時間を数え切れない。
+    プロファイラーがあれば、クエリごとの時間（execute から読み出し終わりまで）も渡す。
+    """
+
+    def __init__(self, cursor, conn):
+        self._cursor = cursor
+        self._conn = conn
+        self._stats = conn.stats
+        self._profiler = conn.profiler
+        self._query = None
+        self._query_seconds = 0.0
+
+    def _timed(self, func, *args):
+        started = time.perf_counter()
+        try:
+            return func(*args)
+        finally:
+            elapsed = time.perf_counter() - started
+            self._stats.seconds += elapsed
+            if self._query is not None:
+                self._query_seconds += elapsed
+                if self._query_seconds >= self._profiler.threshold:
+                    # 1回の execute につき1度だけ記録する
+                    query, self._query = self._query, None
+                    self._profiler.record_slow(
+                        self._conn.raw, self._conn.endpoint, *query, self._query_seconds)
+
+    def _start(self, sql, params):
+        self._stats.queries += 1
+        if self._profiler is not None:
+            self._profiler.on_query(sql, params)
+            self._query = (sql, params) if self._profiler.threshold is not None else None
+            self._query_seconds = 0.0
+
+    def execute(self, sql, *args):
+        self._start(sql, args[0] if args else ())
+        self._timed(self._cursor.execute, sql, *args)
+        return self
+
+    def executemany(self, sql, *args):
+        # パラメータが複数あるので実行計画は取らない
+        self._start(sql, None)
+        self._timed(self._cursor.executemany, sql, *args)
+        return self
+
+    def fetchone(self):
+        return self._timed(self._cursor.fetchone)
+
+    def fetchmany(self, *args):
+        return self._timed(self._cursor.fetchmany, *args)
+
+    def fetchall(self):
+        return self._timed(self._cursor.fetchall)
+
+    def __iter__(self):
+        # 1行ずつ時間を測ると遅いので、まとめて読み出しながら返す
+        while True:
+            rows = self.fetchmany(256)
+            if not rows:
+                return
+            yield from rows
+
+    def __next__(self):
+        return self._timed(self._cursor.__next__)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        close = getattr(self._cursor, 'close', None)
+        if close is not None:
+            close()
+        return False
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+
+class InstrumentedConnection:
+    """接続のラッパー。execute / cursor / commit の回数と時間を stats に足す
+
+    profiler（profiler.QueryProfiler）を渡すと、遅いクエリを endpoint の名前で記録する。
+    """
+
+    def __init__(self, conn, stats=None, profiler=None, endpoint=None):
+        self._conn = conn
+        self.stats = stats if stats is not None else QueryStats()
+        self.profiler = profiler
+        self.endpoint = endpoint
+
+    @property
+    def raw(self):
+        return self._conn
+
+    def execute(self, *args):
+        return InstrumentedCursor(self._conn.cursor(), self).execute(*args)
+
+    def executemany(self, *args):
+        return InstrumentedCursor(self._conn.cursor(), self).executemany(*args)
+
+    def cursor(self, *args, **kwargs):
+        return InstrumentedCursor(self._conn.cursor(*args, **kwargs), self)
+
+    def commit(self):
+        started = time.perf_counter()
+        try:
+            self._conn.commit()
+        finally:
+            self.stats.seconds += time.perf_counter() - started
+
+    def __enter__(self):
+        self._conn.__enter__()
+        return self
+
+    def __exit__(self, *exc):
+        return self._conn.__exit__(*exc)
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.total = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[index] += 1
+                break
+        self.total += 1
+        self.sum += value
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{key}="{_escape(value)}"' for key, value in labels) + '}'
+
+
+def _number(value):
+    if isinstance(value, bool):
+        return '1' if value else '0'
+    if isinstance(value, float) and math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class MetricsRegistry:
+    """リクエストの計測値を集計し、Prometheus のテキスト形式で出力する"""
+
+    def __init__(self, prefix='nekoooo'):
+        self.prefix = prefix
+        self._lock = threading.Lock()
+        self._latency = {}
+        self._db_seconds = {}
+        self._db_queries = {}
+        self._requests = {}
+        self._collectors = []
+        self.started_at = time.time()
+
+    def observe_request(self, endpoint, method, status, seconds, db_stats=None):
+        key = (endpoint, method)
+        with self._lock:
+            self._latency.setdefault(key, Histogram(LATENCY_BUCKETS)).observe(seconds)
+            status_key = (endpoint, method, str(status))
+            self._requests[status_key] = self._requests.get(status_key, 0) + 1
+            if db_stats is not None:
+                self._db_seconds.setdefault(key, Histogram(LATENCY_BUCKETS)).observe(db_stats.seconds)
+                self._db_queries.setdefault(key, Histogram(QUERY_COUNT_BUCKETS)).observe(db_stats.queries)
+
+    def add_collector(self, collect):
+        """出力のたびに呼ぶ関数を登録する
+
+        collect() は (名前, 種類, 説明, [(ラベルの dict, 値), ...]) のリストを返す。
+        """
+        self._collectors.append(collect)
+
+    def summary(self):
+        """エンドポイントごとの件数・平均応答時間・平均 DB 時間・平均クエリ数"""
+        with self._lock:
+            rows = []
+            for key, histogram in self._latency.items():
+                db_seconds = self._db_seconds.get(key)
+                db_queries = self._db_queries.get(key)
+                rows.append({
+                    'endpoint': key[0],
+                    'method': key[1],
+                    'count': histogram.total,
+                    'avg_seconds': histogram.sum / histogram.total,
+                    'avg_db_seconds': db_seconds.sum / db_seconds.total if db_seconds else None,
+                    'avg_queries': db_queries.sum / db_queries.total if db_queries else None,
+                })
+        rows.sort(key=lambda row: row['count'] * row['avg_seconds'], reverse=True)
+        return rows
+
+    def _histogram_lines(self, name, help_text, histograms):
+        lines = [f'# HELP {name} {help_text}', f'# TYPE {name} histogram']
+        for (endpoint, method), histogram in sorted(histograms.items()):
+            labels = [('endpoint', endpoint), ('method', method)]
+            cumulative = 0
+            for bound, count in zip(histogram.buckets, histogram.counts):
+                cumulative += count
+                lines.append(f'{name}_bucket{_labels(labels + [("le", _number(float(bound)))])} {cumulative}')
+            lines.append(f'{name}_bucket{_labels(labels + [("le", "+Inf")])} {histogram.total}')
+            lines.append(f'{name}_sum{_labels(labels)} {_number(histogram.sum)}')
+            lines.append(f'{name}_count{_labels(labels)} {histogram.total}')
+        return lines
+
+    def render(self):
+        p = self.prefix
+        with self._lock:
+            lines = self._histogram_lines(
+                f'{p}_request_duration_seconds', 'リクエストの処理時間', self._latency)
+            lines += self._histogram_lines(
+                f'{p}_request_db_seconds', '1リクエストあたりの DB 時間', self._db_seconds)
+            lines += self._histogram_lines(
+                f'{p}_request_db_queries', '1リクエストあたりのクエリ数', self._db_queries)
+            lines += [f'# HELP {p}_requests_total ステータス別のリクエスト数',
+                      f'# TYPE {p}_requests_total counter']
+            for (endpoint, method, status), count in sorted(self._requests.items()):
+                labels = [('endpoint', endpoint), ('method', method), ('status', status)]
+                lines.append(f'{p}_requests_total{_labels(labels)} {count}')
+        lines += [f'# HELP {p}_process_start_time_seconds 計測を始めた時刻',
+                  f'# TYPE {p}_process_start_time_seconds gauge',
+                  f'{p}_process_start_time_seconds {_number(self.started_at)}']
+
+        for collect in self._collectors:
+            try:
+                metrics = collect()
+            except Exception as e:
+                lines.append(f'# 収集に失敗しました: {type(e).__name__}')
+                continue
+            for name, kind, help_text, samples in metrics:
+                lines += [f'# HELP {p}_{name} {help_text}', f'# TYPE {p}_{name} {kind}']
+                for labels, value in samples:
+                    if value is None:
+                        continue
+                    lines.append(f'{p}_{name}{_labels(sorted(labels.items()))} {_number(value)}')
+        return '\n'.join(lines) + '\n'
@@ -0,0 +1,98 @@
+"""(timestamp, id) をキーにしたカーソル方式のページネーション
+
+OFFSET は読み飛ばす行数に比例して遅くなるので、直前のページの端の
+(timestamp, id) を不透明なトークンにして次のページの起点にする。
+"""
+import base64
+import json
+
+from attendance_system.stats_cache import LRUCache
+
+
+class InvalidCursorError(ValueError):
+    """カーソルのトークンを読み取れない（改変された・別の形式など）"""
+
+
+def encode_cursor(direction, timestamp, record_id):
+    payload = json.dumps([direction, timestamp, record_id], separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(token):
+    """トークンを (direction, timestamp, id) に戻す。空なら None、不正なら InvalidCursorError"""
+    if not token:
+        return None
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        direction, timestamp, record_id = json.loads(base64.urlsafe_b64decode(padded))
+    except (ValueError, TypeError):
+        raise InvalidCursorError('カーソルが不正です')
+    if direction not in ('next', 'prev') or not isinstance(timestamp, str) or type(record_id) is not int:
+        raise InvalidCursorError('カーソルが不正です')
+    return direction, timestamp, record_id
+
+
+def fetch_keyset_page(conn, select_sql, where_sql, params, cursor, per_page,
+                      timestamp_column='timestamp', id_column='id'):
+    """新しい順のページを1つ取得する
+
+    select_sql は WHERE より前、where_sql は条件式（空なら '1'）。
+    取得行には timestamp_column / id_column を 'cursor_ts' / 'cursor_id' として含めること。
+    (rows, next_token, prev_token) を返す。cursor が不正なら InvalidCursorError。
+    """
+    decoded = decode_cursor(cursor)
+    query_params = list(params)
+    if decoded is None:
+        direction = 'next'
+        keyset_sql = ''
+    else:
+        direction, cursor_ts, cursor_id = decoded
+        operator = '<' if direction == 'next' else '>'
+        keyset_sql = f' AND ({timestamp_column}, {id_column}) {operator} (?, ?)'
+        query_params += [cursor_ts, cursor_id]
+
+    order = 'DESC' if direction == 'next' else 'ASC'
+    rows = conn.execute(
+        f'{select_sql} WHERE ({where_sql}){keyset_sql} '
+        f'ORDER BY {timestamp_column} {order}, {id_column} {order} LIMIT ?',
+        query_params + [per_page + 1]
+    ).fetchall()
+
+    has_more = len(rows) > per_page
+    rows = rows[:per_page]
+    if direction == 'prev':
+        rows.reverse()
+
+    next_token = prev_token = None
+    if rows:
+        first, last = rows[0], rows[-1]
+        if (direction == 'next' and has_more) or (direction == 'prev' and decoded is not None):
+            next_token = encode_cursor('next', last['cursor_ts'], last['cursor_id'])
+        if (direction == 'prev' and has_more) or (direction == 'next' and decoded is not None):
+            prev_token = encode_cursor('prev', first['cursor_ts'], first['cursor_id'])
+    return rows, next_token, prev_token
+
+
+class CountCache:
+    """COUNT(*) の結果を一定時間使い回す（件数表示はおおよそで十分なため）
+
+    キーには絞り込みの値も入るので、ユーザーごとの件数などで増え続けないよう
+    maxsize 件を超えたら最近使っていないものから捨てる。
+    """
+
+    def __init__(self, ttl=60.0, maxsize=1024):
+        self._cache = LRUCache(maxsize=maxsize, ttl=ttl)
+
+    def get(self, conn, sql, params=()):
+        key = (sql, tuple(params))
+        value = self._cache.get(key)
+        if value is None:
+            value = conn.execute(sql, params).fetchone()[0]
+            self._cache.set(key, value)
+        return value
+
+    def clear(self):
+        self._cache.clear()
+
+    def __len__(self):
+        return len(self._cache)
@@ -0,0 +1,159 @@
+"""SQL クエリのプロファイラー
+
+metrics.InstrumentedConnection からクエリごとに呼ばれ、
+- threshold 秒以上かかったクエリを、実行計画（EXPLAIN QUERY PLAN）と
+  実行したエンドポイントの名前つきで記録する（遅いクエリのログ）
+- query_budget() の中で実行されたクエリを数え、上限を超えたら QueryBudgetExceeded を投げる
+  （テストで使い、N+1 クエリが紛れ込んだら失敗させる）
+値はワーカープロセスごとに持つ。
+"""
+import sqlite3
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+# 実行計画を取るのはこれらで始まる文だけ（PRAGMA や BEGIN などは取らない）
+_EXPLAINABLE = ('SELECT', 'WITH', 'INSERT', 'UPDATE', 'DELETE', 'REPLACE')
+
+
+def normalize_sql(sql):
+    """空白や改行をまとめて1行にする"""
+    return ' '.join(sql.split())
+
+
+class QueryBudgetExceeded(AssertionError):
+    """クエリ数が上限を超えた"""
+
+    def __init__(self, label, budget, queries):
+        self.label = label
+        self.budget = budget
+        self.queries = queries
+        lines = '\n'.join(f'  {normalize_sql(sql)}' for sql in queries)
+        super().__init__(f'{label}: クエリ数 {len(queries)} が上限 {budget} を超えました\n{lines}')
+
+
+class QueryProfiler:
+    """遅いクエリの記録とクエリ数の上限チェック
+
+    threshold が None なら遅いクエリは記録しない。
+    log は遅いクエリ・上限超えのたびに1行のメッセージを渡して呼ぶ関数。
+    """
+
+    def __init__(self, threshold=0.1, explain=True, keep=100, log=None):
+        self.threshold = threshold
+        self.explain = explain
+        self.log = log
+        self._lock = threading.Lock()
+        self._slow = deque(maxlen=keep)
+        self._slow_counts = {}
+        self._budget_violations = {}
+        # query_budget・start_recording で記録中のリスト（スレッドごと）
+        self._local = threading.local()
+
+    def _recorders(self):
+        recorders = getattr(self._local, 'recorders', None)
+        if recorders is None:
+            recorders = self._local.recorders = []
+        return recorders
+
+    def on_query(self, sql, params=None):
+        recorders = getattr(self._local, 'recorders', None)
+        if recorders:
+            for queries, with_params in recorders:
+                queries.append((sql, params) if with_params else sql)
+
+    def _explain(self, conn, sql, params):
+        if params is None or not self.explain:
+            return None
+        if not sql.lstrip().upper().startswith(_EXPLAINABLE):
+            return None
+        prefix = 'EXPLAIN QUERY PLAN ' if isinstance(conn, sqlite3.Connection) else 'EXPLAIN '
+        try:
+            cursor = conn.cursor()
+            cursor.execute(prefix + sql, params)
+            rows = cursor.fetchall()
+        except Exception as e:
+            return f'（実行計画を取得できません: {type(e).__name__}: {e}）'
+        # SQLite は (id, parent, notused, detail)、PostgreSQL は1列の行を返す
+        return ' / '.join(str(row[-1]) for row in rows)
+
+    def record_slow(self, conn, endpoint, sql, params, seconds):
+        """遅いクエリを記録する。conn は実行計画を取るための（ラップしていない）接続"""
+        endpoint = endpoint or '-'
+        entry = {
+            'at': time.time(),
+            'endpoint': endpoint,
+            'seconds': seconds,
+            'sql': normalize_sql(sql),
+            'params': repr(params)[:200] if params is not None else None,
+            'plan': self._explain(conn, sql, params),
+        }
+        with self._lock:
+            self._slow.append(entry)
+            self._slow_counts[endpoint] = self._slow_counts.get(endpoint, 0) + 1
+        if self.log is not None:
+            self.log(f"遅いクエリ {seconds * 1000:.1f}ms [{endpoint}] {entry['sql']}"
+                     + (f" -- {entry['plan']}" if entry['plan'] else ''))
+
+    def slow_queries(self, endpoint=None):
+        """記録した遅いクエリ（新しい順）"""
+        with self._lock:
+            entries = list(self._slow)
+        entries.reverse()
+        if endpoint is not None:
+            entries = [entry for entry in entries if entry['endpoint'] == endpoint]
+        return entries
+
+    def start_recording(self, with_params=False):
+        """このスレッドで実行されるクエリの記録を始め、記録先のリストを返す
+
+        with_params=True なら SQL だけでなく (SQL, パラメータ) を記録する
+        （executemany のパラメータは None）。実際の文の実行計画を確かめるのに使う。
+        """
+        queries = []
+        self._recorders().append((queries, with_params))
+        return queries
+
+    def stop_recording(self, queries):
+        recorders = self._recorders()
+        for index, (recorder, _) in enumerate(recorders):
+            if recorder is queries:
+                del recorders[index]
+                break
+        return queries
+
+    def check_budget(self, label, budget, queries):
+        """queries が budget 件を超えていたら記録して QueryBudgetExceeded を返す（超えていなければ None）"""
+        if budget is None or len(queries) <= budget:
+            return None
+        with self._lock:
+            self._budget_violations[label] = self._budget_violations.get(label, 0) + 1
+        error = QueryBudgetExceeded(label, budget, list(queries))
+        if self.log is not None:
+            self.log(f'クエリ数の上限超え [{label}] {len(queries)} > {budget}')
+        return error
+
+    @contextmanager
+    def query_budget(self, budget, label='query_budget'):
+        """ブロック内のクエリが budget 件を超えたら QueryBudgetExceeded を投げる
+
+            with query_profiler.query_budget(5, 'all_records'):
+                client.get('/all_records')
+        """
+        queries = self.start_recording()
+        try:
+            yield queries
+        finally:
+            self.stop_recording(queries)
+        error = self.check_budget(label, budget, queries)
+        if error is not None:
+            raise error
+
+    def stats(self):
+        with self._lock:
+            return {
+                'threshold': self.threshold,
+                'slow_queries': dict(self._slow_counts),
+                'budget_violations': dict(self._budget_violations),
+            }
@@ -0,0 +1,122 @@
+"""主要クエリの実行計画チェック
+
+records・likes へのアクセスがインデックスを使わない全件スキャンに
+戻っていないかを EXPLAIN QUERY PLAN で確認する。
+テストでは tests/test_query_budgets.py が各ルートを実際に呼び、QueryProfiler で記録した
+文とパラメータをそのまま check_statements で確認する（ルートの SQL を写す必要がない）。
+HOT_QUERIES は稼働中のデータベース向けの代表的なクエリで、
+`flask --app attendance_system.app check-query-plans` で確認でき、
+全件スキャンがあれば終了コード1で失敗する。
+"""
+from attendance_system.profiler import normalize_sql
+
+# (名前, SQL, パラメータ) ― ルートで使っている WHERE 句と同じ形にしておくこと
+HOT_QUERIES = [
+    ('index: 今日の記録数', '''
+        SELECT COUNT(*) FROM records
+        WHERE user_id = ? AND is_deleted = 0 AND local_date = DATE('now', '+9 hours')
+    ''', (1,)),
+    ('index: 今日の記録', '''
+        SELECT id, action, memo, likes_count FROM records
+        WHERE user_id = ? AND is_deleted = 0 AND local_date = DATE('now', '+9 hours')
+        ORDER BY timestamp DESC LIMIT ? OFFSET ?
+    ''', (1, 10, 0)),
+    ('record: 同日同アクションの確認', '''
+        SELECT * FROM records
+        WHERE user_id = ? AND action = ? AND local_date = DATE(?, '+9 hours')
+        AND is_deleted = 0
+    ''', (1, 'sleep', '2025-01-01T00:00:00+09:00')),
+    ('day_records: 管理者', '''
+        SELECT r.id, u.username FROM records r
+        JOIN users u ON r.user_id = u.id
+        WHERE r.timestamp >= ? AND r.timestamp < ? AND r.local_date = ?
+        ORDER BY r.timestamp ASC
+    ''', ('2024-12-31', '2025-01-03', '2025-01-01')),
+    ('day_records: ユーザー', '''
+        SELECT id, action FROM records
+        WHERE user_id = ? AND is_deleted = 0 AND local_date = ?
+        ORDER BY timestamp ASC
+    ''', (1, '2025-01-01')),
+    ('day_records: 当日の睡眠', '''
+        SELECT action, timestamp FROM records
+        WHERE user_id = ? AND is_deleted = 0 AND local_date = ?
+        AND (action = 'sleep' OR action = 'wake_up')
+        ORDER BY timestamp
+    ''', (1, '2025-01-01')),
+    ('all_records: フィード', '''
+        SELECT users.username, records.id,
+            EXISTS (
+                SELECT 1 FROM likes WHERE likes.user_id = ? AND likes.record_id = records.id
+            ) as liked
+        FROM records JOIN users ON records.user_id = users.id
+        WHERE (records.is_deleted = 0 AND users.is_private = 0 AND users.username != 'admin')
+        AND (records.timestamp, records.id) < (?, ?)
+        ORDER BY records.timestamp DESC, records.id DESC LIMIT ?
+    ''', (1, '2025-01-01', 0, 21)),
+    ('admin_user_records: 記録数', '''
+        SELECT COUNT(*) FROM records WHERE user_id = ? AND is_deleted = 0
+    ''', (1,)),
+    ('admin_user_records: 記録', '''
+        SELECT id, action FROM records WHERE (user_id = ?)
+        AND (timestamp, id) < (?, ?)
+        ORDER BY timestamp DESC, id DESC LIMIT ?
+    ''', (1, '2025-01-01', 0, 21)),
+    ('calendar: 月の記録数', '''
+        SELECT local_date, COUNT(*) FROM records
+        WHERE user_id = ? AND is_deleted = 0 AND local_date BETWEEN ? AND ?
+        GROUP BY local_date
+    ''', (1, '2025-01-01', '2025-01-31')),
+    ('sleep_sessions: 再計算', '''
+        SELECT id, action, timestamp, local_date FROM records
+        WHERE user_id = ? AND is_deleted = 0
+        AND (action = 'sleep' OR action = 'wake_up')
+        AND (timestamp, id) > (?, ?)
+        ORDER BY timestamp, id
+    ''', (1, '2025-01-01', 0)),
+    ('rollups: 週別平均', '''
+        SELECT period_key, start_date, sum_duration, count FROM weekly_rollups
+        WHERE user_id = ? ORDER BY period_key DESC
+    ''', (1,)),
+    ('rollups: 月別平均', '''
+        SELECT period_key, start_date, sum_duration, count FROM monthly_rollups
+        WHERE user_id = ? ORDER BY period_key DESC
+    ''', (1,)),
+]
+
+
+def find_full_scans(conn, sql, params=(), tables=('records', 'r', 'likes', 'weekly_rollups', 'monthly_rollups')):
+    """実行計画のうち、インデックスを使わずに tables（別名を含む）を走査している行を返す"""
+    plan = conn.execute('EXPLAIN QUERY PLAN ' + sql, params).fetchall()
+    offending = []
+    for row in plan:
+        detail = row[3]
+        words = detail.replace('SCAN TABLE ', 'SCAN ').split()
+        if len(words) >= 2 and words[0] == 'SCAN' and words[1] in tables and 'INDEX' not in detail:
+            offending.append(detail)
+    return offending
+
+
+def check_statements(conn, statements):
+    """QueryProfiler.start_recording(with_params=True) で記録した実際の文を確認する
+
+    {1行にした SQL: 全件スキャンの計画行} を返す。パラメータのない文（executemany）や
+    実行計画のない文（PRAGMA・BEGIN など）は飛ばす。
+    """
+    failures = {}
+    for sql, params in statements:
+        if params is None or not sql.lstrip().upper().startswith(('SELECT', 'WITH', 'UPDATE', 'DELETE')):
+            continue
+        offending = find_full_scans(conn, sql, params)
+        if offending:
+            failures[normalize_sql(sql)] = offending
+    return failures
+
+
+def check_hot_queries(conn, queries=HOT_QUERIES):
+    """{名前: 全件スキャンの計画行} を返す。問題がなければ空"""
+    failures = {}
+    for name, sql, params in queries:
+        offending = find_full_scans(conn, sql, params)
+        if offending:
+            failures[name] = offending
+    return failures
@@ -0,0 +1,198 @@
+"""週別・月別の睡眠時間の集計テーブル
+
+weekly_rollups / monthly_rollups に (user_id, period_key) ごとの
+睡眠時間の合計（秒）と件数を持っておき、sleep_sessions への追加・削除のたびに
+トリガーで差分だけ足し引きする。週別・月別の平均はこの表を
+主キーの範囲で読むだけで求められる。
+
+週は ISO 週（月曜始まり、キーは ISO 年 + 週番号 例: 2026-W01）、
+月は local_date の年月（例: 2026-01）で区切る。
+
+平均は秒の合計 / 3600 / 件数で求める。stats.py の基準実装（時間に直した値を1件ずつ足す）とは
+足し算の丸め誤差だけ違い（avg_duration で 1e-9 時間未満）、平均がちょうど分の境界にあるときは
+表示の分が1分、評価の境界にあるときは評価が食い違うことがある。許容範囲は tests/test_rollups.py で確認している。
+"""
+from collections import defaultdict
+from datetime import date, timedelta
+
+ROLLUP_TABLES = ('weekly_rollups', 'monthly_rollups')
+
+
+def _monday_sql(column):
+    # 月曜日（%w は日曜が 0）
+    return f"date({column}, '-' || ((CAST(strftime('%w', {column}) AS INTEGER) + 6) % 7) || ' days')"
+
+
+def _week_key_sql(column):
+    # ISO 週はその週の木曜日が属する年と、その年の何番目の木曜日かで決まる
+    thursday = f"date({_monday_sql(column)}, '+3 days')"
+    return (f"strftime('%Y', {thursday}) || '-W' || "
+            f"printf('%02d', (CAST(strftime('%j', {thursday}) AS INTEGER) - 1) / 7 + 1)")
+
+
+def _month_key_sql(column):
+    return f"substr({column}, 1, 7)"
+
+
+def _month_start_sql(column):
+    return f"substr({column}, 1, 7) || '-01'"
+
+
+# (テーブル, period_key の式, start_date の式)
+_ROLLUPS = (
+    ('weekly_rollups', _week_key_sql, _monday_sql),
+    ('monthly_rollups', _month_key_sql, _month_start_sql),
+)
+
+
+def week_key(d):
+    iso_year, iso_week, _ = d.isocalendar()
+    return f"{iso_year}-W{iso_week:02d}"
+
+
+def week_start(d):
+    return d - timedelta(days=d.weekday())
+
+
+def create_rollup_tables(conn):
+    """集計テーブルとトリガーを作る。テーブルを新しく作ったときは True"""
+    created = False
+    for table, _, _ in _ROLLUPS:
+        exists = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (table,)
+        ).fetchone()
+        conn.execute(f'''
+            CREATE TABLE IF NOT EXISTS {table} (
+                user_id INTEGER NOT NULL,
+                period_key TEXT NOT NULL,
+                sum_duration REAL NOT NULL,
+                count INTEGER NOT NULL,
+                start_date TEXT NOT NULL,
+                PRIMARY KEY (user_id, period_key)
+            )
+        ''')
+        created = created or not exists
+
+    inserts = []
+    deletes = []
+    for table, key_sql, start_sql in _ROLLUPS:
+        inserts.append(f'''
+            INSERT INTO {table} (user_id, period_key, sum_duration, count, start_date)
+            VALUES (NEW.user_id, {key_sql('NEW.local_date')}, NEW.duration_seconds, 1,
+                    {start_sql('NEW.local_date')})
+            ON CONFLICT (user_id, period_key) DO UPDATE SET
+                sum_duration = sum_duration + excluded.sum_duration,
+                count = count + 1;
+        ''')
+        deletes.append(f'''
+            UPDATE {table} SET
+                sum_duration = sum_duration - OLD.duration_seconds,
+                count = count - 1
+            WHERE user_id = OLD.user_id AND period_key = {key_sql('OLD.local_date')};
+            DELETE FROM {table}
+            WHERE user_id = OLD.user_id AND period_key = {key_sql('OLD.local_date')} AND count <= 0;
+        ''')
+    conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_rollups_sessions_insert AFTER INSERT ON sleep_sessions
+        BEGIN
+            {''.join(inserts)}
+        END
+    ''')
+    conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_rollups_sessions_delete AFTER DELETE ON sleep_sessions
+        BEGIN
+            {''.join(deletes)}
+        END
+    ''')
+    return created
+
+
+def rebuild_rollups(conn, user_id=None):
+    """sleep_sessions から集計テーブルを作り直す（user_id を省略すると全ユーザー）"""
+    where_sql, params = ('WHERE user_id = ?', (user_id,)) if user_id is not None else ('', ())
+    for table in ROLLUP_TABLES:
+        conn.execute(f'DELETE FROM {table} {where_sql}', params)
+
+    weeks = defaultdict(lambda: [0.0, 0, None])
+    months = defaultdict(lambda: [0.0, 0, None])
+    rows = conn.execute(f'''
+        SELECT user_id, local_date, duration_seconds FROM sleep_sessions {where_sql}
+        ORDER BY user_id, wake_ts, wake_record_id
+    ''', params)
+    for row_user_id, local_date, duration in rows:
+        d = date.fromisoformat(local_date)
+        for groups, key, start in (
+            (weeks, week_key(d), week_start(d)),
+            (months, local_date[:7], d.replace(day=1)),
+        ):
+            group = groups[(row_user_id, key)]
+            group[0] += duration
+            group[1] += 1
+            group[2] = start.isoformat()
+
+    for table, groups in (('weekly_rollups', weeks), ('monthly_rollups', months)):
+        conn.executemany(f'''
+            INSERT INTO {table} (user_id, period_key, sum_duration, count, start_date)
+            VALUES (?, ?, ?, ?, ?)
+        ''', [(uid, key, total, count, start) for (uid, key), (total, count, start) in groups.items()])
+
+
+def _load(conn, table, user_id, date_from=None, date_to=None):
+    # 主キー (user_id, period_key) の範囲読み。period_key の並びは期間の並びと同じ
+    sql = f'SELECT period_key, start_date, sum_duration, count FROM {table} WHERE user_id = ?'
+    params = [user_id]
+    if date_from is not None:
+        sql += ' AND start_date >= ?'
+        params.append(date_from)
+    if date_to is not None:
+        sql += ' AND start_date <= ?'
+        params.append(date_to)
+    return conn.execute(sql + ' ORDER BY period_key DESC', params).fetchall()
+
+
+def _split_hours(value):
+    hours = int(value)
+    return hours, int((value - hours) * 60)
+
+
+def _format_day(d):
+    return f'{d.year:04d}/{d.month:02d}/{d.day:02d}'
+
+
+def weekly_averages(conn, user_id, evaluate, date_from=None, date_to=None):
+    """週別平均（新しい週から順）。形式は stats.calculate_weekly_average と同じ"""
+    weekly_avgs = []
+    for key, start, total, count in _load(conn, 'weekly_rollups', user_id, date_from, date_to):
+        avg_sleep = total / 3600 / count
+        avg_hours, avg_minutes = _split_hours(avg_sleep)
+        start_date = date.fromisoformat(start)
+        weekly_avgs.append({
+            'period': f"{_format_day(start_date)}～{_format_day(start_date + timedelta(days=6))}",
+            'avg_hours': avg_hours,
+            'avg_minutes': avg_minutes,
+            'avg_duration': avg_sleep,
+            'evaluation': evaluate(avg_sleep),
+            'start_date': start_date,
+            'week_key': key,
+            'record_days': count
+        })
+    return weekly_avgs
+
+
+def monthly_averages(conn, user_id, evaluate, date_from=None, date_to=None):
+    """月別平均（新しい月から順）。形式は stats.calculate_monthly_average と同じ"""
+    monthly_avgs = []
+    for key, start, total, count in _load(conn, 'monthly_rollups', user_id, date_from, date_to):
+        avg_sleep = total / 3600 / count
+        avg_hours, avg_minutes = _split_hours(avg_sleep)
+        start_date = date.fromisoformat(start)
+        monthly_avgs.append({
+            'period': f"{start_date.year}年{start_date.month}月",
+            'avg_hours': avg_hours,
+            'avg_minutes': avg_minutes,
+            'avg_duration': avg_sleep,
+            'evaluation': evaluate(avg_sleep),
+            'start_date': start_date,
+            'record_days': count
+        })
+    return monthly_avgs
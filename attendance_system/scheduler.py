@@ -0,0 +1,345 @@
+"""定期ジョブのスケジューラー
+
+cron 形式（分 時 日 月 曜日）のスケジュールでジョブを実行する。
+- ジョブの次回実行時刻・結果は scheduled_jobs テーブルに保存する
+- 複数のプロセスで動かしても、scheduler_lease のリース（期限付きのロック）を
+  持つ1プロセスだけがジョブを実行する。ジョブの実行中はリースを定期的に延長するので、
+  lease_seconds より長いジョブでも途中でほかのプロセスに奪われない
+- 失敗したジョブは backoff 秒から倍々に間隔を空けて max_retries 回まで再試行し、
+  それでも失敗したら次の定刻まで待つ
+
+通常は gunicorn の設定（gunicorn.conf.py）から `flask run-scheduler` を別プロセスとして1つだけ起動する。
+"""
+import os
+import socket
+import sqlite3
+import sys
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import timedelta
+
+# (最小値, 最大値)。曜日は 0 と 7 がどちらも日曜日
+_FIELDS = ((0, 59), (0, 23), (1, 31), (1, 12), (0, 7))
+# 1年先まで探しても見つからないスケジュール（2月30日など）は無効とみなす
+_MAX_SEARCH_DAYS = 366 * 4
+
+
+class CronError(ValueError):
+    """cron 形式の書式が正しくない"""
+
+
+def _parse_field(text, low, high):
+    values = set()
+    for part in text.split(','):
+        step = 1
+        if '/' in part:
+            part, step_text = part.split('/', 1)
+            if not step_text.isdigit() or int(step_text) == 0:
+                raise CronError(f'間隔が不正です: {text}')
+            step = int(step_text)
+        if part == '*':
+            start, end = low, high
+        elif '-' in part:
+            start_text, end_text = part.split('-', 1)
+            if not (start_text.isdigit() and end_text.isdigit()):
+                raise CronError(f'範囲が不正です: {text}')
+            start, end = int(start_text), int(end_text)
+        elif part.isdigit():
+            start = int(part)
+            end = high if step > 1 else start
+        else:
+            raise CronError(f'値が不正です: {text}')
+        if not low <= start <= end <= high:
+            raise CronError(f'範囲外の値です: {text}')
+        values.update(range(start, end + 1, step))
+    return values
+
+
+class CronSchedule:
+    """cron 形式のスケジュール（分 時 日 月 曜日。*, 数値, a-b, */n, カンマ区切りに対応）"""
+
+    def __init__(self, expression):
+        fields = expression.split()
+        if len(fields) != 5:
+            raise CronError(f'5つの項目が必要です: {expression}')
+        self.expression = expression
+        (self.minutes, self.hours, self.days, self.months,
+         weekdays) = (_parse_field(text, low, high) for text, (low, high) in zip(fields, _FIELDS))
+        self.weekdays = {day % 7 for day in weekdays}
+        # 日と曜日の両方が指定されている場合は、cron と同じくどちらかに合えばよい
+        self._any_day = fields[2] == '*'
+        self._any_weekday = fields[4] == '*'
+
+    def _day_matches(self, moment):
+        day_ok = moment.day in self.days
+        weekday_ok = (moment.weekday() + 1) % 7 in self.weekdays
+        if self._any_day or self._any_weekday:
+            return day_ok and weekday_ok
+        return day_ok or weekday_ok
+
+    def next_after(self, moment):
+        """moment より後で最初に一致する時刻（秒以下は 0）"""
+        candidate = moment.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        limit = candidate + timedelta(days=_MAX_SEARCH_DAYS)
+        while candidate < limit:
+            if candidate.month not in self.months or not self._day_matches(candidate):
+                candidate = (candidate + timedelta(days=1)).replace(hour=0, minute=0)
+            elif candidate.hour not in self.hours:
+                candidate = (candidate + timedelta(hours=1)).replace(minute=0)
+            elif candidate.minute not in self.minutes:
+                candidate += timedelta(minutes=1)
+            else:
+                return candidate
+        raise CronError(f'一致する時刻がありません: {self.expression}')
+
+
+class Job:
+    def __init__(self, name, schedule, func, max_retries=3, backoff=60.0, max_backoff=3600.0):
+        self.name = name
+        self.schedule = CronSchedule(schedule)
+        self.func = func
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+
+    def retry_delay(self, attempts):
+        return min(self.backoff * 2 ** (attempts - 1), self.max_backoff)
+
+
+def create_scheduler_tables(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS scheduled_jobs (
+            name TEXT PRIMARY KEY,
+            schedule TEXT NOT NULL,
+            next_run_at TEXT NOT NULL,
+            last_started_at TEXT,
+            last_finished_at TEXT,
+            last_status TEXT,
+            last_error TEXT,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            run_count INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS scheduler_lease (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            owner TEXT NOT NULL,
+            expires_at REAL NOT NULL
+        )
+    ''')
+
+
+class Scheduler:
+    """ジョブの登録・リースの取得・期限の来たジョブの実行を行う
+
+    connect() は scheduled_jobs を置く DB への新しい接続を返す関数。
+    now() はタイムゾーン付きの現在時刻を返す関数（時刻は ISO 形式の文字列で保存するので、
+    常に同じタイムゾーンで返すこと）。
+    """
+
+    def __init__(self, connect, now, tick=15.0, lease_seconds=60.0):
+        self.connect = connect
+        self.now = now
+        self.tick = tick
+        self.lease_seconds = lease_seconds
+        self.owner = f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}'
+        self.jobs = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._synced = False
+
+    def register(self, name, schedule, func, **options):
+        """ジョブを登録する。func() は引数なしで呼ばれ、例外を投げると失敗として扱う"""
+        self.jobs[name] = Job(name, schedule, func, **options)
+        self._synced = False
+        return self.jobs[name]
+
+    def _sync(self, conn):
+        # 登録済みのジョブを scheduled_jobs に反映する（スケジュールが変わったら次回時刻も作り直す）
+        now = self.now()
+        for job in self.jobs.values():
+            conn.execute('''
+                INSERT INTO scheduled_jobs (name, schedule, next_run_at) VALUES (?, ?, ?)
+                ON CONFLICT (name) DO UPDATE SET
+                    schedule = excluded.schedule,
+                    next_run_at = excluded.next_run_at,
+                    attempts = 0
+                WHERE scheduled_jobs.schedule != excluded.schedule
+            ''', (job.name, job.schedule.expression, job.schedule.next_after(now).isoformat()))
+        conn.commit()
+        self._synced = True
+
+    def acquire_lease(self, conn):
+        """リースを取得・延長できたら True（期限切れのリースは誰でも取れる）"""
+        now = time.time()
+        conn.execute(
+            'INSERT OR IGNORE INTO scheduler_lease (id, owner, expires_at) VALUES (1, ?, 0)',
+            (self.owner,))
+        cursor = conn.execute('''
+            UPDATE scheduler_lease SET owner = ?, expires_at = ?
+            WHERE id = 1 AND (owner = ? OR expires_at < ?)
+        ''', (self.owner, now + self.lease_seconds, self.owner, now))
+        conn.commit()
+        return cursor.rowcount == 1
+
+    @contextmanager
+    def _heartbeat(self):
+        """ジョブの実行中、lease_seconds の 1/3 ごとに別の接続でリースを延長する"""
+        stop = threading.Event()
+
+        def renew():
+            conn = self.connect()
+            try:
+                while not stop.wait(self.lease_seconds / 3):
+                    try:
+                        if not self.acquire_lease(conn):
+                            print('スケジューラーのリースを失いました', file=sys.stderr)
+                    except sqlite3.Error as e:
+                        print(f'スケジューラーのリースを延長できませんでした: {e}', file=sys.stderr)
+            finally:
+                conn.close()
+
+        thread = threading.Thread(target=renew, name='job-scheduler-heartbeat', daemon=True)
+        thread.start()
+        try:
+            yield
+        finally:
+            stop.set()
+            thread.join()
+
+    def release_lease(self, conn):
+        conn.execute('DELETE FROM scheduler_lease WHERE id = 1 AND owner = ?', (self.owner,))
+        conn.commit()
+
+    def run_pending(self):
+        """リーダーなら期限の来たジョブを実行し、実行したジョブ名のリストを返す"""
+        with self._lock:
+            conn = self.connect()
+            try:
+                create_scheduler_tables(conn)
+                if not self._synced:
+                    self._sync(conn)
+                if not self.acquire_lease(conn):
+                    return []
+                now = self.now().isoformat()
+                due = conn.execute('''
+                    SELECT name, next_run_at, attempts FROM scheduled_jobs
+                    WHERE next_run_at <= ? ORDER BY next_run_at
+                ''', (now,)).fetchall()
+                executed = []
+                for name, next_run_at, attempts in due:
+                    job = self.jobs.get(name)
+                    if job is None or not self._claim(conn, job, next_run_at):
+                        continue
+                    with self._heartbeat():
+                        self._execute(conn, job, attempts)
+                    executed.append(name)
+                return executed
+            finally:
+                conn.close()
+
+    def _claim(self, conn, job, next_run_at):
+        # next_run_at が読んだときのままなら自分が実行する（別プロセスとの二重実行を防ぐ）
+        now = self.now()
+        cursor = conn.execute('''
+            UPDATE scheduled_jobs SET next_run_at = ?, last_started_at = ?, last_status = 'running'
+            WHERE name = ? AND next_run_at = ?
+        ''', (job.schedule.next_after(now).isoformat(), now.isoformat(), job.name, next_run_at))
+        conn.commit()
+        return cursor.rowcount == 1
+
+    def _execute(self, conn, job, attempts):
+        try:
+            job.func()
+        except Exception as e:
+            attempts += 1
+            print(f'ジョブ {job.name} が失敗しました（{attempts}回目）: {e}', file=sys.stderr)
+            finished = self.now()
+            if attempts <= job.max_retries:
+                conn.execute('''
+                    UPDATE scheduled_jobs SET next_run_at = ?, last_finished_at = ?,
+                        last_status = 'retrying', last_error = ?, attempts = ?
+                    WHERE name = ?
+                ''', ((finished + timedelta(seconds=job.retry_delay(attempts))).isoformat(),
+                      finished.isoformat(), str(e), attempts, job.name))
+            else:
+                # 再試行を使い切ったら次の定刻（claim 時に設定済み）まで待つ
+                conn.execute('''
+                    UPDATE scheduled_jobs SET last_finished_at = ?, last_status = 'failed',
+                        last_error = ?, attempts = 0
+                    WHERE name = ?
+                ''', (finished.isoformat(), str(e), job.name))
+        else:
+            conn.execute('''
+                UPDATE scheduled_jobs SET last_finished_at = ?, last_status = 'ok',
+                    last_error = NULL, attempts = 0, run_count = run_count + 1
+                WHERE name = ?
+            ''', (self.now().isoformat(), job.name))
+        conn.commit()
+
+    def run_job(self, name):
+        """リースに関係なく、その場でジョブを1回実行する（手動実行用）"""
+        job = self.jobs[name]
+        with self._lock:
+            conn = self.connect()
+            try:
+                create_scheduler_tables(conn)
+                if not self._synced:
+                    self._sync(conn)
+                conn.execute('''
+                    UPDATE scheduled_jobs SET last_started_at = ?, last_status = 'running'
+                    WHERE name = ?
+                ''', (self.now().isoformat(), name))
+                conn.commit()
+                self._execute(conn, job, 0)
+                return conn.execute(
+                    'SELECT last_status FROM scheduled_jobs WHERE name = ?', (name,)).fetchone()[0]
+            finally:
+                conn.close()
+
+    def status(self):
+        conn = self.connect()
+        try:
+            create_scheduler_tables(conn)
+            conn.row_factory = sqlite3.Row
+            jobs = [dict(row) for row in conn.execute('SELECT * FROM scheduled_jobs ORDER BY name')]
+            lease = conn.execute('SELECT owner, expires_at FROM scheduler_lease WHERE id = 1').fetchone()
+        finally:
+            conn.close()
+        return {
+            'owner': self.owner,
+            'running': self._thread is not None and self._thread.is_alive(),
+            'leader': dict(lease) if lease else None,
+            'is_leader': bool(lease) and lease['owner'] == self.owner and lease['expires_at'] > time.time(),
+            'jobs': jobs,
+        }
+
+    def _run(self):
+        while True:
+            try:
+                self.run_pending()
+            except sqlite3.Error as e:
+                print(f'スケジューラーでエラーが発生しました: {e}', file=sys.stderr)
+            if self._stop.wait(self.tick):
+                break
+
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name='job-scheduler', daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        conn = self.connect()
+        try:
+            self.release_lease(conn)
+        finally:
+            conn.close()
@@ -0,0 +1,146 @@
+"""睡眠セッション（就寝→起床のペア）の派生テーブル
+
+records を毎回すべて読み直して就寝・起床をペアにする代わりに、
+書き込みのたびに影響範囲だけ再計算して sleep_sessions に保存しておく。
+ペアの作り方は従来の average_sleep / get_sleep_times と同じ:
+就寝で開始時刻を上書きし、開始時刻がある状態の起床でセッションを確定する。
+"""
+from datetime import date, datetime
+
+
+def table_exists(conn, name):
+    row = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (name,)
+    ).fetchone()
+    return row is not None
+
+
+def create_sleep_sessions_table(cursor):
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS sleep_sessions (
+        id INTEGER PRIMARY KEY,
+        user_id INTEGER NOT NULL,
+        sleep_record_id INTEGER NOT NULL,
+        wake_record_id INTEGER NOT NULL,
+        sleep_ts TEXT NOT NULL,
+        wake_ts TEXT NOT NULL,
+        duration_seconds REAL NOT NULL,
+        local_date TEXT NOT NULL,
+        FOREIGN KEY(user_id) REFERENCES users(id)
+    )
+    ''')
+    cursor.execute('''
+    CREATE INDEX IF NOT EXISTS idx_sleep_sessions_user_wake
+    ON sleep_sessions (user_id, wake_ts, wake_record_id)
+    ''')
+    # 管理者の全体統計（日ごとのアクティブユーザー数）用
+    cursor.execute('''
+    CREATE INDEX IF NOT EXISTS idx_sleep_sessions_date_user
+    ON sleep_sessions (local_date, user_id)
+    ''')
+
+
+def pair_events(rows):
+    """(id, action, timestamp, local_date) の時系列からセッションを組み立てる"""
+    sessions = []
+    sleep_start = None
+    for row in rows:
+        if row['action'] == 'sleep':
+            sleep_start = row
+        elif row['action'] == 'wake_up' and sleep_start:
+            try:
+                duration = (datetime.fromisoformat(row['timestamp'])
+                            - datetime.fromisoformat(sleep_start['timestamp'])).total_seconds()
+            except (TypeError, ValueError):
+                # タイムゾーン有無が混在した古いデータはペアにできない
+                duration = None
+            if duration is not None:
+                sessions.append((
+                    sleep_start['id'], row['id'],
+                    sleep_start['timestamp'], row['timestamp'],
+                    duration, row['local_date']
+                ))
+            sleep_start = None
+    return sessions
+
+
+def refresh_user_sessions(conn, user_id, since_timestamp=None):
+    """user_id のセッションを since_timestamp 以降について作り直す
+
+    since_timestamp より前に起床が確定しているセッションは影響を受けないので、
+    その最後のものを起点に、以降のイベントだけを再生する。
+    None の場合は全期間を作り直す。呼び出し側でコミットすること。
+    """
+    anchor = None
+    if since_timestamp is not None:
+        anchor = conn.execute('''
+            SELECT wake_ts, wake_record_id FROM sleep_sessions
+            WHERE user_id = ? AND wake_ts < ?
+            ORDER BY wake_ts DESC, wake_record_id DESC
+            LIMIT 1
+        ''', (user_id, since_timestamp)).fetchone()
+
+    if anchor:
+        conn.execute('''
+            DELETE FROM sleep_sessions
+            WHERE user_id = ? AND (wake_ts, wake_record_id) > (?, ?)
+        ''', (user_id, anchor['wake_ts'], anchor['wake_record_id']))
+        rows = conn.execute('''
+            SELECT id, action, timestamp, local_date
+            FROM records
+            WHERE user_id = ? AND is_deleted = 0
+            AND (action = 'sleep' OR action = 'wake_up')
+            AND (timestamp, id) > (?, ?)
+            ORDER BY timestamp, id
+        ''', (user_id, anchor['wake_ts'], anchor['wake_record_id'])).fetchall()
+    else:
+        conn.execute('DELETE FROM sleep_sessions WHERE user_id = ?', (user_id,))
+        rows = conn.execute('''
+            SELECT id, action, timestamp, local_date
+            FROM records
+            WHERE user_id = ? AND is_deleted = 0
+            AND (action = 'sleep' OR action = 'wake_up')
+            ORDER BY timestamp, id
+        ''', (user_id,)).fetchall()
+
+    sessions = pair_events(rows)
+    conn.executemany('''
+        INSERT INTO sleep_sessions
+        (user_id, sleep_record_id, wake_record_id, sleep_ts, wake_ts, duration_seconds, local_date)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    ''', [(user_id,) + s for s in sessions])
+    return len(sessions)
+
+
+def backfill_sleep_sessions(conn):
+    """全ユーザーのセッションを records から作り直す。作成件数を返す"""
+    total = 0
+    user_ids = [row['id'] for row in conn.execute('SELECT id FROM users').fetchall()]
+    for user_id in user_ids:
+        total += refresh_user_sessions(conn, user_id)
+    return total
+
+
+def load_sleep_times(conn, user_id):
+    """集計用の睡眠時間リストを sleep_sessions から取得する"""
+    rows = conn.execute('''
+        SELECT local_date, duration_seconds
+        FROM sleep_sessions
+        WHERE user_id = ?
+        ORDER BY wake_ts, wake_record_id
+    ''', (user_id,)).fetchall()
+
+    sleep_times = []
+    for row in rows:
+        sleep_duration = row['duration_seconds'] / 3600  # 時間単位
+        sleep_date = date.fromisoformat(row['local_date'])
+        sleep_times.append({
+            'date': sleep_date,
+            'duration': sleep_duration,
+            'hours': int(sleep_duration),
+            'minutes': int((sleep_duration - int(sleep_duration)) * 60),
+            'week': sleep_date.isocalendar()[1],  # ISO週番号
+            'month': sleep_date.month,
+            'year': sleep_date.year
+        })
+    return sleep_times
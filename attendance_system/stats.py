@@ -0,0 +1,222 @@
+"""睡眠時間の評価と集計（純粋関数）
+
+sleep_times は {'date', 'duration'（時間）, 'hours', 'minutes', 'week', 'month', 'year'} の
+dict のリスト（sleep_sessions.load_sleep_times・aggregation.SessionColumns.to_sleep_times の形）。
+画面の集計は aggregation（列データ）と rollups（集計テーブル）で行っており、
+ここの関数はその基準となる実装。結果を変えるときは aggregation・rollups・comparisons も合わせること。
+"""
+from datetime import date, datetime, timedelta
+
+NO_DIFF = {'diff_hours': 0, 'diff_minutes': 0, 'is_increase': False}
+
+
+def evaluate_sleep(sleep_duration):
+    """睡眠時間の評価を行う"""
+    optimal_sleep = 7.0  # 適正睡眠時間
+    sleep_ratio = sleep_duration / optimal_sleep
+
+    if sleep_ratio >= 1.5:
+        return "寝すぎ⁉"
+    elif 1.286 <= sleep_ratio < 1.5:
+        return "ちょい寝すぎか。"
+    elif 1.0 <= sleep_ratio < 1.286:
+        return "良好だよ☻"
+    elif 0.858 <= sleep_ratio < 1.0:
+        return "もう少し寝てほしいかも..."
+    elif 0.50 <= sleep_ratio < 0.858:
+        return "頼むこれ以上は..."
+    else:
+        return "いい加減もっと寝ろよ！！"
+
+
+def calculate_average(sleep_times):
+    """全期間の平均睡眠時間を計算"""
+    if not sleep_times:
+        return {'avg_hours': 0, 'avg_minutes': 0, 'evaluation': None}
+
+    total_sleep = sum(item['duration'] for item in sleep_times)
+    avg_sleep = total_sleep / len(sleep_times)
+    avg_hours = int(avg_sleep)
+    avg_minutes = int((avg_sleep - avg_hours) * 60)
+
+    return {
+        'avg_hours': avg_hours,
+        'avg_minutes': avg_minutes,
+        'avg_duration': avg_sleep,
+        'evaluation': evaluate_sleep(avg_sleep) if len(sleep_times) >= 3 else None
+    }
+
+
+def calculate_overall_average(sleep_times):
+    """全ての記録の平均睡眠時間を計算"""
+    if not sleep_times:
+        return {'avg_hours': 0, 'avg_minutes': 0, 'evaluation': "データなし"}
+
+    total_sleep = sum(item['duration'] for item in sleep_times)
+    avg_sleep = total_sleep / len(sleep_times)
+    avg_hours = int(avg_sleep)
+    avg_minutes = int((avg_sleep - avg_hours) * 60)
+    evaluation = evaluate_sleep(avg_sleep) if len(sleep_times) >= 3 else "評価不可"
+
+    return {
+        'avg_hours': avg_hours,
+        'avg_minutes': avg_minutes,
+        'avg_duration': avg_sleep,
+        'evaluation': evaluation
+    }
+
+
+def calculate_weekly_average(sleep_times):
+    """ISO 週ごとの平均睡眠時間（新しい週から順）
+
+    週は ISO 週（月曜始まり、年をまたぐ週は ISO 年に属する。例: 2024/12/30～2025/01/05 は 2025-W01）。
+    以前は「暦年 + ISO 週番号」をキーにし、開始日を %W（年内最初の月曜日から第1週）で求めていたため、
+    1月1日が月曜でない年は週が1週遅れて表示されていた（2025-W01 が 2025/01/06～ になる）。
+    """
+    if not sleep_times:
+        return []
+
+    # 週ごとにグループ化
+    weeks = {}
+    for item in sleep_times:
+        iso_year, iso_week, _ = item['date'].isocalendar()
+        week_key = f"{iso_year}-W{iso_week:02d}"
+        if week_key not in weeks:
+            weeks[week_key] = []
+        weeks[week_key].append(item)
+
+    # 各週の平均を計算
+    weekly_avgs = []
+    for week_key, items in weeks.items():
+        total_sleep = sum(item['duration'] for item in items)
+        avg_sleep = total_sleep / len(items)
+        avg_hours = int(avg_sleep)
+        avg_minutes = int((avg_sleep - avg_hours) * 60)
+
+        year, week = week_key.split('-W')
+        start_date = date.fromisocalendar(int(year), int(week), 1)
+        end_date = start_date + timedelta(days=6)
+
+        weekly_avgs.append({
+            'period': f"{start_date.strftime('%Y/%m/%d')}～{end_date.strftime('%Y/%m/%d')}",
+            'avg_hours': avg_hours,
+            'avg_minutes': avg_minutes,
+            'avg_duration': avg_sleep,
+            'evaluation': evaluate_sleep(avg_sleep),
+            'start_date': start_date,
+            'week_key': week_key,
+            'record_days': len(items)
+        })
+
+    weekly_avgs.sort(key=lambda x: x['start_date'], reverse=True)
+    return weekly_avgs
+
+
+def calculate_monthly_average(sleep_times):
+    """月ごとの平均睡眠時間（新しい月から順）"""
+    if not sleep_times:
+        return []
+
+    # 月ごとにグループ化
+    months = {}
+    for item in sleep_times:
+        month_key = f"{item['year']}-{item['month']:02d}"
+        if month_key not in months:
+            months[month_key] = []
+        months[month_key].append(item)
+
+    # 各月の平均を計算
+    monthly_avgs = []
+    for month_key, items in months.items():
+        total_sleep = sum(item['duration'] for item in items)
+        avg_sleep = total_sleep / len(items)
+        avg_hours = int(avg_sleep)
+        avg_minutes = int((avg_sleep - avg_hours) * 60)
+
+        year, month = map(int, month_key.split('-'))
+        start_date = datetime(year, month, 1).date()
+
+        monthly_avgs.append({
+            'period': f"{year}年{month}月",
+            'avg_hours': avg_hours,
+            'avg_minutes': avg_minutes,
+            'avg_duration': avg_sleep,
+            'evaluation': evaluate_sleep(avg_sleep),
+            'start_date': start_date,
+            'record_days': len(items)
+        })
+
+    monthly_avgs.sort(key=lambda x: x['start_date'], reverse=True)
+    return monthly_avgs
+
+
+def calculate_comparisons(sleep_times):
+    """前日比、先週比、先月比を計算"""
+    if not sleep_times:
+        return {
+            'yesterday': dict(NO_DIFF),
+            'last_week': dict(NO_DIFF),
+            'last_month': dict(NO_DIFF)
+        }
+
+    # 日付でソート
+    sorted_times = sorted(sleep_times, key=lambda x: x['date'], reverse=True)
+
+    # 最新の記録の日付
+    today = sorted_times[0]['date']
+
+    # 前日比
+    yesterday_diff = calculate_diff(sorted_times, 0, 1)
+
+    # 先週比（同じ曜日）
+    last_week_idx = next((i for i, item in enumerate(sorted_times) if (today - item['date']).days >= 7 and today.weekday() == item['date'].weekday()), None)
+    last_week_diff = calculate_diff(sorted_times, 0, last_week_idx) if last_week_idx else dict(NO_DIFF)
+
+    # 先月比（同じ日）
+    last_month_day = today.day
+    last_month = today.month - 1 if today.month > 1 else 12
+    last_month_year = today.year if today.month > 1 else today.year - 1
+    last_month_idx = next((i for i, item in enumerate(sorted_times) if item['date'].year == last_month_year and item['date'].month == last_month and item['date'].day == last_month_day), None)
+    last_month_diff = calculate_diff(sorted_times, 0, last_month_idx) if last_month_idx else dict(NO_DIFF)
+
+    return {
+        'yesterday': yesterday_diff,
+        'last_week': last_week_diff,
+        'last_month': last_month_diff
+    }
+
+
+def calculate_diff(sorted_times, current_idx, compare_idx):
+    """2つの睡眠時間の差分を計算"""
+    if not sorted_times or compare_idx is None or current_idx >= len(sorted_times) or compare_idx >= len(sorted_times):
+        return dict(NO_DIFF)
+
+    current = sorted_times[current_idx]['duration']
+    compare = sorted_times[compare_idx]['duration']
+    diff = current - compare
+    is_increase = diff > 0
+
+    diff_abs = abs(diff)
+    diff_hours = int(diff_abs)
+    diff_minutes = int((diff_abs - diff_hours) * 60)
+
+    return {
+        'diff_hours': diff_hours,
+        'diff_minutes': diff_minutes,
+        'is_increase': is_increase
+    }
+
+
+def revise_previous_day_comparison(sleep_times):
+    """各記録の1つ前の記録との差（"+1時間5分" の形。先頭は "-"）"""
+    comparisons = []
+    for i in range(len(sleep_times)):
+        if i == 0:
+            comparisons.append("-")
+        else:
+            diff = sleep_times[i]['duration'] - sleep_times[i-1]['duration']
+            diff_hours = int(abs(diff))
+            diff_minutes = int((abs(diff) - diff_hours) * 60)
+            comparison = f"{'+' if diff > 0 else '-'}{diff_hours}時間{diff_minutes}分"
+            comparisons.append(comparison)
+    return comparisons
@@ -0,0 +1,218 @@
+"""睡眠統計のキャッシュ
+
+統計は本人が記録・削除したときにしか変わらないので、ユーザーと期間ごとに
+計算結果を保持し、書き込み側で明示的に無効化する。
+プロセス内の LRU（TTL付き）に加えて、複数の gunicorn ワーカーで共有できる
+SQLite ファイルのバックエンドを任意で使える。
+
+version(user_id) を渡すと、その値（アプリではメインの DB のトリガーで進む
+user_data_versions）をキーに含める。別のプロセスでの書き込みでも値が変わるので、
+どのバックエンドでも古い統計は読まれない。
+"""
+import os
+import pickle
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+class LRUCache:
+    """TTL 付きのプロセス内 LRU キャッシュ"""
+
+    def __init__(self, maxsize=256, ttl=300.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._data = OrderedDict()
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            value, expires_at = item
+            if expires_at < time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + self.ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete_prefix(self, prefix):
+        with self._lock:
+            for key in [k for k in self._data if k.startswith(prefix)]:
+                del self._data[key]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+class SQLiteCacheBackend:
+    """ワーカー間で共有するファイルキャッシュ（値は pickle で保存）"""
+
+    def __init__(self, path, ttl=300.0):
+        self.path = path
+        self.ttl = ttl
+        self._local = threading.local()
+        conn = self._connection()
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS cache (
+                key TEXT PRIMARY KEY,
+                value BLOB NOT NULL,
+                expires_at REAL NOT NULL
+            )
+        ''')
+        # 世代番号などのカウンター（期限なし。clear でも消さない）
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS counters (
+                key TEXT PRIMARY KEY,
+                value INTEGER NOT NULL
+            )
+        ''')
+        conn.commit()
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or getattr(self._local, 'pid', None) != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5)
+            conn.execute('PRAGMA journal_mode = WAL')
+            conn.execute('PRAGMA synchronous = NORMAL')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def get(self, key):
+        row = self._connection().execute(
+            'SELECT value, expires_at FROM cache WHERE key = ?', (key,)
+        ).fetchone()
+        if row is None or row[1] < time.time():
+            return None
+        return pickle.loads(row[0])
+
+    def set(self, key, value):
+        conn = self._connection()
+        conn.execute(
+            'INSERT OR REPLACE INTO cache (key, value, expires_at) VALUES (?, ?, ?)',
+            (key, pickle.dumps(value, pickle.HIGHEST_PROTOCOL), time.time() + self.ttl)
+        )
+        conn.commit()
+
+    def get_counter(self, key):
+        row = self._connection().execute('SELECT value FROM counters WHERE key = ?', (key,)).fetchone()
+        return row[0] if row else 0
+
+    def incr(self, key):
+        """カウンターを1つ進めて新しい値を返す（読み取りと更新を1つの書き込みトランザクションで行う）"""
+        conn = self._connection()
+        conn.execute('''
+            INSERT INTO counters (key, value) VALUES (?, 1)
+            ON CONFLICT (key) DO UPDATE SET value = value + 1
+        ''', (key,))
+        value = conn.execute('SELECT value FROM counters WHERE key = ?', (key,)).fetchone()[0]
+        conn.commit()
+        return value
+
+    def delete_prefix(self, prefix):
+        conn = self._connection()
+        # LIKE のワイルドカードを使わず、範囲指定で前方一致させる
+        conn.execute('DELETE FROM cache WHERE key >= ? AND key < ?', (prefix, prefix + '\uffff'))
+        conn.commit()
+
+    def clear(self):
+        conn = self._connection()
+        conn.execute('DELETE FROM cache')
+        conn.commit()
+
+
+class StatsCache:
+    """ユーザー・期間ごとの統計キャッシュ
+
+    共有バックエンドがある場合はユーザーごとの世代番号もそこに置き、
+    他のワーカーが持っているプロセス内キャッシュも無効化で読まれなくなるようにする。
+    version があれば、その値もキーに含める（invalidate_user を呼ばない書き込みにも追従する）。
+    """
+
+    def __init__(self, local=None, shared=None, version=None):
+        self.local = local or LRUCache()
+        self.shared = shared
+        self.version = version
+        self._lock = threading.Lock()
+        self._generations = {}
+        self._counters = {'hits': 0, 'shared_hits': 0, 'misses': 0, 'invalidations': 0}
+
+    def _count(self, name):
+        with self._lock:
+            self._counters[name] += 1
+
+    def _generation(self, user_id):
+        if self.shared is not None:
+            generation = self.shared.get_counter(f'gen:{user_id}')
+        else:
+            generation = self._generations.get(user_id, 0)
+        if self.version is not None:
+            return f'{self.version(user_id)}.{generation}'
+        return generation
+
+    def get_or_compute(self, user_id, period, compute):
+        """キャッシュがあれば返し、なければ compute() の結果を保存して返す"""
+        key = f'stats:{user_id}:{self._generation(user_id)}:{period}'
+        value = self.local.get(key)
+        if value is not None:
+            self._count('hits')
+            return value
+        if self.shared is not None:
+            value = self.shared.get(key)
+            if value is not None:
+                self._count('shared_hits')
+                self.local.set(key, value)
+                return value
+        self._count('misses')
+        value = compute()
+        if value is not None:
+            self.local.set(key, value)
+            if self.shared is not None:
+                self.shared.set(key, value)
+        return value
+
+    def invalidate_user(self, user_id):
+        """user_id のすべての期間のキャッシュを無効化する"""
+        self._count('invalidations')
+        self.local.delete_prefix(f'stats:{user_id}:')
+        if self.shared is not None:
+            self.shared.incr(f'gen:{user_id}')
+            self.shared.delete_prefix(f'stats:{user_id}:')
+        else:
+            with self._lock:
+                self._generations[user_id] = self._generations.get(user_id, 0) + 1
+
+    def clear(self):
+        self.local.clear()
+        if self.shared is not None:
+            self.shared.clear()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+        lookups = stats['hits'] + stats['shared_hits'] + stats['misses']
+        stats['hit_rate'] = (stats['hits'] + stats['shared_hits']) / lookups if lookups else 0.0
+        stats['local_entries'] = len(self.local)
+        stats['backend'] = 'sqlite' if self.shared is not None else 'memory'
+        return stats
+
+
+def create_stats_cache(backend='memory', path=None, maxsize=256, ttl=300.0, version=None):
+    shared = None
+    if backend == 'sqlite':
+        shared = SQLiteCacheBackend(path, ttl=ttl)
+    return StatsCache(local=LRUCache(maxsize=maxsize, ttl=ttl), shared=shared, version=version)
@@ -0,0 +1,135 @@
+"""SQLite の書き込みを1本のスレッドにまとめるキュー
+
+各リクエストは書き込み処理 fn(conn) をキューに入れて結果を待つ。
+書き込みスレッドは専用の接続で、溜まっている処理をまとめて1トランザクションで
+実行してからコミットする。処理ごとに SAVEPOINT を切るので、1つが失敗しても
+同じバッチの他の処理は巻き込まれない。
+ロックを取り合う書き込み側の接続がプロセス内で1本になり、コミット回数も減る。
+"""
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+
+class WriteQueue:
+    def __init__(self, connect, batch_size=64, max_wait=0.002):
+        self.connect = connect
+        self.batch_size = batch_size
+        self.max_wait = max_wait
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._counters = {'submitted': 0, 'completed': 0, 'failed': 0,
+                          'batches': 0, 'max_batch': 0, 'commit_time_total': 0.0}
+
+    def start(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='sqlite-writer', daemon=True)
+                self._thread.start()
+        return self
+
+    def stop(self):
+        thread = self._thread
+        if thread is not None and thread.is_alive():
+            self._queue.put(None)
+            thread.join()
+        self._thread = None
+
+    def submit(self, fn, timeout=None):
+        """fn(conn) を書き込みスレッドで実行し、コミット後にその戻り値を返す
+
+        fn 内で発生した例外はそのまま呼び出し側で送出される。
+        """
+        future = Future()
+        with self._lock:
+            self._counters['submitted'] += 1
+        self._queue.put((fn, future))
+        return future.result(timeout)
+
+    def _next_batch(self):
+        first = self._queue.get()
+        if first is None:
+            return None
+        batch = [first]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                job = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if job is None:
+                # 停止の合図は今のバッチを処理してから受け取る
+                self._queue.put(None)
+                break
+            batch.append(job)
+        return batch
+
+    def _run(self):
+        conn = self.connect()
+        conn.isolation_level = None
+        try:
+            while True:
+                batch = self._next_batch()
+                if batch is None:
+                    return
+                self._run_batch(conn, batch)
+        finally:
+            conn.close()
+
+    def _run_batch(self, conn, batch):
+        done = []
+        failed = 0
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+        except Exception as e:
+            for _, future in batch:
+                future.set_exception(e)
+            self._record(len(batch), 0, len(batch), 0.0)
+            return
+
+        for fn, future in batch:
+            conn.execute('SAVEPOINT job')
+            try:
+                result = fn(conn)
+            except Exception as e:
+                conn.execute('ROLLBACK TO job')
+                conn.execute('RELEASE job')
+                future.set_exception(e)
+                failed += 1
+            else:
+                conn.execute('RELEASE job')
+                done.append((future, result))
+
+        started = time.perf_counter()
+        try:
+            conn.execute('COMMIT')
+        except Exception as e:
+            if conn.in_transaction:
+                conn.execute('ROLLBACK')
+            for future, _ in done:
+                future.set_exception(e)
+            self._record(len(batch), 0, len(batch), time.perf_counter() - started)
+            return
+        for future, result in done:
+            future.set_result(result)
+        self._record(len(batch), len(done), failed, time.perf_counter() - started)
+
+    def _record(self, size, completed, failed, commit_time):
+        with self._lock:
+            self._counters['batches'] += 1
+            self._counters['completed'] += completed
+            self._counters['failed'] += failed
+            self._counters['max_batch'] = max(self._counters['max_batch'], size)
+            self._counters['commit_time_total'] += commit_time
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+        stats['queue_depth'] = self._queue.qsize()
+        stats['avg_batch'] = (
+            (stats['completed'] + stats['failed']) / stats['batches'] if stats['batches'] else 0.0)
+        stats['running'] = self._thread is not None and self._thread.is_alive()
+        return stats
@@ -0,0 +1,87 @@
+"""集計エンジンのベンチマーク
+
+stats.py の calculate_* 関数（dict のリストを Python のループで集計）と
+aggregation モジュール（列データで集計）を同じデータで実行し、所要時間を比較する。
+結果が完全に一致することは tests/test_stats.py で確認する。
+
+    python benchmarks/bench_aggregation.py [セッション数 ...]
+"""
+import os
+import random
+import sys
+import time
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from attendance_system import aggregation, stats  # noqa: E402
+
+
+def generate_rows(n, seed=0):
+    """(local_date, duration_seconds) を n 件作る（同日の複数セッションや欠けた日を含む）"""
+    rng = random.Random(seed)
+    day = date(1990, 1, 1)
+    rows = []
+    while len(rows) < n:
+        day += timedelta(days=rng.choices((0, 1, 2), weights=(5, 90, 5))[0])
+        rows.append((day.isoformat(), rng.uniform(3, 11) * 3600))
+    return rows
+
+
+def to_sleep_times(rows):
+    """(local_date, duration_seconds) を calculate_* 関数に渡す dict のリストにする"""
+    sleep_times = []
+    for local_date, duration_seconds in rows:
+        sleep_duration = duration_seconds / 3600
+        sleep_date = date.fromisoformat(local_date)
+        sleep_times.append({
+            'date': sleep_date,
+            'duration': sleep_duration,
+            'hours': int(sleep_duration),
+            'minutes': int((sleep_duration - int(sleep_duration)) * 60),
+            'week': sleep_date.isocalendar()[1],
+            'month': sleep_date.month,
+            'year': sleep_date.year
+        })
+    return sleep_times
+
+
+def legacy_summary(rows):
+    sleep_times = to_sleep_times(rows)
+    return {
+        'daily_avg': stats.calculate_average(sleep_times),
+        'overall_avg': stats.calculate_overall_average(sleep_times),
+        'comparisons': stats.calculate_comparisons(sleep_times)
+    }
+
+
+def columnar_summary(rows):
+    # 週別・月別は rollups（集計テーブル）で求めるので bench_rollups.py で測る
+    columns = aggregation.SessionColumns.from_rows(rows)
+    return {
+        'daily_avg': aggregation.average(columns, stats.evaluate_sleep),
+        'overall_avg': aggregation.overall_average(columns, stats.evaluate_sleep),
+        'comparisons': aggregation.comparisons(columns)
+    }
+
+
+def best_of(func, rows, repeat=5):
+    best = float('inf')
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func(rows)
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def main(sizes):
+    print(f"{'sessions':>10} {'legacy(ms)':>12} {'columnar(ms)':>13} {'speedup':>8}")
+    for n in sizes:
+        rows = generate_rows(n)
+        legacy = best_of(legacy_summary, rows)
+        columnar = best_of(columnar_summary, rows)
+        print(f'{n:>10} {legacy * 1000:>12.1f} {columnar * 1000:>13.1f} {legacy / columnar:>7.1f}x')
+
+
+if __name__ == '__main__':
+    main([int(arg) for arg in sys.argv[1:]] or [1000, 10000, 50000])
@@ -0,0 +1,45 @@
+"""比較値（前日比・先週比・先月比・移動平均）のベンチマーク
+
+stats.calculate_comparisons（全件を並べ替えて先頭から探す）と、
+comparisons.SleepIndex（日付順の索引を1回作り、二分探索で引く）を比べる。
+結果が calculate_comparisons と同じになること、期間の集計が正しいことは tests/test_stats.py で確認する。
+
+作る時間は、平均睡眠の画面で1回比べるとき（累積和などを作らない）と、
+API 用にキャッシュへ置くとき（prepare() まで）に分けて出す。引く時間は作ったあとの1回分。
+
+    python benchmarks/bench_comparisons.py [セッション数 ...]
+"""
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from attendance_system import aggregation, comparisons, stats  # noqa: E402
+from attendance_system.comparisons import SleepIndex  # noqa: E402
+from bench_aggregation import generate_rows, to_sleep_times  # noqa: E402
+from bench_stats import best_of  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('sizes', nargs='*', type=int, default=[1000, 10000, 100000, 1000000])
+    args = parser.parse_args()
+
+    print(f"{'sessions':>10}{'legacy(ms)':>12}{'build(ms)':>11}{'prepare(ms)':>13}{'lookup(us)':>12}{'api(us)':>10}")
+    for n in args.sizes:
+        rows = generate_rows(n)
+        sleep_times = to_sleep_times(rows)
+        columns = aggregation.SessionColumns.from_rows(rows)
+        legacy = best_of(lambda: stats.calculate_comparisons(sleep_times))
+        build = best_of(lambda: comparisons.comparisons(SleepIndex.from_columns(columns)))
+        prepare = best_of(lambda: SleepIndex.from_columns(columns).prepare())
+        index = SleepIndex.from_columns(columns).prepare()
+        lookup = best_of(lambda: comparisons.comparisons(index), max_repeat=1000)
+        api = best_of(lambda: comparisons.build_comparisons(index, (7, 30, 365)), max_repeat=1000)
+        print(f'{n:>10}{legacy * 1000:>12.3f}{build * 1000:>11.3f}{prepare * 1000:>13.3f}'
+              f'{lookup * 1e6:>12.1f}{api * 1e6:>10.1f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+"""all_records の「いいね済み」判定のベンチマーク
+
+10万件いいねしているユーザーで、フィード1ページ（20件）を表示するときの
+従来の方法（そのユーザーのいいねを全件読み込んでリストで in 判定）と
+フィードのクエリ内の EXISTS で表示行の分だけ確認する方法を比較する。
+両者の判定結果が一致することも確認する。
+
+    python benchmarks/bench_liked_lookup.py [いいね件数]
+"""
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+
+# app の import でデータベースが初期化されるため、一時ディレクトリを使う
+os.environ.setdefault('RENDER_DATA_DIR', tempfile.mkdtemp())
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from attendance_system import app as app_module  # noqa: E402
+from attendance_system.pagination import fetch_keyset_page  # noqa: E402
+
+PER_PAGE = 20
+PAGES = 10
+
+CONDITIONS = "records.is_deleted=0 AND users.is_private=0 AND users.username != 'admin'"
+BASE_QUERY = """
+    SELECT users.username, users.id as user_id, records.id, records.action,
+        records.memo, records.likes_count,
+        records.timestamp as cursor_ts, records.id as cursor_id
+    FROM records JOIN users ON records.user_id=users.id"""
+EXISTS_QUERY = """
+    SELECT users.username, users.id as user_id, records.id, records.action,
+        records.memo, records.likes_count,
+        EXISTS (
+            SELECT 1 FROM likes WHERE likes.user_id = ? AND likes.record_id = records.id
+        ) as liked,
+        records.timestamp as cursor_ts, records.id as cursor_id
+    FROM records JOIN users ON records.user_id=users.id"""
+
+
+def seed(conn, likes):
+    """records を likes * 1.2 件作り、1人のユーザーがそのうち likes 件にいいねした状態にする"""
+    conn.execute("INSERT INTO users (username, password) VALUES ('author', 'x'), ('liker', 'x')")
+    author = conn.execute("SELECT id FROM users WHERE username = 'author'").fetchone()[0]
+    liker = conn.execute("SELECT id FROM users WHERE username = 'liker'").fetchone()[0]
+    total = int(likes * 1.2)
+    start = datetime(2000, 1, 1, tzinfo=timezone(timedelta(hours=9)))
+    conn.executemany(
+        "INSERT INTO records (user_id, action, timestamp, memo, local_date) VALUES (?, 'sleep', ?, '', ?)",
+        [(author, (start + timedelta(minutes=i)).isoformat(), (start + timedelta(minutes=i)).date().isoformat())
+         for i in range(total)]
+    )
+    first = conn.execute('SELECT MIN(id) FROM records').fetchone()[0]
+    # 6件中5件にいいね（ページごとにいいね済み・未いいねが混ざる）
+    liked = [(liker, first + i) for i in range(total) if i % 6][:likes]
+    conn.executemany("INSERT INTO likes (user_id, record_id, timestamp) VALUES (?, ?, '')", liked)
+    conn.commit()
+    return liker
+
+
+def legacy_pages(conn, user_id):
+    flags = []
+    cursor = None
+    for _ in range(PAGES):
+        records, cursor, _ = fetch_keyset_page(
+            conn, BASE_QUERY, CONDITIONS, [], cursor, PER_PAGE,
+            timestamp_column='records.timestamp', id_column='records.id')
+        liked_ids = [row['record_id'] for row in conn.execute(
+            'SELECT record_id FROM likes WHERE user_id=?', (user_id,)).fetchall()]
+        flags.extend(record['id'] in liked_ids for record in records)
+    return flags
+
+
+def exists_pages(conn, user_id):
+    flags = []
+    cursor = None
+    for _ in range(PAGES):
+        records, cursor, _ = fetch_keyset_page(
+            conn, EXISTS_QUERY, CONDITIONS, [user_id], cursor, PER_PAGE,
+            timestamp_column='records.timestamp', id_column='records.id')
+        flags.extend(bool(record['liked']) for record in records)
+    return flags
+
+
+def best_of(func, conn, user_id, repeat=3):
+    best = float('inf')
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func(conn, user_id)
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def main(likes):
+    with app_module.app.app_context():
+        conn = app_module.get_db_connection()
+        user_id = seed(conn, likes)
+        if legacy_pages(conn, user_id) != exists_pages(conn, user_id):
+            raise SystemExit('いいね済みの判定結果が一致しません')
+        legacy = best_of(legacy_pages, conn, user_id) / PAGES
+        exists = best_of(exists_pages, conn, user_id) / PAGES
+    print(f'likes={likes} per_page={PER_PAGE}')
+    print(f"{'legacy(ms/page)':>16} {'exists(ms/page)':>16} {'speedup':>8}")
+    print(f'{legacy * 1000:>16.2f} {exists * 1000:>16.2f} {legacy / exists:>7.1f}x')
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
@@ -0,0 +1,94 @@
+"""週別・月別平均のベンチマーク
+
+sleep_sessions を全件読み込んで stats.py の基準実装で集計する方法と、
+トリガーで更新している weekly_rollups / monthly_rollups を読むだけの方法を比較する。
+両者の期間・件数が一致し、平均が浮動小数点の誤差の範囲で一致することも確認する
+（表示の時・分の許容範囲は tests/test_rollups.py で確認している）。
+
+    python benchmarks/bench_rollups.py [セッション数 ...]
+"""
+import os
+import sys
+import tempfile
+import time
+
+# app の import でデータベースが初期化されるため、一時ディレクトリを使う
+os.environ.setdefault('RENDER_DATA_DIR', tempfile.mkdtemp())
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from attendance_system import app as app_module  # noqa: E402
+from attendance_system import rollups, stats  # noqa: E402
+from attendance_system.sleep_sessions import load_sleep_times  # noqa: E402
+from bench_aggregation import generate_rows  # noqa: E402
+
+
+def seed(conn, username, n):
+    """n 件のセッションを持つユーザーを作る（集計テーブルはトリガーで更新される）"""
+    user_id = conn.execute(
+        "INSERT INTO users (username, password) VALUES (?, 'x')", (username,)).lastrowid
+    started = time.perf_counter()
+    conn.executemany('''
+        INSERT INTO sleep_sessions
+        (user_id, sleep_record_id, wake_record_id, sleep_ts, wake_ts, duration_seconds, local_date)
+        VALUES (?, 0, ?, ?, ?, ?, ?)
+    ''', [(user_id, i, local_date, f'{local_date}T{i:09d}', duration, local_date)
+          for i, (local_date, duration) in enumerate(generate_rows(n))])
+    conn.commit()
+    return user_id, time.perf_counter() - started
+
+
+def scan_averages(conn, user_id):
+    sleep_times = load_sleep_times(conn, user_id)
+    return stats.calculate_weekly_average(sleep_times), stats.calculate_monthly_average(sleep_times)
+
+
+def rollup_averages(conn, user_id):
+    evaluate = app_module.evaluate_sleep
+    return (rollups.weekly_averages(conn, user_id, evaluate),
+            rollups.monthly_averages(conn, user_id, evaluate))
+
+
+# 平均が分・評価の境界ちょうどのときだけ食い違いうる表示用の項目
+DISPLAY_KEYS = ('avg_hours', 'avg_minutes', 'evaluation')
+
+
+def same(expected, actual):
+    if len(expected) != len(actual):
+        return False
+    for a, b in zip(expected, actual):
+        for key, value in a.items():
+            if key in DISPLAY_KEYS:
+                continue
+            if isinstance(value, float) and abs(value - b[key]) > 1e-9:
+                return False
+            if not isinstance(value, float) and value != b[key]:
+                return False
+    return True
+
+
+def best_of(func, conn, user_id, repeat=5):
+    best = float('inf')
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func(conn, user_id)
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def main(sizes):
+    print(f"{'sessions':>10} {'insert(ms)':>11} {'scan(ms)':>10} {'rollup(ms)':>11} {'speedup':>8}")
+    with app_module.app.app_context():
+        conn = app_module.get_db_connection()
+        for n in sizes:
+            user_id, insert = seed(conn, f'bench{n}', n)
+            scanned, rolled = scan_averages(conn, user_id), rollup_averages(conn, user_id)
+            if not all(same(a, b) for a, b in zip(scanned, rolled)):
+                raise SystemExit(f'{n}件: 集計結果が一致しません')
+            scan = best_of(scan_averages, conn, user_id)
+            rollup = best_of(rollup_averages, conn, user_id)
+            print(f'{n:>10} {insert * 1000:>11.1f} {scan * 1000:>10.1f} '
+                  f'{rollup * 1000:>11.2f} {scan / rollup:>7.1f}x')
+
+
+if __name__ == '__main__':
+    main([int(arg) for arg in sys.argv[1:]] or [1000, 10000, 100000])
@@ -0,0 +1,64 @@
+"""stats モジュール（睡眠時間の評価・集計の純粋関数）のベンチマーク
+
+関数ごとに、セッション数を変えて最短の所要時間とセッションあたりの時間を測る。
+結果が変わっていないこと（性質のチェックと出力全体のハッシュ）は tests/test_stats.py で確認する。
+
+    python benchmarks/bench_stats.py [セッション数 ...]
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from attendance_system import stats  # noqa: E402
+from bench_aggregation import generate_rows, to_sleep_times  # noqa: E402
+
+
+def _cases(sleep_times):
+    """関数名 → セッションのリストを受け取って1回実行する関数"""
+    sorted_times = sorted(sleep_times, key=lambda x: x['date'], reverse=True)
+    durations = [item['duration'] for item in sleep_times]
+    return {
+        'evaluate_sleep': lambda: [stats.evaluate_sleep(d) for d in durations],
+        'calculate_average': lambda: stats.calculate_average(sleep_times),
+        'calculate_overall_average': lambda: stats.calculate_overall_average(sleep_times),
+        'calculate_weekly_average': lambda: stats.calculate_weekly_average(sleep_times),
+        'calculate_monthly_average': lambda: stats.calculate_monthly_average(sleep_times),
+        'calculate_comparisons': lambda: stats.calculate_comparisons(sleep_times),
+        'calculate_diff': lambda: stats.calculate_diff(sorted_times, 0, len(sorted_times) - 1),
+        'revise_previous_day_comparison': lambda: stats.revise_previous_day_comparison(sleep_times),
+    }
+
+
+def best_of(func, budget=1.0, max_repeat=50):
+    """最短の所要時間（合計で budget 秒を超えたらそれ以上繰り返さない）"""
+    best = float('inf')
+    spent = 0.0
+    for _ in range(max_repeat):
+        started = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - started
+        best = min(best, elapsed)
+        spent += elapsed
+        if spent > budget:
+            break
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('sizes', nargs='*', type=int, default=[100, 10000, 1000000])
+    args = parser.parse_args()
+
+    print(f"{'function':<32}{'sessions':>10}{'best(ms)':>11}{'ns/session':>12}")
+    for n in args.sizes:
+        cases = _cases(to_sleep_times(generate_rows(n)))
+        for name, func in cases.items():
+            best = best_of(func)
+            print(f'{name:<32}{n:>10}{best * 1000:>11.3f}{best / n * 1e9:>12.1f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,192 @@
+"""ベンチマーク用のデータ生成
+
+実際の使われ方に近いユーザーと、複数年分の睡眠・起床の記録を作る。
+- ユーザーごとに就寝時刻・睡眠時間の傾向（平均とばらつき）と記録を忘れる割合を変える
+- 途中から使い始めたユーザー、昼寝、起床の記録忘れ、削除済みの記録を混ぜる
+- 一部のユーザーは非公開にする
+- 公開ユーザーの記録に他のユーザーがいいねする
+記録は end の前日までで、end の日（既定は今日）の記録はない。
+同じ引数なら同じデータになる。パスワードはすべて PASSWORD。
+
+    python benchmarks/generate_data.py DATA_DIR [--users 100] [--years 3] [--seed 0] [--end 2025-01-01]
+
+DATA_DIR/attendance.db に作る（RENDER_DATA_DIR に DATA_DIR を指定すればアプリから使える）。
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from datetime import date, datetime, timedelta, timezone
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+JST = timezone(timedelta(hours=9))
+PASSWORD = 'p'
+USERNAME_PREFIX = 'bench'
+MEMOS = ('', '', '', '', '', '眠い', 'よく眠れた', '夜更かしした', '寝坊', '早起き', '夢を見た')
+# 1件の記録へのいいね数の分布
+LIKE_COUNTS = (0, 1, 2, 3, 5, 8)
+LIKE_WEIGHTS = (70, 15, 7, 4, 3, 1)
+
+
+def username(index):
+    return f'{USERNAME_PREFIX}{index:05d}'
+
+
+def _profile(rng):
+    """ユーザーごとの生活リズム"""
+    return {
+        'bedtime': rng.gauss(23.5, 1.0),  # 時（24 を超えたら翌日）
+        'bedtime_sd': rng.uniform(0.2, 1.2),
+        'duration': min(max(rng.gauss(7.0, 0.8), 4.5), 9.5),
+        'duration_sd': rng.uniform(0.3, 1.2),
+        'skip': rng.choice((0.02, 0.05, 0.1, 0.3)),
+        'nap': rng.choice((0.0, 0.0, 0.02, 0.08)),
+        'forget_wake': 0.02,
+        'delete': 0.01,
+    }
+
+
+def _user_records(rng, user_id, first_day, end):
+    """1人分の記録 (user_id, action, timestamp, memo, local_date, is_deleted, deleted_at)"""
+    profile = _profile(rng)
+    rows = []
+    # 同じ日に同じ行動は1件まで（アプリの記録画面と同じ制約）
+    used = set()
+
+    def add(action, moment):
+        local_date = moment.date().isoformat()
+        if moment.date() >= end or (action, local_date) in used:
+            return
+        used.add((action, local_date))
+        deleted = rng.random() < profile['delete']
+        rows.append((
+            user_id, action, moment.isoformat(timespec='seconds'), rng.choice(MEMOS), local_date,
+            1 if deleted else 0,
+            (moment + timedelta(hours=rng.uniform(1, 48))).isoformat(timespec='seconds') if deleted else None,
+        ))
+
+    day = first_day
+    while day < end:
+        if rng.random() >= profile['skip']:
+            midnight = datetime(day.year, day.month, day.day, tzinfo=JST)
+            sleep_at = midnight + timedelta(hours=rng.gauss(profile['bedtime'], profile['bedtime_sd']))
+            duration = min(max(rng.gauss(profile['duration'], profile['duration_sd']), 1.0), 14.0)
+            add('sleep', sleep_at)
+            if rng.random() >= profile['forget_wake']:
+                add('wake_up', sleep_at + timedelta(hours=duration, seconds=rng.randrange(3600)))
+            if rng.random() < profile['nap']:
+                # 昼寝（その日の睡眠・起床がまだなければ記録される）
+                nap_at = midnight + timedelta(hours=rng.uniform(13, 16))
+                add('sleep', nap_at)
+                add('wake_up', nap_at + timedelta(minutes=rng.randrange(20, 90)))
+        day += timedelta(days=1)
+    return rows
+
+
+def generate(conn, password_hash, users=100, years=3, seed=0, end=None, private_ratio=0.1):
+    """conn（sqlite3.Row を返す接続）にユーザーと記録・いいねを作り、件数を返す
+
+    password_hash は全ユーザー共通のパスワードのハッシュ（app.hash_password(PASSWORD)）。
+    睡眠セッション・週別/月別の集計・likes_count もここで作り直す。
+    """
+    from attendance_system.likes import reconcile_like_counts
+    from attendance_system.rollups import rebuild_rollups
+    from attendance_system.sleep_sessions import refresh_user_sessions
+
+    rng = random.Random(seed)
+    end = end or datetime.now(JST).date()
+    start = end - timedelta(days=round(365.25 * years))
+    created_at = datetime(start.year, start.month, start.day, tzinfo=JST).isoformat()
+
+    user_rows = [(username(i), password_hash, 1 if rng.random() < private_ratio else 0, created_at)
+                 for i in range(users)]
+    conn.executemany(
+        'INSERT INTO users (username, password, is_private, created_at) VALUES (?, ?, ?, ?)', user_rows)
+    user_ids = [row[0] for row in conn.execute(
+        f"SELECT id FROM users WHERE username LIKE '{USERNAME_PREFIX}%' ORDER BY username")]
+    private = {user_id for user_id, row in zip(user_ids, user_rows) if row[2]}
+
+    records = 0
+    for user_id in user_ids:
+        # 4人に1人は期間の途中から使い始めたユーザー
+        offset = rng.randrange(0, (end - start).days) if rng.random() < 0.25 else rng.randrange(0, 30)
+        rows = _user_records(rng, user_id, start + timedelta(days=offset), end)
+        conn.executemany('''
+            INSERT INTO records (user_id, action, timestamp, memo, local_date, is_deleted, deleted_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', rows)
+        records += len(rows)
+
+    # 公開ユーザーの削除されていない記録に、ほかのユーザーがいいねする
+    likes = []
+    for record_id, author, timestamp in conn.execute('''
+        SELECT r.id, r.user_id, r.timestamp FROM records r
+        JOIN users u ON u.id = r.user_id
+        WHERE u.username LIKE ? AND u.is_private = 0 AND r.is_deleted = 0
+        ORDER BY r.id
+    ''', (f'{USERNAME_PREFIX}%',)).fetchall():
+        count = min(rng.choices(LIKE_COUNTS, weights=LIKE_WEIGHTS)[0], len(user_ids) - 1)
+        if not count:
+            continue
+        liked_at = datetime.fromisoformat(timestamp) + timedelta(minutes=rng.randrange(1, 600))
+        for liker in rng.sample(user_ids, count + 1):
+            if liker != author:
+                likes.append((liker, record_id, liked_at.isoformat(timespec='seconds')))
+    conn.executemany('''
+        INSERT INTO likes (user_id, record_id, timestamp) VALUES (?, ?, ?)
+        ON CONFLICT (user_id, record_id) DO NOTHING
+    ''', likes)
+
+    sessions = sum(refresh_user_sessions(conn, user_id) for user_id in user_ids)
+    reconcile_like_counts(conn)
+    rebuild_rollups(conn)
+    conn.commit()
+    return {
+        'users': users,
+        'private_users': len(private),
+        'records': records,
+        'likes': len(likes),
+        'sleep_sessions': sessions,
+        'first_date': start.isoformat(),
+        'end_date': end.isoformat(),
+    }
+
+
+def generate_in(data_dir, **options):
+    """data_dir/attendance.db を作ってデータを入れ、件数を返す（アプリを import する前に呼ぶこと）"""
+    os.environ['RENDER_DATA_DIR'] = data_dir
+    os.environ.setdefault('SCHEDULER_ENABLED', '0')
+    # 一括登録のクエリはどれも遅いクエリのログに載るので、ここでは記録しない
+    os.environ.setdefault('SLOW_QUERY_MS', '')
+    if ROOT not in sys.path:
+        sys.path.insert(0, ROOT)
+    from attendance_system import app as app_module
+
+    with app_module.app.app_context():
+        conn = app_module.get_db_connection()
+        return generate(conn, app_module.hash_password(PASSWORD), **options)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('data_dir')
+    parser.add_argument('--users', type=int, default=100)
+    parser.add_argument('--years', type=float, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--end', type=date.fromisoformat, help='この日の前日までの記録を作る（既定は今日）')
+    parser.add_argument('--private-ratio', type=float, default=0.1)
+    args = parser.parse_args()
+
+    if os.path.exists(os.path.join(args.data_dir, 'attendance.db')):
+        raise SystemExit(f'{args.data_dir} にはすでに attendance.db があります')
+    os.makedirs(args.data_dir, exist_ok=True)
+    started = time.perf_counter()
+    counts = generate_in(args.data_dir, users=args.users, years=args.years, seed=args.seed,
+                         end=args.end, private_ratio=args.private_ratio)
+    print(', '.join(f'{key}={value}' for key, value in counts.items()))
+    print(f'{time.perf_counter() - started:.1f}秒')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,381 @@
+"""アプリ全体の負荷テスト
+
+generate_data.py で作ったデータに対して主要な画面・API にリクエストを送り、
+シナリオごとのスループットとレイテンシ（p50 / p95 / p99）を測る。
+- testclient: Flask のテストクライアント（同じプロセス内。WSGI サーバーやネットワークは含まない）
+- gunicorn: gunicorn.conf.py の設定で起動したサーバーに HTTP で送る
+サーバーごとにデータベースのコピーを使うので、どちらも同じデータから始まる。
+結果は --output に JSON で保存し、--compare で以前の結果と比べられる
+（p95 が --tolerance を超えて悪化したシナリオがあれば終了コード1）。
+
+    python benchmarks/load_app.py [--server testclient|gunicorn|all] [--users 100] [--years 3]
+        [--requests 300] [--concurrency 4] [--output baseline.json] [--compare baseline.json]
+
+データは同じ引数なら同じものができる（--end を省略すると今日の前日まで）。
+--data-dir に既存のデータ（attendance.db のあるディレクトリ）を指定すると作らずに使う。
+record シナリオは今日の記録を作るので最後に実行する。ユーザーごとに最初の睡眠・起床だけが
+登録され、それ以降は「登録済み」の確認で終わる。
+"""
+import argparse
+import http.client
+import json
+import os
+import platform
+import random
+import shutil
+import socket
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import date, datetime, timedelta
+from urllib.parse import urlencode
+
+from generate_data import PASSWORD, USERNAME_PREFIX
+from load_sqlite_writes import percentile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BASE_URL = 'https://localhost'
+SERVERS = ('testclient', 'gunicorn')
+# スレッドごとにログインしておくユーザー数（ユーザーごとのキャッシュの効き方を実際に近づける）
+SESSIONS_PER_THREAD = 8
+
+
+def _random_day(rng, ctx):
+    first, end = date.fromisoformat(ctx['first_date']), date.fromisoformat(ctx['end_date'])
+    return (first + timedelta(days=rng.randrange((end - first).days))).isoformat()
+
+
+# (名前, メソッド, (rng, ctx) から (パス, フォームデータ) を作る関数, 成功とみなすステータス)
+SCENARIOS = [
+    ('index', 'GET', lambda rng, ctx: ('/', None), (200,)),
+    ('all_records', 'GET', lambda rng, ctx: (
+        '/all_records' if rng.random() < 0.7 else f"/all_records?user_id={rng.choice(ctx['public_ids'])}",
+        None), (200,)),
+    ('average_sleep', 'GET', lambda rng, ctx: (
+        f"/average_sleep?period={rng.choice(('daily', 'weekly', 'monthly', 'all'))}", None), (200,)),
+    ('day_records', 'GET', lambda rng, ctx: (f'/day_records/{_random_day(rng, ctx)}', None), (200,)),
+    ('sleep_data', 'GET', lambda rng, ctx: (
+        f"/api/sleep_data?period={rng.choice(('daily', 'weekly', 'monthly'))}", None), (200,)),
+    ('record', 'POST', lambda rng, ctx: (
+        '/record', {'action': rng.choice(('sleep', 'wake_up')), 'memo': ''}), (302,)),
+]
+
+
+class TestClientSession:
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def request(self, method, path, data=None):
+        response = self.client.open(BASE_URL + path, method=method, data=data)
+        response.get_data()
+        return response.status_code
+
+
+class HttpSession:
+    """gunicorn に送るクライアント（keep-alive で接続を使い回し、session クッキーを送り返す）"""
+
+    def __init__(self, port):
+        self.port = port
+        self.conn = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+        self.cookie = None
+
+    def _send(self, method, path, data):
+        headers = {}
+        body = None
+        if data is not None:
+            body = urlencode(data)
+            headers['Content-Type'] = 'application/x-www-form-urlencoded'
+        if self.cookie:
+            headers['Cookie'] = self.cookie
+        self.conn.request(method, path, body=body, headers=headers)
+        response = self.conn.getresponse()
+        response.read()
+        # SESSION_COOKIE_SECURE でも http のままクッキーを送り返す
+        for header in response.headers.get_all('Set-Cookie') or []:
+            name_value = header.split(';', 1)[0]
+            if name_value.startswith('session='):
+                self.cookie = name_value
+        return response.status
+
+    def request(self, method, path, data=None):
+        try:
+            return self._send(method, path, data)
+        except (http.client.RemoteDisconnected, ConnectionError):
+            # サーバーが keep-alive の接続を閉じていたらつなぎ直す
+            self.conn.close()
+            return self._send(method, path, data)
+
+
+def login(session, username):
+    status = session.request('POST', '/login', {'username': username, 'password': PASSWORD})
+    if status != 302:
+        raise RuntimeError(f'{username} でログインできません（{status}）')
+    return session
+
+
+def summarize(latencies, errors, elapsed):
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'throughput': len(latencies) / elapsed if elapsed else 0.0,
+        'mean_ms': sum(latencies) / len(latencies) * 1000 if latencies else 0.0,
+        'p50_ms': percentile(latencies, 0.50) * 1000,
+        'p95_ms': percentile(latencies, 0.95) * 1000,
+        'p99_ms': percentile(latencies, 0.99) * 1000,
+        'max_ms': max(latencies, default=0.0) * 1000,
+    }
+
+
+def run_scenario(make_session, scenario, ctx, requests, concurrency, seed):
+    """concurrency 本のスレッドから合計 requests 件送り、集計を返す（ログインは計測に含めない）"""
+    name, method, build, ok = scenario
+    results = {'latencies': [], 'errors': 0}
+    lock = threading.Lock()
+    ready = threading.Barrier(concurrency + 1)
+
+    def worker(index):
+        rng = random.Random(f'{seed}:{name}:{index}')
+        usernames = ctx['usernames'][index::concurrency][:SESSIONS_PER_THREAD]
+        sessions = [login(make_session(), username) for username in usernames]
+        latencies, errors = [], 0
+        ready.wait()
+        for _ in range(requests // concurrency + (index < requests % concurrency)):
+            session = rng.choice(sessions)
+            path, data = build(rng, ctx)
+            started = time.perf_counter()
+            try:
+                status = session.request(method, path, data)
+            except OSError:
+                status = None
+            latencies.append(time.perf_counter() - started)
+            errors += status not in ok
+        with lock:
+            results['latencies'].extend(latencies)
+            results['errors'] += errors
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    ready.wait()
+    started = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    return summarize(results['latencies'], results['errors'], time.perf_counter() - started)
+
+
+def load_context(db_path):
+    """シナリオで使うユーザー名・公開ユーザーの ID・記録のある期間"""
+    conn = sqlite3.connect(db_path)
+    try:
+        users = conn.execute(
+            'SELECT id, username, is_private FROM users WHERE username LIKE ? ORDER BY username',
+            (f'{USERNAME_PREFIX}%',)).fetchall()
+        first_date, last_date = conn.execute(
+            'SELECT MIN(local_date), MAX(local_date) FROM records').fetchone()
+    finally:
+        conn.close()
+    if not users:
+        raise SystemExit(f'{db_path} に generate_data.py で作ったユーザーがいません')
+    return {
+        'usernames': [username for _, username, _ in users],
+        'public_ids': [user_id for user_id, _, is_private in users if not is_private],
+        'first_date': first_date,
+        'end_date': (date.fromisoformat(last_date) + timedelta(days=1)).isoformat(),
+    }
+
+
+def describe_data(db_path):
+    conn = sqlite3.connect(db_path)
+    try:
+        count = lambda sql: conn.execute(sql).fetchone()[0]  # noqa: E731
+        return {
+            'users': count(f"SELECT COUNT(*) FROM users WHERE username LIKE '{USERNAME_PREFIX}%'"),
+            'private_users': count('SELECT COUNT(*) FROM users WHERE is_private = 1'),
+            'records': count('SELECT COUNT(*) FROM records'),
+            'likes': count('SELECT COUNT(*) FROM likes'),
+            'sleep_sessions': count('SELECT COUNT(*) FROM sleep_sessions'),
+            'first_date': count('SELECT MIN(local_date) FROM records'),
+            'last_date': count('SELECT MAX(local_date) FROM records'),
+        }
+    finally:
+        conn.close()
+
+
+def run_scenarios(make_session, ctx, args):
+    # テンプレートのコンパイルなどを計測に含めないよう、読み込みのシナリオを1回ずつ先に送る
+    session = login(make_session(), ctx['usernames'][0])
+    rng = random.Random(args.seed)
+    for _, method, build, _ in SCENARIOS:
+        if method == 'GET':
+            session.request(method, *build(rng, ctx))
+    return {scenario[0]: run_scenario(make_session, scenario, ctx, args.requests, args.concurrency, args.seed)
+            for scenario in SCENARIOS}
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def run_testclient(data_dir, args):
+    os.environ['RENDER_DATA_DIR'] = data_dir
+    sys.path.insert(0, ROOT)
+    from attendance_system import app as app_module
+
+    ctx = load_context(os.path.join(data_dir, 'attendance.db'))
+    return run_scenarios(lambda: TestClientSession(app_module.app), ctx, args)
+
+
+def run_gunicorn(data_dir, args):
+    ctx = load_context(os.path.join(data_dir, 'attendance.db'))
+    port = free_port()
+    env = dict(os.environ, RENDER_DATA_DIR=data_dir, PORT=str(port), WEB_CONCURRENCY=str(args.workers))
+    server = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '--config', os.path.join(ROOT, 'gunicorn.conf.py'),
+         '--bind', f'127.0.0.1:{port}', 'attendance_system.app:app'],
+        cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        deadline = time.monotonic() + 60
+        while True:
+            try:
+                if HttpSession(port).request('GET', '/login') == 200:
+                    break
+            except OSError:
+                pass
+            if server.poll() is not None or time.monotonic() > deadline:
+                raise RuntimeError('gunicorn が起動しませんでした')
+            time.sleep(0.2)
+        return run_scenarios(lambda: HttpSession(port), ctx, args)
+    finally:
+        server.terminate()
+        server.wait(timeout=30)
+
+
+def run_server(args):
+    """1つのサーバーで全シナリオを実行して結果を JSON で出力する（子プロセスで呼ばれる）"""
+    runner = run_testclient if args.run == 'testclient' else run_gunicorn
+    print(json.dumps(runner(args.data_dir, args)))
+
+
+def prepare_data(args):
+    """データを用意して attendance.db のパスを返す"""
+    if args.data_dir:
+        path = os.path.join(args.data_dir, 'attendance.db')
+        if os.path.exists(path):
+            return path
+    data_dir = args.data_dir or tempfile.mkdtemp(prefix='nekoooo-bench-')
+    command = [sys.executable, os.path.join(ROOT, 'benchmarks', 'generate_data.py'), data_dir,
+               '--users', str(args.users), '--years', str(args.years), '--seed', str(args.seed)]
+    if args.end:
+        command += ['--end', args.end.isoformat()]
+    subprocess.run(command, check=True, stdout=subprocess.DEVNULL)
+    return os.path.join(data_dir, 'attendance.db')
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_results(results):
+    print(f"{'server':<11}{'scenario':<15}{'req':>6}{'err':>5}{'req/s':>9}"
+          f"{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}")
+    for server, scenarios in results.items():
+        for name, r in scenarios.items():
+            print(f"{server:<11}{name:<15}{r['requests']:>6}{r['errors']:>5}{r['throughput']:>9.1f}"
+                  f"{r['p50_ms']:>9.2f}{r['p95_ms']:>9.2f}{r['p99_ms']:>9.2f}")
+
+
+def compare(baseline, results, tolerance):
+    """以前の結果と比べて表示し、p95 が tolerance を超えて悪化したシナリオの一覧を返す"""
+    print(f"\n基準: {baseline.get('git_commit')} ({baseline.get('created_at')})")
+    print(f"{'server':<11}{'scenario':<15}{'p50':>16}{'p95':>16}{'req/s':>16}")
+    regressions = []
+    for server, scenarios in results.items():
+        for name, new in scenarios.items():
+            old = baseline.get('results', {}).get(server, {}).get(name)
+            if old is None:
+                continue
+            change = lambda key: (new[key] - old[key]) / old[key] * 100 if old[key] else 0.0  # noqa: E731
+            print(f"{server:<11}{name:<15}{new['p50_ms']:>8.2f}{change('p50_ms'):>+7.0f}%"
+                  f"{new['p95_ms']:>8.2f}{change('p95_ms'):>+7.0f}%"
+                  f"{new['throughput']:>8.1f}{change('throughput'):>+7.0f}%")
+            if old['p95_ms'] and new['p95_ms'] > old['p95_ms'] * (1 + tolerance):
+                regressions.append(f'{server}/{name}')
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--server', choices=SERVERS + ('all',), default='all')
+    parser.add_argument('--users', type=int, default=100)
+    parser.add_argument('--years', type=float, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--end', type=date.fromisoformat, help='データの最終日の翌日（既定は今日）')
+    parser.add_argument('--data-dir', help='既存のデータ（なければここに作る）')
+    parser.add_argument('--requests', type=int, default=300, help='シナリオごとのリクエスト数')
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--workers', type=int, default=2, help='gunicorn のワーカー数')
+    parser.add_argument('--output', help='結果を保存する JSON ファイル')
+    parser.add_argument('--compare', help='比べる以前の結果（JSON）')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='p95 の悪化をどこまで許すか')
+    parser.add_argument('--run', choices=SERVERS, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run:
+        run_server(args)
+        return
+
+    db_path = prepare_data(args)
+    results = {}
+    for server in (SERVERS if args.server == 'all' else (args.server,)):
+        # 記録の追加がほかのサーバーの計測に影響しないよう、サーバーごとにコピーを使う
+        data_dir = tempfile.mkdtemp(prefix=f'nekoooo-{server}-')
+        shutil.copyfile(db_path, os.path.join(data_dir, 'attendance.db'))
+        env = dict(os.environ, SCHEDULER_ENABLED='0', SCHEDULER_PROCESS='0', BACKUP_INTERVAL='0')
+        output = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), '--run', server, '--data-dir', data_dir,
+             '--requests', str(args.requests), '--concurrency', str(args.concurrency),
+             '--workers', str(args.workers), '--seed', str(args.seed)],
+            env=env, capture_output=True, text=True, check=True
+        ).stdout
+        results[server] = json.loads(output.strip().splitlines()[-1])
+        shutil.rmtree(data_dir)
+
+    report = {
+        'created_at': datetime.now().astimezone().isoformat(timespec='seconds'),
+        'git_commit': git_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'settings': {
+            'requests': args.requests,
+            'concurrency': args.concurrency,
+            'workers': args.workers,
+            'seed': args.seed,
+            'sessions_per_thread': SESSIONS_PER_THREAD,
+        },
+        'data': describe_data(db_path),
+        'results': results,
+    }
+    print_results(results)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            regressions = compare(json.load(f), results, args.tolerance)
+        if regressions:
+            print(f"\np95 が {args.tolerance:.0%} 以上悪化しました: {', '.join(regressions)}")
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
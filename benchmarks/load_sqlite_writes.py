@@ -0,0 +1,160 @@
+"""SQLite 書き込みの負荷テスト
+
+gunicorn の複数ワーカーを fork したプロセスで、各ワーカー内の並列リクエストを
+スレッドで再現し、/like_record・/record・/toggle_privacy と /all_records を同時に送る。
+通常モードと高並列モード（SQLITE_HIGH_CONCURRENCY=1: WAL + 書き込みキュー）で
+エラー率（「database is locked」などのエラー表示になったリクエストの割合）と
+レイテンシの p50 / p99 を比較する。
+
+    python benchmarks/load_sqlite_writes.py [--workers 4] [--threads 8] [--requests 200]
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BASE_URL = 'https://localhost'
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def seed(app_module, users, records):
+    with app_module.app.app_context():
+        conn = app_module.get_db_connection()
+        password = app_module.hash_password('p')
+        conn.executemany(
+            'INSERT INTO users (username, password, created_at) VALUES (?, ?, ?)',
+            [(f'load{i}', password, app_module.jst_now()) for i in range(users)]
+        )
+        author = conn.execute("SELECT id FROM users WHERE username = 'load0'").fetchone()[0]
+        conn.executemany(
+            "INSERT INTO records (user_id, action, timestamp, memo, local_date) "
+            "VALUES (?, 'sleep', ?, '', DATE(?, '+9 hours'))",
+            [(author, f'2020-01-01T00:00:{i % 60:02d}+09:00', '2020-01-01T00:00:00+09:00')
+             for i in range(records)]
+        )
+        conn.commit()
+        first = conn.execute('SELECT MIN(id) FROM records').fetchone()[0]
+    return first
+
+
+def run_client(app, username, record_ids, results, lock):
+    client = app.test_client()
+    client.post(BASE_URL + '/login', data={'username': username, 'password': 'p'})
+    latencies = []
+    errors = 0
+    for i, record_id in enumerate(record_ids):
+        started = time.perf_counter()
+        if i % 10 == 0:
+            client.post(BASE_URL + '/record', data={'action': 'sleep' if i % 20 else 'wake_up'})
+        elif i % 10 == 5:
+            client.post(BASE_URL + '/toggle_privacy', data={'is_private': 'on' if i % 20 else ''})
+        elif i % 10 in (3, 7):
+            # 読み込みも混ぜる（ロールバックジャーナルでは読み込み中の書き込みが待たされる）
+            client.get(BASE_URL + '/all_records')
+        else:
+            client.post(BASE_URL + f'/like_record/{record_id}?from_page=all_records')
+        latencies.append(time.perf_counter() - started)
+        with client.session_transaction() as sess:
+            flashes = sess.pop('_flashes', [])
+        errors += sum(1 for category, _ in flashes if category in ('error', 'danger'))
+    with lock:
+        results['latencies'].extend(latencies)
+        results['errors'] += errors
+
+
+def run_worker(worker, threads, requests, first_record, queue):
+    from attendance_system import app as app_module
+
+    results = {'latencies': [], 'errors': 0}
+    lock = threading.Lock()
+    clients = []
+    for t in range(threads):
+        index = worker * threads + t
+        record_ids = [first_record + (index * requests + i) % (requests * 4) for i in range(requests)]
+        clients.append(threading.Thread(
+            target=run_client,
+            args=(app_module.app, f'load{index}', record_ids, results, lock)
+        ))
+    for client in clients:
+        client.start()
+    for client in clients:
+        client.join()
+    queue.put(results)
+
+
+def run_mode(args):
+    """1つのモードを実行して結果を JSON で出力する（子プロセスで呼ばれる）"""
+    os.environ['RENDER_DATA_DIR'] = tempfile.mkdtemp()
+    sys.path.insert(0, ROOT)
+    from attendance_system import app as app_module
+
+    app_module.app.config['TESTING'] = True
+    first = seed(app_module, args.workers * args.threads, args.requests * 4)
+    # fork 前に親の接続を閉じ、各ワーカーが自分の接続を持つようにする
+    app_module.get_sqlite_pool().close_all()
+
+    ctx = multiprocessing.get_context('fork')
+    queue = ctx.Queue()
+    started = time.perf_counter()
+    workers = [ctx.Process(target=run_worker, args=(w, args.threads, args.requests, first, queue))
+               for w in range(args.workers)]
+    for worker in workers:
+        worker.start()
+    collected = [queue.get() for _ in workers]
+    for worker in workers:
+        worker.join()
+    elapsed = time.perf_counter() - started
+
+    latencies = [value for result in collected for value in result['latencies']]
+    errors = sum(result['errors'] for result in collected)
+    print(json.dumps({
+        'requests': len(latencies),
+        'errors': errors,
+        'error_rate': errors / len(latencies) if latencies else 0.0,
+        'p50_ms': percentile(latencies, 0.50) * 1000,
+        'p99_ms': percentile(latencies, 0.99) * 1000,
+        'throughput': len(latencies) / elapsed,
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--requests', type=int, default=200, help='スレッドごとのリクエスト数')
+    parser.add_argument('--mode', choices=['default', 'high_concurrency'])
+    args = parser.parse_args()
+
+    if args.mode:
+        run_mode(args)
+        return
+
+    print(f'workers={args.workers} threads={args.threads} requests/thread={args.requests}')
+    print(f"{'mode':<18}{'requests':>9}{'errors':>8}{'error%':>8}{'p50 ms':>9}{'p99 ms':>9}{'req/s':>9}")
+    for mode in ('default', 'high_concurrency'):
+        env = dict(os.environ, SQLITE_HIGH_CONCURRENCY='1' if mode == 'high_concurrency' else '0')
+        output = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), '--mode', mode,
+             '--workers', str(args.workers), '--threads', str(args.threads),
+             '--requests', str(args.requests)],
+            env=env, capture_output=True, text=True, check=True
+        ).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        print(f"{mode:<18}{result['requests']:>9}{result['errors']:>8}{result['error_rate'] * 100:>7.2f}%"
+              f"{result['p50_ms']:>9.2f}{result['p99_ms']:>9.2f}{result['throughput']:>9.0f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,42 @@
+# gunicorn の設定（startup.sh から起動したときに自動で読み込まれる）
+#
+# /api/stream（Server-Sent Events）は接続中ずっとスレッドを1本使うため、
+# 同期ワーカーではなくスレッドワーカー（gthread）にして、
+# ストリームを開いたままでも他のリクエストを受けられるようにする。
+import os
+import signal
+import subprocess
+import sys
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '8000')}"
+worker_class = 'gthread'
+workers = int(os.environ.get('WEB_CONCURRENCY', 2))
+# 1ワーカーあたりの同時接続数（ストリーム接続もここに含まれる）
+threads = int(os.environ.get('GUNICORN_THREADS', 32))
+# gthread ではこの値はワーカーの生存確認の間隔で、長く続くストリームは打ち切られない
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 60))
+keepalive = 75
+graceful_timeout = 30
+
+# 定期ジョブ（attendance_system/scheduler.py）はワーカーごとには動かさず、
+# マスターが flask run-scheduler を別プロセスで1つだけ起動する（SCHEDULER_PROCESS=0 で起動しない）
+_scheduler = None
+
+
+def when_ready(server):
+    global _scheduler
+    if os.environ.get('SCHEDULER_PROCESS', '1') == '1':
+        _scheduler = subprocess.Popen(
+            [sys.executable, '-m', 'flask', '--app', 'attendance_system.app', 'run-scheduler'])
+        server.log.info('Started scheduler process (pid %s)', _scheduler.pid)
+
+
+def on_exit(server):
+    if _scheduler is None or _scheduler.poll() is not None:
+        return
+    # run-scheduler は Ctrl+C（SIGINT）でリースを返してから終了する
+    _scheduler.send_signal(signal.SIGINT)
+    try:
+        _scheduler.wait(timeout=graceful_timeout)
+    except subprocess.TimeoutExpired:
+        _scheduler.kill()
@@ -17,8 +17,21 @@ TOKEN=$GITHUB_TOKEN
 REPO="yukirin88/Nekoooo"
 BRANCH="db-backup"
 
-# attendance.dbがなければバックアップから復元
-if [ ! -f attendance.db ]; then
+# アプリ（attendance_system/app.py）と同じ場所を使う
+DATA_DIR=${RENDER_DATA_DIR:-attendance_system}
+DB_PATH="$DATA_DIR/attendance.db"
+BACKUP_DIR=${BACKUP_DIR:-$DATA_DIR/backups}
+mkdir -p "$DATA_DIR"
+
+# attendance.dbがなければ、まずローカルのスナップショット（チェックサム検証済み）から復元
+if [ ! -f "$DB_PATH" ] && [ -d "$BACKUP_DIR" ]; then
+  echo "💾 Restoring from local snapshots in $BACKUP_DIR..."
+  python -m attendance_system.backup restore --db "$DB_PATH" --dir "$BACKUP_DIR" \
+    || echo "⚠️ ローカルのスナップショットから復元できませんでした。GitHubのバックアップを探します。"
+fi
+
+# それでもなければGitHubのバックアップから復元
+if [ ! -f "$DB_PATH" ]; then
   RESPONSE=$(curl -s -H "Authorization: token $TOKEN" \
                     -H "Accept: application/vnd.github.v3+json" \
                     "https://api.github.com/repos/$REPO/contents/?ref=$BRANCH")
@@ -35,13 +48,13 @@ if [ ! -f attendance.db ]; then
   else
     echo "✅ Found backup: $LATEST_DB. Downloading..."
     curl -s -H "Authorization: token $TOKEN" \
-         -o attendance.db \
+         -o "$DB_PATH" \
          "https://raw.githubusercontent.com/$REPO/$BRANCH/$LATEST_DB"
 
     # ファイルサイズが1KB未満なら空DBとみなして削除し、アプリも起動しない
-    if [ -f attendance.db ] && [ $(stat -c%s "attendance.db") -lt 1024 ]; then
+    if [ -f "$DB_PATH" ] && [ $(stat -c%s "$DB_PATH") -lt 1024 ]; then
       echo "⚠️ ダウンロードしたDBが空または異常です。attendance.dbを削除し、アプリを起動しません。"
-      rm attendance.db
+      rm "$DB_PATH"
       exit 1
     fi
   fi
@@ -0,0 +1,42 @@
+"""テスト共通の準備
+
+アプリは import した時点でデータベースを作り、バックアップ・スケジューラーの設定を読むので、
+import する前に一時ディレクトリをデータディレクトリにし、定期ジョブを止めておく。
+"""
+import os
+import sys
+import tempfile
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+os.environ['RENDER_DATA_DIR'] = tempfile.mkdtemp(prefix='attendance-test-')
+os.environ['SCHEDULER_ENABLED'] = '0'
+os.environ['BACKUP_INTERVAL'] = '0'
+os.environ.setdefault('SECRET_KEY', 'test')
+
+BASE_URL = 'https://localhost'
+
+
+@pytest.fixture(scope='session')
+def app_module():
+    from attendance_system import app as app_module
+    app_module.app.config['TESTING'] = True
+    return app_module
+
+
+@pytest.fixture
+def db(app_module):
+    """テスト用の一時データベース（アプリと同じスキーマ）への接続。コミットしなかった変更は戻す"""
+    with app_module.app.app_context():
+        conn = app_module.get_db_connection()
+        yield conn
+        conn.rollback()
+
+
+def register_and_login(client, username, password='p'):
+    client.post(BASE_URL + '/register', data={'username': username, 'password': password})
+    client.post(BASE_URL + '/login', data={'username': username, 'password': password})
@@ -0,0 +1,60 @@
+"""テスト用の睡眠セッションのデータ"""
+import random
+from datetime import date, timedelta
+
+
+def generate_rows(n, seed=0):
+    """(local_date, duration_seconds) を n 件作る（同日の複数セッションや欠けた日を含む）"""
+    rng = random.Random(seed)
+    day = date(1990, 1, 1)
+    rows = []
+    while len(rows) < n:
+        day += timedelta(days=rng.choices((0, 1, 2), weights=(5, 90, 5))[0])
+        rows.append((day.isoformat(), rng.uniform(3, 11) * 3600))
+    return rows
+
+
+def to_sleep_times(rows):
+    """(local_date, duration_seconds) を calculate_* 関数に渡す dict のリストにする"""
+    sleep_times = []
+    for local_date, duration_seconds in rows:
+        sleep_duration = duration_seconds / 3600
+        sleep_date = date.fromisoformat(local_date)
+        sleep_times.append({
+            'date': sleep_date,
+            'duration': sleep_duration,
+            'hours': int(sleep_duration),
+            'minutes': int((sleep_duration - int(sleep_duration)) * 60),
+            'week': sleep_date.isocalendar()[1],
+            'month': sleep_date.month,
+            'year': sleep_date.year
+        })
+    return sleep_times
+
+
+def comparison_datasets():
+    """比較値のテスト用の入力（並べ替えていない・同じ日付が並ぶ・月末や2月29日・記録があく）"""
+    rng = random.Random(0)
+    datasets = [[]] + [generate_rows(n, seed=seed) for n in (1, 2, 3, 8, 40, 400) for seed in range(3)]
+    for seed in range(5):
+        rows = generate_rows(300, seed=seed)
+        random.Random(seed).shuffle(rows)
+        datasets.append(rows)
+    # 同じ日付が何件も並ぶ入力（順番が結果に効く）
+    datasets.append([(row[0], rng.uniform(0, 20) * 3600) for row in generate_rows(60)] * 3)
+    # 最新の日が月末・2月29日・1月になる入力
+    for last in ('2024-03-31', '2024-02-29', '2024-03-29', '2025-01-15', '2023-12-31'):
+        end = date.fromisoformat(last)
+        rows = [((end - timedelta(days=rng.randrange(0, 800))).isoformat(), rng.uniform(3, 11) * 3600)
+                for _ in range(500)]
+        rows.append((last, 7.5 * 3600))
+        datasets.append(rows)
+    # 記録が数週間あくことのある入力（直近の週に見つからず、曜日ごとの配列で探す）
+    for _ in range(3):
+        day = date(2020, 1, 1)
+        rows = []
+        for _ in range(200):
+            day += timedelta(days=rng.choice((1, 3, 6, 13, 20, 34, 60)))
+            rows.append((day.isoformat(), rng.uniform(3, 11) * 3600))
+        datasets.append(rows)
+    return datasets
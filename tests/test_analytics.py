@@ -0,0 +1,57 @@
+"""/admin/analytics（全体統計はユーザー ID 0 のキャッシュとして全管理者で共有する）"""
+from attendance_system.data_versions import get_user_version
+from conftest import BASE_URL, register_and_login
+from test_rollups import insert_sessions
+
+
+def _admin_client(app_module):
+    client = app_module.app.test_client()
+    client.post(BASE_URL + '/login', data={'username': 'admin', 'password': 'admin'})
+    return client
+
+
+def _stats(client, **query):
+    response = client.get(BASE_URL + '/admin/analytics', query_string={'format': 'json', **query})
+    assert response.status_code == 200
+    return response.get_json()
+
+
+def _analytics_version(app_module):
+    with app_module.app.app_context():
+        return get_user_version(app_module.get_db_connection(), app_module.ANALYTICS_CACHE_OWNER)
+
+
+def test_requires_admin(app_module):
+    client = app_module.app.test_client()
+    register_and_login(client, 'analytics-user')
+    response = client.get(BASE_URL + '/admin/analytics?format=json')
+    assert response.status_code == 302 and '/login' in response.headers['Location']
+
+
+def test_days_are_clamped(app_module):
+    client = _admin_client(app_module)
+    assert len(_stats(client, days=1000)['daily_active']) == 365
+    assert len(_stats(client, days=0)['daily_active']) == 1
+    assert _stats(client, days=7)['days'] == 7
+    assert client.get(BASE_URL + '/admin/analytics').status_code == 200
+
+
+def test_shared_cache_entry_and_refresh(app_module):
+    app_module.stats_cache.clear()
+    admin = _admin_client(app_module)
+    users = _stats(admin)['summary']['users']
+
+    with app_module.app.app_context():
+        conn = app_module.get_db_connection()
+        insert_sessions(conn, 'analytics-new-user', [('2024-01-01', 7 * 3600)])
+        conn.commit()
+
+    # ユーザーの書き込みではユーザー 0 の版は変わらないので、キャッシュした統計を返す
+    version = _analytics_version(app_module)
+    assert _stats(admin)['summary']['users'] == users
+    assert _stats(_admin_client(app_module))['summary']['users'] == users
+
+    # refresh=1 で作り直し、DB 側の版も進める（ほかのワーカーのキャッシュも読まれなくなる）
+    assert _stats(admin, refresh=1)['summary']['users'] == users + 1
+    assert _analytics_version(app_module) == version + 1
+    assert _stats(_admin_client(app_module))['summary']['users'] == users + 1
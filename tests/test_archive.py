@@ -0,0 +1,55 @@
+"""記録のアーカイブと復元"""
+from attendance_system import archive
+
+CUTOFF = '2001-01-01T00:00:00+09:00'
+
+
+def _add_deleted_record(conn, user_id, timestamp):
+    return conn.execute('''
+        INSERT INTO records (user_id, action, timestamp, memo, is_deleted, deleted_at)
+        VALUES (?, 'sleep', ?, '', 1, ?)
+    ''', (user_id, timestamp, timestamp)).lastrowid
+
+
+def test_archive_reused_record_id(db):
+    # records の id は使い回されるので、同じ ID の記録を2回アーカイブできること
+    user_id = db.execute("INSERT INTO users (username, password) VALUES ('archive-reuse', 'x')").lastrowid
+    first_id = _add_deleted_record(db, user_id, '2000-01-01T00:00:00+09:00')
+    assert archive.archive_records(db, archive.DELETED, CUTOFF, '2000-02-01') == (1, {user_id})
+    second_id = _add_deleted_record(db, user_id, '2000-01-02T00:00:00+09:00')
+    assert second_id == first_id
+    assert archive.archive_records(db, archive.DELETED, CUTOFF, '2000-02-01') == (1, {user_id})
+
+    archive_ids = [row['archive_id'] for row in db.execute(
+        'SELECT archive_id FROM record_archive_index WHERE record_id = ? ORDER BY archive_id', (first_id,))]
+    assert len(archive_ids) == 2
+    # どちらのアーカイブからも1件ずつ戻せる（2件目は ID が空いていないので新しい ID になる）
+    for archive_id in archive_ids:
+        assert archive.restore_record(db, archive_id, first_id) == user_id
+    timestamps = [row['timestamp'] for row in db.execute(
+        'SELECT timestamp FROM records WHERE user_id = ? ORDER BY timestamp', (user_id,))]
+    assert timestamps == ['2000-01-01T00:00:00+09:00', '2000-01-02T00:00:00+09:00']
+    assert not db.execute('SELECT 1 FROM record_archive_index WHERE record_id = ?', (first_id,)).fetchone()
+
+
+
+def test_restore_deleted_record_keeps_one_per_day(db):
+    # 削除してアーカイブした後に同じ日に記録し直していたら、戻した記録は削除済みのままにする
+    user_id = db.execute("INSERT INTO users (username, password) VALUES ('archive-conflict', 'x')").lastrowid
+    timestamp = '2000-01-01T23:00:00+09:00'
+    db.execute('''
+        INSERT INTO records (user_id, action, timestamp, memo, is_deleted, deleted_at, local_date)
+        VALUES (?, 'sleep', ?, 'old', 1, ?, '2000-01-01')
+    ''', (user_id, timestamp, timestamp))
+    archive.archive_records(db, archive.DELETED, CUTOFF, '2000-02-01')
+    archive_id = db.execute('SELECT id FROM record_archive WHERE user_id = ?', (user_id,)).fetchone()[0]
+    db.execute('''
+        INSERT INTO records (user_id, action, timestamp, memo, local_date)
+        VALUES (?, 'sleep', '2000-01-01T23:30:00+09:00', 'new', '2000-01-01')
+    ''', (user_id,))
+
+    assert archive.restore_archive(db, archive_id) == 1
+    rows = db.execute('''
+        SELECT memo, is_deleted, deleted_at FROM records WHERE user_id = ? ORDER BY memo
+    ''', (user_id,)).fetchall()
+    assert [tuple(row) for row in rows] == [('new', 0, None), ('old', 1, timestamp)]
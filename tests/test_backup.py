@@ -0,0 +1,32 @@
+"""定期バックアップ（BACKUP_INTERVAL）"""
+import os
+import sqlite3
+import time
+
+from attendance_system.backup import BackupService
+
+
+def test_due_follows_latest_snapshot(tmp_path):
+    db_path = str(tmp_path / 'attendance.db')
+    sqlite3.connect(db_path).close()
+    service = BackupService(db_path, str(tmp_path / 'backups'), interval=3600)
+    assert service.due()
+    path = service.run_once()
+    assert path and not service.due()
+    # 最新のスナップショットが interval より古ければまた取る（再起動しても間隔を保つ）
+    old = time.time() - 3601
+    os.utime(path, (old, old))
+    assert service.due()
+    assert not BackupService(db_path, str(tmp_path / 'backups'), interval=0).due()
+
+
+
+def test_status_lists_snapshots(tmp_path):
+    db_path = str(tmp_path / 'attendance.db')
+    sqlite3.connect(db_path).close()
+    service = BackupService(db_path, str(tmp_path / 'backups'), interval=3600, keep=2)
+    path = service.run_once()
+    status = service.status()
+    assert 'running' not in status
+    assert status['last_snapshot'] == path and status['last_error'] is None
+    assert status['snapshots'] == [os.path.basename(path)]
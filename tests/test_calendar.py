@@ -0,0 +1,69 @@
+"""/api/calendar の月の境目と日本時間の扱い"""
+from attendance_system.sleep_sessions import refresh_user_sessions
+from conftest import BASE_URL, register_and_login
+
+
+def _login_with_records(app_module, username, records):
+    """(action, timestamp, local_date) の記録を持つユーザーでログインしたクライアントを返す"""
+    client = app_module.app.test_client()
+    register_and_login(client, username)
+    with app_module.app.app_context():
+        conn = app_module.get_db_connection()
+        user_id = conn.execute('SELECT id FROM users WHERE username = ?', (username,)).fetchone()[0]
+        conn.executemany('''
+            INSERT INTO records (user_id, action, timestamp, memo, local_date) VALUES (?, ?, ?, '', ?)
+        ''', [(user_id,) + record for record in records])
+        refresh_user_sessions(conn, user_id)
+        conn.commit()
+    return client
+
+
+def _days(client, year, month):
+    response = client.get(BASE_URL + '/api/calendar', query_string={'year': year, 'month': month})
+    assert response.status_code == 200
+    data = response.get_json()
+    assert (data['year'], data['month']) == (year, month)
+    return {day['date']: day for day in data['days']}
+
+
+def test_session_across_month_end_counts_on_wake_day(app_module):
+    # 1月31日に寝て2月1日に起きた睡眠は、起床した2月1日の分になる
+    client = _login_with_records(app_module, 'calendar-month-end', [
+        ('sleep', '2024-01-31T23:00:00+09:00', '2024-01-31'),
+        ('wake_up', '2024-02-01T07:30:00+09:00', '2024-02-01'),
+    ])
+    january = _days(client, 2024, 1)
+    assert list(january) == ['2024-01-31']
+    assert january['2024-01-31']['sleep_count'] == 1
+    assert january['2024-01-31']['session_count'] == 0 and january['2024-01-31']['duration'] is None
+
+    february = _days(client, 2024, 2)
+    assert list(february) == ['2024-02-01']
+    day = february['2024-02-01']
+    assert (day['wake_count'], day['session_count']) == (1, 1)
+    assert (day['duration'], day['hours'], day['minutes']) == (8.5, 8, 30)
+    assert day['evaluation']
+
+
+def test_days_follow_japan_time(app_module):
+    # UTC では2月29日でも、日本時間で3月1日の起床は3月の分になる
+    client = _login_with_records(app_module, 'calendar-timezone', [
+        ('sleep', '2024-02-29T14:00:00+00:00', '2024-02-29'),
+        ('wake_up', '2024-02-29T22:00:00+00:00', '2024-03-01'),
+    ])
+    february = _days(client, 2024, 2)
+    assert list(february) == ['2024-02-29']
+    assert february['2024-02-29']['session_count'] == 0
+
+    march = _days(client, 2024, 3)
+    assert list(march) == ['2024-03-01']
+    assert march['2024-03-01']['session_count'] == 1
+    assert march['2024-03-01']['duration'] == 8.0
+
+
+def test_invalid_month(app_module):
+    client = app_module.app.test_client()
+    register_and_login(client, 'calendar-invalid')
+    for month in (0, 13):
+        response = client.get(BASE_URL + '/api/calendar', query_string={'year': 2024, 'month': month})
+        assert response.status_code == 400
@@ -0,0 +1,74 @@
+"""データベース接続プール"""
+import os
+import sqlite3
+import time
+
+import pytest
+
+from attendance_system.db_pool import ConnectionPool, PoolExhaustedError, create_sqlite_pool
+
+
+def _memory_pool(**kwargs):
+    return ConnectionPool(lambda: sqlite3.connect(':memory:', check_same_thread=False), **kwargs)
+
+
+def test_exhausted_pool_times_out():
+    pool = _memory_pool(size=1, timeout=0.05)
+    conn = pool.acquire()
+    started = time.monotonic()
+    with pytest.raises(PoolExhaustedError):
+        pool.acquire()
+    assert time.monotonic() - started >= 0.05
+    assert pool.stats()['exhausted'] == 1
+    # 返却されればまた借りられる（同じ接続を使い回す）
+    pool.release(conn)
+    assert pool.acquire() is conn
+
+
+def test_pool_resets_after_fork(monkeypatch):
+    pool = _memory_pool(size=1, timeout=0.05)
+    parent_conn = pool.acquire()
+    pid = os.getpid()
+    monkeypatch.setattr(os, 'getpid', lambda: pid + 1)
+    # 子プロセスでは親の接続を使わず、上限も数え直す
+    child_conn = pool.acquire()
+    assert child_conn is not parent_conn
+    assert pool.stats()['open'] == 1
+    # 親の接続が子で返却されてもプールには入れない
+    pool.release(parent_conn)
+    assert pool.stats()['idle'] == 0
+    parent_conn.execute('SELECT 1')
+
+
+def test_failed_health_check_discards_connection():
+    broken = []
+
+    def health_check(conn):
+        if conn in broken:
+            raise sqlite3.OperationalError('gone')
+
+    pool = _memory_pool(size=1, health_check=health_check, health_check_interval=0)
+    stale = pool.acquire()
+    pool.release(stale)
+    broken.append(stale)
+    fresh = pool.acquire()
+    assert fresh is not stale
+    with pytest.raises(sqlite3.ProgrammingError):
+        stale.execute('SELECT 1')
+    stats = pool.stats()
+    assert stats['health_check_failures'] == 1 and stats['discarded'] == 1 and stats['open'] == 1
+
+
+def test_release_rolls_back_open_transaction(tmp_path):
+    pool = create_sqlite_pool(str(tmp_path / 'pool.db'), size=1)
+    conn = pool.acquire()
+    conn.execute('CREATE TABLE items (id INTEGER PRIMARY KEY)')
+    conn.commit()
+    conn.execute('INSERT INTO items DEFAULT VALUES')
+    assert conn.in_transaction
+    pool.release(conn)
+
+    conn = pool.acquire()
+    assert not conn.in_transaction
+    assert conn.execute('SELECT COUNT(*) FROM items').fetchone()[0] == 0
+    pool.release(conn)
@@ -0,0 +1,119 @@
+"""/api/export のストリーミング出力（CSV / JSON Lines）"""
+import csv
+import io
+import json
+from datetime import date, timedelta
+
+import pytest
+
+from attendance_system import export
+from attendance_system.sleep_sessions import refresh_user_sessions
+from conftest import BASE_URL, register_and_login
+
+# fetchmany の区切りをまたぐ件数
+DAYS = export.CHUNK_SIZE // 2 + 3
+START = date(2020, 1, 1)
+
+
+def _login_with_nights(app_module, username, days):
+    """days 晩分の就寝・起床の記録を持つユーザーでログインし、(クライアント, ユーザーID) を返す"""
+    client = app_module.app.test_client()
+    register_and_login(client, username)
+    with app_module.app.app_context():
+        conn = app_module.get_db_connection()
+        user_id = conn.execute('SELECT id FROM users WHERE username = ?', (username,)).fetchone()[0]
+        rows = []
+        for i in range(days):
+            night = START + timedelta(days=i)
+            morning = night + timedelta(days=1)
+            rows += [(user_id, 'sleep', f'{night}T23:00:00+09:00', f'メモ,{i}', night.isoformat()),
+                     (user_id, 'wake_up', f'{morning}T07:00:00+09:00', '', morning.isoformat())]
+        conn.executemany('''
+            INSERT INTO records (user_id, action, timestamp, memo, local_date) VALUES (?, ?, ?, ?, ?)
+        ''', rows)
+        refresh_user_sessions(conn, user_id)
+        conn.commit()
+    return client, user_id
+
+
+@pytest.fixture(scope='module')
+def exporter(app_module):
+    return _login_with_nights(app_module, 'export-user', DAYS)
+
+
+def _csv_rows(response):
+    assert response.status_code == 200
+    assert response.mimetype == 'text/csv'
+    return list(csv.reader(io.StringIO(response.get_data(as_text=True))))
+
+
+def _jsonl_rows(response):
+    assert response.status_code == 200
+    assert response.mimetype == 'application/x-ndjson'
+    return [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+
+
+def test_records_csv(exporter):
+    client, _ = exporter
+    response = client.get(BASE_URL + '/api/export/records')
+    assert response.headers['Content-Disposition'] == 'attachment; filename=records.csv'
+    rows = _csv_rows(response)
+    assert rows[0] == export.RECORD_COLUMNS
+    assert len(rows) == 1 + 2 * DAYS
+    timestamps = [row[2] for row in rows[1:]]
+    assert timestamps == sorted(timestamps)
+    # カンマを含むメモもそのまま読み戻せる
+    assert rows[1][1] == 'sleep' and rows[1][4] == 'メモ,0'
+
+
+def test_records_jsonl_with_filters(exporter):
+    client, _ = exporter
+    rows = _jsonl_rows(client.get(BASE_URL + '/api/export/records', query_string={'format': 'jsonl'}))
+    assert len(rows) == 2 * DAYS
+    assert list(rows[0]) == export.RECORD_COLUMNS
+
+    rows = _jsonl_rows(client.get(BASE_URL + '/api/export/records', query_string={
+        'format': 'jsonl', 'action': 'wake_up', 'from': '2020-01-05', 'to': '2020-01-09'}))
+    assert [row['local_date'] for row in rows] == [f'2020-01-0{d}' for d in range(5, 10)]
+    assert {row['action'] for row in rows} == {'wake_up'}
+
+
+def test_sessions(exporter):
+    client, _ = exporter
+    rows = _csv_rows(client.get(BASE_URL + '/api/export/sessions'))
+    assert rows[0] == export.SESSION_COLUMNS
+    assert len(rows) == 1 + DAYS
+    assert float(rows[1][2]) == 8 * 3600
+    assert len(_jsonl_rows(client.get(BASE_URL + '/api/export/sessions?format=jsonl'))) == DAYS
+
+
+def test_empty_export_has_header_only(app_module):
+    client = app_module.app.test_client()
+    register_and_login(client, 'export-empty')
+    assert _csv_rows(client.get(BASE_URL + '/api/export/records')) == [export.RECORD_COLUMNS]
+    assert _csv_rows(client.get(BASE_URL + '/api/export/sessions')) == [export.SESSION_COLUMNS]
+    assert _jsonl_rows(client.get(BASE_URL + '/api/export/records?format=jsonl')) == []
+
+
+def test_user_id_is_only_for_admins(app_module, exporter):
+    _, user_id = exporter
+    client = app_module.app.test_client()
+    register_and_login(client, 'export-other')
+    query = {'user_id': user_id}
+    assert len(_csv_rows(client.get(BASE_URL + '/api/export/records', query_string=query))) == 1
+
+    admin = app_module.app.test_client()
+    admin.post(BASE_URL + '/login', data={'username': 'admin', 'password': 'admin'})
+    assert len(_csv_rows(admin.get(BASE_URL + '/api/export/records', query_string=query))) == 1 + 2 * DAYS
+
+
+@pytest.mark.parametrize('query', [
+    {'format': 'xml'},
+    {'from': '2020-02-30'},
+    {'action': 'nap'},
+])
+def test_invalid_parameters(exporter, query):
+    client, _ = exporter
+    response = client.get(BASE_URL + '/api/export/records', query_string=query)
+    assert response.status_code == 400
+    assert 'error' in response.get_json()
@@ -0,0 +1,34 @@
+"""/api/feed の ETag（data_versions のバージョンから作る）"""
+from conftest import BASE_URL, register_and_login
+
+
+def test_unchanged_feed_returns_304(app_module):
+    client = app_module.app.test_client()
+    register_and_login(client, 'feed-etag-unchanged')
+    response = client.get(BASE_URL + '/api/feed')
+    assert response.status_code == 200
+    etag = response.headers['ETag']
+
+    # 読み込みだけならバージョンは変わらない
+    client.get(BASE_URL + '/api/feed?limit=5')
+    response = client.get(BASE_URL + '/api/feed', headers={'If-None-Match': etag})
+    assert response.status_code == 304
+    assert response.headers['ETag'] == etag
+    assert response.data == b''
+    # 条件が違えば ETag も違う
+    response = client.get(BASE_URL + '/api/feed?limit=5', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+
+
+def test_write_changes_etag(app_module):
+    client = app_module.app.test_client()
+    register_and_login(client, 'feed-etag-write')
+    etag = client.get(BASE_URL + '/api/feed').headers['ETag']
+
+    client.post(BASE_URL + '/record', data={'action': 'sleep', 'memo': 'etag'})
+    response = client.get(BASE_URL + '/api/feed', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert response.headers['ETag'] != etag
+    assert any(record['username'] == 'feed-etag-write' and record['memo'] == 'etag'
+               for record in response.get_json()['records'])
+    assert client.get(BASE_URL + '/api/feed', headers={'If-None-Match': response.headers['ETag']}).status_code == 304
@@ -0,0 +1,100 @@
+"""記録の一括取り込み"""
+from attendance_system.ingest import ingest_rows, summarize_results
+
+
+def _add_user(conn, username):
+    return conn.execute('INSERT INTO users (username, password) VALUES (?, ?)', (username, 'x')).lastrowid
+
+
+def _row(action, timestamp, user_id=None):
+    row = {'action': action, 'timestamp': timestamp}
+    if user_id is not None:
+        row['user_id'] = str(user_id)
+    return row
+
+
+def _ingest(conn, rows, **kwargs):
+    # db フィクスチャはテスト後にロールバックするので、コミットしない write を渡す
+    return ingest_rows(conn, list(enumerate(rows, start=1)), write=lambda fn: fn(conn), **kwargs)
+
+
+def _statuses(results):
+    return [result['status'] for result in results]
+
+
+def test_duplicates_in_input_and_existing(db):
+    user_id = _add_user(db, 'ingest-dup')
+    db.execute('''
+        INSERT INTO records (user_id, action, timestamp, memo, local_date)
+        VALUES (?, 'sleep', '2000-01-01T23:00:00+09:00', '', '2000-01-01')
+    ''', (user_id,))
+    results, touched = _ingest(db, [
+        _row('sleep', '2000-01-01T22:00:00+09:00'),
+        _row('wake_up', '2000-01-02T07:00:00+09:00'),
+        _row('wake_up', '2000-01-02T08:00:00+09:00'),
+    ], default_user_id=user_id)
+    assert _statuses(results) == ['duplicate', 'inserted', 'duplicate']
+    assert touched == {user_id}
+    assert summarize_results(results) == {'inserted': 1, 'duplicate': 2, 'invalid': 0}
+
+
+def test_unknown_user_and_allowed_user_id(db):
+    user_id = _add_user(db, 'ingest-owner')
+    other_id = _add_user(db, 'ingest-other')
+    missing_id = other_id + 1000
+    results, touched = _ingest(db, [
+        _row('sleep', '2000-01-01T23:00:00+09:00', user_id),
+        _row('sleep', '2000-01-01T23:00:00+09:00', other_id),
+        _row('sleep', '2000-01-01T23:00:00+09:00', missing_id),
+    ], default_user_id=user_id, allowed_user_id=user_id)
+    assert _statuses(results) == ['inserted', 'invalid', 'invalid']
+    assert results[1]['error'] == '他のユーザーの記録は登録できません'
+    assert touched == {user_id}
+
+    # 管理者（allowed_user_id なし）でも存在しないユーザーには登録しない
+    results, touched = _ingest(db, [_row('sleep', '2000-01-01T23:00:00+09:00', missing_id)])
+    assert results == [{'line': 1, 'status': 'invalid', 'error': f'ユーザーが存在しません: {missing_id}'}]
+    assert touched == set()
+    assert not db.execute('SELECT 1 FROM records WHERE user_id = ?', (missing_id,)).fetchone()
+
+
+def test_duplicate_across_batch_boundary(db):
+    user_id = _add_user(db, 'ingest-batch')
+    calls = []
+
+    def write(fn):
+        calls.append(fn)
+        return fn(db)
+
+    results, _ = ingest_rows(db, list(enumerate([
+        _row('sleep', '2000-01-01T23:00:00+09:00'),
+        _row('wake_up', '2000-01-02T07:00:00+09:00'),
+        _row('sleep', '2000-01-01T23:30:00+09:00'),
+        _row('sleep', '2000-01-02T23:00:00+09:00'),
+        {'action': 'nap', 'timestamp': '2000-01-03T12:00:00+09:00'},
+    ], start=1)), default_user_id=user_id, batch_size=2, write=write)
+    # 不正な行は除いてから2行ずつのバッチにする
+    assert len(calls) == 2
+    assert _statuses(results) == ['inserted', 'inserted', 'duplicate', 'inserted', 'invalid']
+    assert [result['line'] for result in results] == [1, 2, 3, 4, 5]
+    count = db.execute('SELECT COUNT(*) FROM records WHERE user_id = ?', (user_id,)).fetchone()[0]
+    assert count == 3
+
+
+def test_duplicate_check_runs_inside_write(db):
+    # 取り込みの開始後（書き込みの直前）に同じ日の記録が増えても重複して登録しない
+    user_id = _add_user(db, 'ingest-race')
+
+    def write(fn):
+        db.execute('''
+            INSERT INTO records (user_id, action, timestamp, memo, local_date)
+            VALUES (?, 'sleep', '2000-01-01T23:00:00+09:00', '', '2000-01-01')
+        ''', (user_id,))
+        return fn(db)
+
+    results, touched = ingest_rows(db, [(1, _row('sleep', '2000-01-01T22:00:00+09:00'))],
+                                   default_user_id=user_id, write=write)
+    assert _statuses(results) == ['duplicate']
+    assert touched == set()
+    count = db.execute('SELECT COUNT(*) FROM records WHERE user_id = ?', (user_id,)).fetchone()[0]
+    assert count == 1
@@ -0,0 +1,29 @@
+"""いいね数（records.likes_count）の足し込み"""
+from attendance_system.likes import add_like, fold_like_deltas, reconcile_like_counts
+
+
+def _likes_count(conn, record_id):
+    return conn.execute('SELECT likes_count FROM records WHERE id = ?', (record_id,)).fetchone()[0]
+
+
+def test_fold_after_like_id_is_reused(db):
+    # likes の id は使い回されるので、反映済みの id と同じ id の新しいいいねも足し込まれること
+    fold_like_deltas(db)
+    user_id = db.execute("INSERT INTO users (username, password) VALUES ('likes-reuse', 'x')").lastrowid
+    record_id = db.execute('''
+        INSERT INTO records (user_id, action, timestamp, memo) VALUES (?, 'sleep', '2000-01-01T00:00:00+09:00', '')
+    ''', (user_id,)).lastrowid
+    assert add_like(db, user_id, record_id, '2000-01-01')
+    assert fold_like_deltas(db) == 1
+    first_id = db.execute('SELECT MAX(id) FROM likes').fetchone()[0]
+
+    # 最新のいいねが（退会・アーカイブなどで）消えると、次のいいねが同じ id になる
+    db.execute('DELETE FROM likes WHERE id = ?', (first_id,))
+    reconcile_like_counts(db, [record_id])
+    assert _likes_count(db, record_id) == 0
+    assert add_like(db, user_id, record_id, '2000-01-02')
+    assert db.execute('SELECT MAX(id) FROM likes').fetchone()[0] == first_id
+    assert fold_like_deltas(db) == 1
+    assert _likes_count(db, record_id) == 1
+    assert fold_like_deltas(db) == 0
+
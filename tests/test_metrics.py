@@ -0,0 +1,45 @@
+"""/metrics の認可（管理者のセッションか、METRICS_TOKEN の Bearer トークン）"""
+import pytest
+
+from conftest import BASE_URL, register_and_login
+
+
+@pytest.fixture
+def token(monkeypatch):
+    monkeypatch.setenv('METRICS_TOKEN', 'metrics-secret')
+    return 'metrics-secret'
+
+
+def test_admin_session(app_module):
+    client = app_module.app.test_client()
+    client.post(BASE_URL + '/login', data={'username': 'admin', 'password': 'admin'})
+    response = client.get(BASE_URL + '/metrics')
+    assert response.status_code == 200
+    assert response.mimetype == 'text/plain'
+    assert b'_request_duration_seconds' in response.data
+    rows = client.get(BASE_URL + '/metrics?format=json').get_json()
+    assert any(row['endpoint'] == 'metrics' for row in rows)
+
+
+def test_bearer_token(app_module, token):
+    client = app_module.app.test_client()
+    response = client.get(BASE_URL + '/metrics', headers={'Authorization': f'Bearer {token}'})
+    assert response.status_code == 200
+    for authorization in ('Bearer wrong', token, f'Basic {token}', ''):
+        response = client.get(BASE_URL + '/metrics', headers={'Authorization': authorization})
+        assert response.status_code == 403, authorization
+
+
+def test_anonymous_and_users_are_forbidden(app_module, token):
+    assert app_module.app.test_client().get(BASE_URL + '/metrics').status_code == 403
+    client = app_module.app.test_client()
+    register_and_login(client, 'metrics-user')
+    assert client.get(BASE_URL + '/metrics').status_code == 403
+
+
+def test_no_token_configured(app_module, monkeypatch):
+    # METRICS_TOKEN が未設定なら空の Bearer でも通さない
+    monkeypatch.delenv('METRICS_TOKEN', raising=False)
+    client = app_module.app.test_client()
+    for authorization in ('Bearer ', 'Bearer None'):
+        assert client.get(BASE_URL + '/metrics', headers={'Authorization': authorization}).status_code == 403
@@ -0,0 +1,87 @@
+"""カーソル方式のページネーションと件数キャッシュ"""
+import base64
+import json
+import sqlite3
+
+import pytest
+
+from attendance_system.pagination import (
+    CountCache, InvalidCursorError, decode_cursor, encode_cursor, fetch_keyset_page
+)
+from conftest import BASE_URL, register_and_login
+
+
+def _raw_token(payload):
+    return base64.urlsafe_b64encode(json.dumps(payload).encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def test_cursor_round_trip():
+    token = encode_cursor('prev', '2024-01-01T07:00:00+09:00', 42)
+    assert decode_cursor(token) == ('prev', '2024-01-01T07:00:00+09:00', 42)
+    assert decode_cursor('') is None and decode_cursor(None) is None
+
+
+@pytest.mark.parametrize('token', [
+    'not-a-token!',
+    encode_cursor('next', '2024-01-01', 1)[:-3],
+    _raw_token(['sideways', '2024-01-01', 1]),
+    _raw_token(['next', '2024-01-01', '1']),
+    _raw_token(['next', '2024-01-01', True]),
+    _raw_token({'direction': 'next'}),
+])
+def test_invalid_cursor(token):
+    with pytest.raises(InvalidCursorError):
+        decode_cursor(token)
+
+
+def test_invalid_cursor_returns_400(app_module):
+    client = app_module.app.test_client()
+    register_and_login(client, 'pagination-invalid')
+    for path in ('/api/feed', '/all_records'):
+        response = client.get(BASE_URL + path, query_string={'cursor': _raw_token(['next', 'x', 'y'])})
+        assert response.status_code == 400
+        assert response.get_json() == {'error': 'カーソルが不正です'}
+
+
+def test_pages_are_stable_across_timestamp_ties():
+    conn = sqlite3.connect(':memory:')
+    conn.row_factory = sqlite3.Row
+    conn.execute('CREATE TABLE items (id INTEGER PRIMARY KEY, timestamp TEXT)')
+    # 同じ時刻の行が多いと、timestamp だけで区切ると行が飛んだり重複したりする
+    conn.executemany('INSERT INTO items (id, timestamp) VALUES (?, ?)',
+                     [(i, f'2024-01-0{i % 3 + 1}') for i in range(1, 12)])
+    expected = [row['id'] for row in conn.execute('SELECT id FROM items ORDER BY timestamp DESC, id DESC')]
+
+    def page(cursor):
+        return fetch_keyset_page(conn, 'SELECT id, timestamp AS cursor_ts, id AS cursor_id FROM items',
+                                 '1', [], cursor, 3)
+
+    seen, pages, cursor = [], [], None
+    while True:
+        rows, next_token, prev_token = page(cursor)
+        seen += [row['id'] for row in rows]
+        pages.append((cursor, [row['id'] for row in rows], prev_token))
+        if next_token is None:
+            break
+        cursor = next_token
+    assert seen == expected
+
+    # 前のページへ戻っても同じ行が同じ順で並ぶ
+    for (_, previous_ids, _), (_, _, prev_token) in zip(pages, pages[1:]):
+        rows, _, _ = page(prev_token)
+        assert [row['id'] for row in rows] == previous_ids
+
+
+def test_count_cache_evicts_least_recently_used():
+    conn = sqlite3.connect(':memory:')
+    cache = CountCache(ttl=60, maxsize=2)
+    cache.get(conn, 'SELECT ?', (1,))
+    cache.get(conn, 'SELECT ?', (2,))
+    cache.get(conn, 'SELECT ?', (1,))
+    cache.get(conn, 'SELECT ?', (3,))
+    assert len(cache) == 2
+    # (2,) が最も使われていないので捨てられ、(1,) はキャッシュから返る
+    conn.close()
+    assert cache.get(None, 'SELECT ?', (1,)) == 1
+    with pytest.raises(AttributeError):
+        cache.get(None, 'SELECT ?', (2,))
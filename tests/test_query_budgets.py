@@ -0,0 +1,141 @@
+"""ルートごとのクエリ数が QUERY_BUDGETS の上限に収まること
+
+QUERY_BUDGETS のすべてのルートを、キャッシュが空のときと温まったときの両方で実行する。
+上限はページの件数やユーザー数に依存しないはずなので、複数ユーザー・数十日分の記録を入れておく
+（1件ごとにクエリを投げる N+1 になっていれば上限を超える）。
+"""
+from datetime import date, datetime, timedelta
+
+import pytest
+import pytz
+from flask import request, request_finished
+
+from attendance_system.query_plans import check_statements
+from conftest import BASE_URL, register_and_login
+
+JST = pytz.timezone('Asia/Tokyo')
+USERS = ('budget0', 'budget1', 'budget2')
+DAYS = 40
+
+
+def _seed(app_module):
+    """各ユーザーに DAYS 日分の睡眠・起床の記録と、ほかのユーザーの記録へのいいねを入れる"""
+    with app_module.app.app_context():
+        conn = app_module.get_db_connection()
+        user_ids = [conn.execute('SELECT id FROM users WHERE username = ?', (name,)).fetchone()[0]
+                    for name in USERS]
+        today = datetime.now(JST).date()
+        for user_id in user_ids:
+            for i in range(1, DAYS + 1):
+                sleep_at = JST.localize(datetime.combine(today - timedelta(days=i), datetime.min.time())
+                                        + timedelta(hours=23))
+                wake_at = sleep_at + timedelta(hours=7, minutes=i)
+                for action, moment in (('sleep', sleep_at), ('wake_up', wake_at)):
+                    conn.execute('''
+                        INSERT INTO records (user_id, action, timestamp, memo, local_date)
+                        VALUES (?, ?, ?, '', ?)
+                    ''', (user_id, action, moment.isoformat(), moment.date().isoformat()))
+            app_module.refresh_user_sessions(conn, user_id)
+        record_ids = [row[0] for row in conn.execute('SELECT id FROM records WHERE user_id != ?', (user_ids[0],))]
+        conn.executemany('INSERT INTO likes (user_id, record_id, timestamp) VALUES (?, ?, ?)',
+                         [(user_ids[0], record_id, datetime.now(JST).isoformat()) for record_id in record_ids[:30]])
+        app_module.reconcile_like_counts(conn)
+        conn.commit()
+        return user_ids, record_ids
+
+
+@pytest.fixture(scope='module')
+def setup(app_module):
+    clients = {}
+    for name in USERS:
+        clients[name] = app_module.app.test_client()
+        register_and_login(clients[name], name)
+    user_ids, record_ids = _seed(app_module)
+    admin = app_module.app.test_client()
+    admin.post(BASE_URL + '/login', data={'username': 'admin', 'password': 'admin'})
+    return clients, admin, user_ids, record_ids
+
+
+def _own_record(app_module, user_id):
+    with app_module.app.app_context():
+        return app_module.get_db_connection().execute(
+            'SELECT id FROM records WHERE user_id = ? AND is_deleted = 0 ORDER BY id DESC LIMIT 1',
+            (user_id,)).fetchone()[0]
+
+
+def _requests(app_module, setup):
+    """エンドポイント名 → (クライアント, メソッド, URL, フォーム) のリスト"""
+    clients, admin, user_ids, record_ids = setup
+    user = clients[USERS[0]]
+    day = (date.today() - timedelta(days=3)).isoformat()
+    return {
+        'index': [(user, 'get', '/', None)],
+        'all_records': [(user, 'get', '/all_records', None), (admin, 'get', '/all_records', None)],
+        'api_feed': [(user, 'get', '/api/feed', None)],
+        'day_records': [(user, 'get', f'/day_records/{day}', None), (admin, 'get', f'/day_records/{day}', None)],
+        'average_sleep': [(user, 'get', '/average_sleep', None), (user, 'get', '/average_sleep?period=all', None)],
+        'sleep_data': [(user, 'get', f'/api/sleep_data?period={p}', None) for p in ('daily', 'weekly', 'monthly')],
+        'api_calendar': [(user, 'get', '/api/calendar', None)],
+        'sleep_comparisons': [(user, 'get', '/api/sleep_comparisons?windows=7,30&series=30', None)],
+        'record': [(clients[USERS[1]], 'post', '/record', {'action': 'sleep', 'memo': 'x'}),
+                   (clients[USERS[1]], 'post', '/record', {'action': 'wake_up', 'memo': 'x'})],
+        'like_record': [(user, 'post', f'/like_record/{record_ids[-1]}', {})],
+        'delete_record': [(clients[USERS[2]], 'post',
+                           f'/delete_record/{_own_record(app_module, user_ids[2])}', {})],
+        'admin_dashboard': [(admin, 'get', '/admin_dashboard', None)],
+        'admin_user_records': [(admin, 'get', f'/admin/user_records/{user_ids[0]}', None)],
+        'admin_analytics': [(admin, 'get', '/admin/analytics', None)],
+        'admin_archive': [(admin, 'get', '/admin/archive', None)],
+    }
+
+
+def test_every_budget_is_tested(app_module, setup):
+    assert set(_requests(app_module, setup)) == set(app_module.QUERY_BUDGETS)
+
+
+@pytest.fixture
+def endpoints(app_module):
+    """処理したリクエストのエンドポイント名（ログイン画面へのリダイレクトなどで素通りしていないか確かめる）"""
+    seen = []
+
+    def record(sender, response, **extra):
+        seen.append(request.endpoint)
+
+    request_finished.connect(record, app_module.app)
+    yield seen
+    request_finished.disconnect(record, app_module.app)
+
+
+@pytest.mark.parametrize('warm', [False, True], ids=['cold', 'warm'])
+def test_query_budgets(app_module, setup, endpoints, warm):
+    profiler = app_module.query_profiler
+    for endpoint, requests in _requests(app_module, setup).items():
+        budget = app_module.QUERY_BUDGETS[endpoint]
+        for client, method, url, form in requests:
+            if warm:
+                getattr(client, method)(BASE_URL + url, data=form)
+            else:
+                app_module.stats_cache.clear()
+            with profiler.query_budget(budget, endpoint) as queries:
+                response = getattr(client, method)(BASE_URL + url, data=form)
+            assert response.status_code < 400, (endpoint, url, response.status_code)
+            assert endpoints[-1] == endpoint, (endpoint, url)
+            # キャッシュが空なら必ずデータベースを読む（計測できているか）
+            assert warm or queries, (endpoint, url)
+            assert len(queries) <= budget, (endpoint, url, queries)
+
+
+def test_route_statements_use_indexes(app_module, setup):
+    # HOT_QUERIES の写しではなく、ルートが実際に実行した文とパラメータで実行計画を確かめる
+    profiler = app_module.query_profiler
+    app_module.stats_cache.clear()
+    statements = profiler.start_recording(with_params=True)
+    try:
+        for requests in _requests(app_module, setup).values():
+            for client, method, url, form in requests:
+                getattr(client, method)(BASE_URL + url, data=form)
+    finally:
+        profiler.stop_recording(statements)
+    assert any('FROM records' in sql for sql, _ in statements)
+    with app_module.app.app_context():
+        assert check_statements(app_module.get_db_connection().raw, statements) == {}
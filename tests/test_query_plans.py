@@ -0,0 +1,17 @@
+"""主要クエリが records・likes・集計テーブルを全件スキャンしていないこと
+
+アプリと同じスキーマ（init_db で作った一時データベース）で EXPLAIN QUERY PLAN を取る。
+"""
+import pytest
+
+from attendance_system.query_plans import HOT_QUERIES, find_full_scans
+
+
+@pytest.mark.parametrize('name, sql, params', HOT_QUERIES, ids=[q[0] for q in HOT_QUERIES])
+def test_hot_query_uses_index(db, name, sql, params):
+    assert find_full_scans(db, sql, params) == []
+
+
+def test_find_full_scans_detects_scan(db):
+    # インデックスのない列での絞り込みは検出されること（チェック自体が壊れていないか）
+    assert find_full_scans(db, 'SELECT * FROM records WHERE memo = ?', ('x',))
@@ -0,0 +1,87 @@
+"""週別・月別の集計テーブル（rollups）と stats.py の基準実装との一致"""
+import random
+from datetime import date, timedelta
+
+import pytest
+
+from attendance_system import rollups, stats
+from attendance_system.sleep_sessions import load_sleep_times
+
+# 評価が切り替わる睡眠時間（evaluate_sleep の境界）
+EVALUATION_BOUNDARIES = [7.0 * ratio for ratio in (0.5, 0.858, 1.0, 1.286, 1.5)]
+
+
+def insert_sessions(conn, username, sessions):
+    """(local_date, duration_seconds) のセッションを持つユーザーを作る（集計テーブルはトリガーで更新）"""
+    user_id = conn.execute("INSERT INTO users (username, password) VALUES (?, 'x')", (username,)).lastrowid
+    conn.executemany('''
+        INSERT INTO sleep_sessions
+        (user_id, sleep_record_id, wake_record_id, sleep_ts, wake_ts, duration_seconds, local_date)
+        VALUES (?, 0, ?, ?, ?, ?, ?)
+    ''', [(user_id, i, f'{d}T{i:09d}', f'{d}T{i:09d}', seconds, d) for i, (d, seconds) in enumerate(sessions)])
+    return user_id
+
+
+def random_sessions(n, seed):
+    rng = random.Random(seed)
+    day = date(2023, 12, 20)
+    sessions = []
+    for _ in range(n):
+        day += timedelta(days=rng.choice((0, 1, 1, 1, 2)))
+        # 記録の時刻にはマイクロ秒が付くので、睡眠時間（秒）も整数とは限らない
+        sessions.append((day.isoformat(), rng.uniform(3, 11) * 3600))
+    return sessions
+
+
+def assert_matches_reference(expected, actual):
+    """rollups の結果が基準実装と許容範囲内で一致すること
+
+    rollups は秒の合計から平均を出し、基準実装は時間に直した値を1件ずつ足すので、
+    avg_duration は浮動小数点の誤差（1e-9 時間未満）だけ違うことがある。
+    そのため表示の時・分と評価は、平均がちょうど分や評価の境界にあるときだけ食い違ってよい。
+    期間・件数などほかの項目は完全に一致すること。
+    """
+    assert len(actual) == len(expected)
+    for e, a in zip(expected, actual):
+        assert {k: v for k, v in a.items() if k not in ('avg_duration', 'avg_hours', 'avg_minutes', 'evaluation')} == \
+            {k: v for k, v in e.items() if k not in ('avg_duration', 'avg_hours', 'avg_minutes', 'evaluation')}
+        assert a['avg_duration'] == pytest.approx(e['avg_duration'], rel=0, abs=1e-9)
+        if (a['avg_hours'], a['avg_minutes']) != (e['avg_hours'], e['avg_minutes']):
+            minutes = e['avg_duration'] * 60
+            assert abs(minutes - round(minutes)) < 1e-6
+            assert abs((a['avg_hours'] * 60 + a['avg_minutes']) - (e['avg_hours'] * 60 + e['avg_minutes'])) == 1
+        if a['evaluation'] != e['evaluation']:
+            assert min(abs(e['avg_duration'] - b) for b in EVALUATION_BOUNDARIES) < 1e-9
+
+
+@pytest.mark.parametrize('seed', range(3))
+def test_rollups_match_reference(db, seed):
+    user_id = insert_sessions(db, f'rollup{seed}', random_sessions(2000, seed))
+    sleep_times = load_sleep_times(db, user_id)
+    assert_matches_reference(stats.calculate_weekly_average(sleep_times),
+                             rollups.weekly_averages(db, user_id, stats.evaluate_sleep))
+    assert_matches_reference(stats.calculate_monthly_average(sleep_times),
+                             rollups.monthly_averages(db, user_id, stats.evaluate_sleep))
+
+
+def test_rollups_after_delete_and_rebuild(db):
+    user_id = insert_sessions(db, 'rollup-delete', random_sessions(500, 10))
+    # トリガーでの差し引き（記録の削除）と作り直しのどちらでも基準実装と合うこと
+    db.execute('DELETE FROM sleep_sessions WHERE user_id = ? AND wake_record_id % 3 = 0', (user_id,))
+    for _ in range(2):
+        sleep_times = load_sleep_times(db, user_id)
+        assert_matches_reference(stats.calculate_weekly_average(sleep_times),
+                                 rollups.weekly_averages(db, user_id, stats.evaluate_sleep))
+        assert_matches_reference(stats.calculate_monthly_average(sleep_times),
+                                 rollups.monthly_averages(db, user_id, stats.evaluate_sleep))
+        rollups.rebuild_rollups(db, user_id)
+
+
+def test_minute_boundary_tolerance(db):
+    # 平均がちょうど 8時間44分 になる組み合わせ。足し算の順番の違いで表示の分が1分ずれる
+    sessions = [('2024-01-01', 24631), ('2024-01-02', 28089.1), ('2024-01-03', 41599.9)]
+    user_id = insert_sessions(db, 'rollup-boundary', sessions)
+    expected = stats.calculate_weekly_average(load_sleep_times(db, user_id))
+    actual = rollups.weekly_averages(db, user_id, stats.evaluate_sleep)
+    assert expected[0]['avg_minutes'] != actual[0]['avg_minutes']
+    assert_matches_reference(expected, actual)
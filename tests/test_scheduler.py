@@ -0,0 +1,31 @@
+"""スケジューラーのリース"""
+import sqlite3
+import time
+from datetime import datetime, timedelta, timezone
+
+from attendance_system.scheduler import Scheduler
+
+
+def test_lease_is_renewed_during_long_job(tmp_path):
+    # リースの期限（0.3秒）より長いジョブの実行中も、ほかのプロセスはリースを取れない
+    path = str(tmp_path / 'jobs.db')
+    clock = [datetime(2024, 1, 1, tzinfo=timezone.utc)]
+    leader = Scheduler(lambda: sqlite3.connect(path, timeout=5), now=lambda: clock[0], lease_seconds=0.3)
+    other = Scheduler(lambda: sqlite3.connect(path, timeout=5), now=lambda: clock[0], lease_seconds=0.3)
+    taken = []
+
+    def long_job():
+        conn = sqlite3.connect(path, timeout=5)
+        try:
+            for _ in range(4):
+                time.sleep(0.25)
+                taken.append(other.acquire_lease(conn))
+        finally:
+            conn.close()
+
+    leader.register('long', '* * * * *', long_job)
+    assert leader.run_pending() == []
+    clock[0] += timedelta(minutes=2)
+    assert leader.run_pending() == ['long']
+    assert taken == [False] * 4
+    assert leader.status()['jobs'][0]['last_status'] == 'ok'
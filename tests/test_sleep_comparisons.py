@@ -0,0 +1,74 @@
+"""/api/sleep_comparisons"""
+from datetime import date, timedelta
+
+import pytest
+
+from conftest import BASE_URL, register_and_login
+
+
+def _login_with_sessions(app_module, username, hours_by_day):
+    """{local_date: 睡眠時間} のセッションを持つユーザーでログインしたクライアントを返す"""
+    client = app_module.app.test_client()
+    register_and_login(client, username)
+    with app_module.app.app_context():
+        conn = app_module.get_db_connection()
+        user_id = conn.execute('SELECT id FROM users WHERE username = ?', (username,)).fetchone()[0]
+        conn.executemany('''
+            INSERT INTO sleep_sessions
+            (user_id, sleep_record_id, wake_record_id, sleep_ts, wake_ts, duration_seconds, local_date)
+            VALUES (?, 0, ?, ?, ?, ?, ?)
+        ''', [(user_id, i, f'{d}T00:00:00+09:00', f'{d}T07:00:00+09:00', hours * 3600, d)
+              for i, (d, hours) in enumerate(sorted(hours_by_day.items()))])
+        conn.commit()
+    return client
+
+
+def test_no_sessions(app_module):
+    client = app_module.app.test_client()
+    register_and_login(client, 'comparisons-empty')
+    data = client.get(BASE_URL + '/api/sleep_comparisons').get_json()
+    assert data['date'] is None and data['windows'] == [] and data['series'] == {}
+    assert data['comparisons']['yesterday'] == {'diff_hours': 0, 'diff_minutes': 0, 'is_increase': False}
+
+
+def test_comparisons_and_windows(app_module):
+    start = date(2024, 1, 1)
+    hours_by_day = {(start + timedelta(days=i)).isoformat(): 7.0 for i in range(13)}
+    hours_by_day['2024-01-14'] = 8.5
+    client = _login_with_sessions(app_module, 'comparisons-windows', hours_by_day)
+
+    # 基準日は date 以前で最新の記録の日
+    data = client.get(BASE_URL + '/api/sleep_comparisons',
+                      query_string={'windows': '7', 'date': '2024-01-20', 'series': '3'}).get_json()
+    assert data['date'] == '2024-01-14'
+    assert data['comparisons']['yesterday'] == {'diff_hours': 1, 'diff_minutes': 30, 'is_increase': True}
+    assert data['comparisons']['last_week'] == {'diff_hours': 1, 'diff_minutes': 30, 'is_increase': True}
+
+    [window] = data['windows']
+    assert window['current'] == {'from': '2024-01-08', 'to': '2024-01-14', 'sessions': 7,
+                                 'avg_duration': pytest.approx((6 * 7.0 + 8.5) / 7)}
+    assert (window['previous']['sessions'], window['previous']['avg_duration']) == (7, 7.0)
+    assert window['vs_previous'] == {'diff_hours': 0, 'diff_minutes': 12, 'is_increase': True}
+    assert window['last_year']['sessions'] == 0 and window['vs_last_year'] is None
+    assert [point['date'] for point in data['series']['7']] == ['2024-01-12', '2024-01-13', '2024-01-14']
+
+    # 記録より前の日を指定すると基準日がない
+    data = client.get(BASE_URL + '/api/sleep_comparisons', query_string={'date': '2023-12-31'}).get_json()
+    assert data['date'] is None
+
+
+@pytest.mark.parametrize('query', [
+    {'windows': '0'},
+    {'windows': '367'},
+    {'windows': '1,2,3,4,5,6'},
+    {'windows': '7,x'},
+    {'date': '2024-13-01'},
+    {'series': '367'},
+    {'series': '-1'},
+])
+def test_invalid_parameters(app_module, query):
+    client = app_module.app.test_client()
+    register_and_login(client, 'comparisons-invalid')
+    response = client.get(BASE_URL + '/api/sleep_comparisons', query_string=query)
+    assert response.status_code == 400
+    assert 'error' in response.get_json()
@@ -0,0 +1,41 @@
+"""/api/sleep_data の日別データの間引き（max_points）"""
+import random
+from datetime import date, timedelta
+
+import pytest
+
+from test_rollups import insert_sessions
+
+
+def _sessions(days, per_day=1):
+    start = date(2024, 1, 10)
+    return [((start + timedelta(days=d)).isoformat(), 7 * 3600) for d in days for _ in range(per_day)]
+
+
+@pytest.mark.parametrize('response_format', ['rows', 'columns'])
+def test_max_points_with_date_from(app_module, db, response_format):
+    # date_from から数えて区切ると、データの範囲から求めた日数では区切りが1つ多くなることがあった
+    user_id = insert_sessions(db, f'points-{response_format}', _sessions([0, 1]))
+    data = app_module.build_daily_sleep_data(db, user_id, response_format, date_from=date(2024, 1, 9), max_points=1)
+    points = data['date'] if response_format == 'columns' else data
+    assert len(points) == 1
+    count = data['count'][0] if response_format == 'columns' else points[0]['count']
+    assert count == 2
+
+
+def test_max_points_same_day_sessions(app_module, db):
+    user_id = insert_sessions(db, 'points-same-day', _sessions([0], per_day=3))
+    data = app_module.build_daily_sleep_data(db, user_id, max_points=1)
+    assert len(data) == 1 and data[0]['count'] == 3
+
+
+def test_max_points_random(app_module, db):
+    rng = random.Random(0)
+    user_id = insert_sessions(db, 'points-random', _sessions(sorted(rng.sample(range(400), 250))))
+    for _ in range(200):
+        max_points = rng.randint(1, 300)
+        date_from = date(2024, 1, 10) + timedelta(days=rng.randint(-30, 200)) if rng.random() < 0.7 else None
+        date_to = date_from + timedelta(days=rng.randint(0, 300)) if date_from and rng.random() < 0.5 else None
+        data = app_module.build_daily_sleep_data(db, user_id, date_from=date_from, date_to=date_to,
+                                                 max_points=max_points)
+        assert len(data) <= max_points, (max_points, date_from, date_to)
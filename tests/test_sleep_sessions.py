@@ -0,0 +1,77 @@
+"""睡眠セッションの差分更新（refresh_user_sessions）と全件作り直しの一致"""
+from datetime import datetime, timedelta
+
+from attendance_system.sleep_sessions import refresh_user_sessions
+
+START = datetime.fromisoformat('2024-01-01T23:00:00+09:00')
+
+
+def _add_user(conn, username):
+    return conn.execute("INSERT INTO users (username, password) VALUES (?, 'x')", (username,)).lastrowid
+
+
+def _add_record(conn, user_id, action, timestamp):
+    return conn.execute('''
+        INSERT INTO records (user_id, action, timestamp, memo, local_date)
+        VALUES (?, ?, ?, '', ?)
+    ''', (user_id, action, timestamp.isoformat(), timestamp.date().isoformat())).lastrowid
+
+
+def _sessions(conn, user_id):
+    return [tuple(row) for row in conn.execute('''
+        SELECT sleep_record_id, wake_record_id, sleep_ts, wake_ts, duration_seconds, local_date
+        FROM sleep_sessions WHERE user_id = ? ORDER BY wake_ts, wake_record_id
+    ''', (user_id,))]
+
+
+def _nights(conn, user_id, count):
+    """count 晩分の就寝・起床を登録してセッションを作る"""
+    for night in range(count):
+        sleep_at = START + timedelta(days=night)
+        _add_record(conn, user_id, 'sleep', sleep_at)
+        _add_record(conn, user_id, 'wake_up', sleep_at + timedelta(hours=7))
+    refresh_user_sessions(conn, user_id)
+
+
+def _assert_matches_rebuild(conn, user_id):
+    incremental = _sessions(conn, user_id)
+    refresh_user_sessions(conn, user_id)
+    assert incremental == _sessions(conn, user_id)
+    return incremental
+
+
+def test_refresh_after_insert(db):
+    user_id = _add_user(db, 'sessions-insert')
+    _nights(db, user_id, 3)
+    sleep_at = START + timedelta(days=3)
+    _add_record(db, user_id, 'sleep', sleep_at)
+    refresh_user_sessions(db, user_id, sleep_at.isoformat())
+    wake_at = sleep_at + timedelta(hours=6)
+    _add_record(db, user_id, 'wake_up', wake_at)
+    refresh_user_sessions(db, user_id, wake_at.isoformat())
+    assert len(_assert_matches_rebuild(db, user_id)) == 4
+
+
+def test_refresh_after_delete(db):
+    user_id = _add_user(db, 'sessions-delete')
+    _nights(db, user_id, 4)
+    # 2晩目の起床を消すと、2晩目の就寝は3晩目の就寝で上書きされる
+    record = db.execute('''
+        SELECT id, timestamp FROM records
+        WHERE user_id = ? AND action = 'wake_up' ORDER BY timestamp LIMIT 1 OFFSET 1
+    ''', (user_id,)).fetchone()
+    db.execute('UPDATE records SET is_deleted = 1 WHERE id = ?', (record['id'],))
+    refresh_user_sessions(db, user_id, record['timestamp'])
+    assert len(_assert_matches_rebuild(db, user_id)) == 3
+
+
+def test_refresh_after_out_of_order_insert(db):
+    user_id = _add_user(db, 'sessions-backdated')
+    _nights(db, user_id, 4)
+    # 後から過去の時刻で登録した記録（id は大きいが時刻は2晩目の途中）
+    backdated = START + timedelta(days=1, hours=3)
+    _add_record(db, user_id, 'wake_up', backdated)
+    refresh_user_sessions(db, user_id, backdated.isoformat())
+    sessions = _assert_matches_rebuild(db, user_id)
+    assert len(sessions) == 4
+    assert sessions[1][3] == backdated.isoformat()
@@ -0,0 +1,164 @@
+"""stats.py（基準実装）の性質と、aggregation・comparisons が同じ結果を返すこと
+
+週別・月別の集計テーブル（rollups）との一致は test_rollups.py で確認する。
+"""
+import hashlib
+import json
+import random
+
+import pytest
+
+from attendance_system import aggregation, comparisons, stats
+from attendance_system.comparisons import SleepIndex
+from sample_data import comparison_datasets, generate_rows, to_sleep_times
+
+# generate_rows(2000, seed=7) と評価の境界付近の睡眠時間に対する全関数の出力の SHA-256
+# 結果を意図して変えたときだけ更新すること
+PINNED_DIGEST = '59238b1ca2d770b4c5f58618aad5d830704d7a4f614c5bad7158e621718f7035'
+# 評価の低い順（evaluate_sleep は睡眠時間に対して単調であること）
+EVALUATIONS = ("いい加減もっと寝ろよ！！", "頼むこれ以上は...", "もう少し寝てほしいかも...",
+               "良好だよ☻", "ちょい寝すぎか。", "寝すぎ⁉")
+
+
+def boundary_durations():
+    # 評価が切り替わる境界（7時間 × 0.5, 0.858, 1.0, 1.286, 1.5）の前後
+    values = [0.0, 24.0]
+    for ratio in (0.5, 0.858, 1.0, 1.286, 1.5):
+        for delta in (-1e-9, 0.0, 1e-9, -0.01, 0.01):
+            values.append(7.0 * ratio + delta)
+    return values
+
+
+def _datasets():
+    rng = random.Random(0)
+    datasets = [[]] + [to_sleep_times(generate_rows(n, seed=seed))
+                       for n in (1, 2, 3, 7, 31, 400) for seed in range(3)]
+    # 同じ日付のセッションが並ぶ場合
+    datasets += [to_sleep_times([(row[0], rng.uniform(0, 20) * 3600) for row in generate_rows(60)] * 2)]
+    return datasets
+
+
+DATASETS = _datasets()
+IDS = [f'{i}:{len(d)}件' for i, d in enumerate(DATASETS)]
+
+
+def test_pinned_digest():
+    sleep_times = to_sleep_times(generate_rows(2000, seed=7))
+    sorted_times = sorted(sleep_times, key=lambda x: x['date'], reverse=True)
+    outputs = {
+        'evaluate_sleep': [stats.evaluate_sleep(d) for d in boundary_durations()],
+        'calculate_average': stats.calculate_average(sleep_times),
+        'calculate_overall_average': stats.calculate_overall_average(sleep_times),
+        'calculate_weekly_average': stats.calculate_weekly_average(sleep_times),
+        'calculate_monthly_average': stats.calculate_monthly_average(sleep_times),
+        'calculate_comparisons': stats.calculate_comparisons(sleep_times),
+        'calculate_diff': [stats.calculate_diff(sorted_times, 0, i) for i in range(0, 2001, 97)],
+        'revise_previous_day_comparison': stats.revise_previous_day_comparison(sleep_times),
+        'small': [
+            [stats.calculate_average(sleep_times[:n]), stats.calculate_overall_average(sleep_times[:n]),
+             stats.calculate_comparisons(sleep_times[:n])]
+            for n in range(4)
+        ],
+    }
+    text = json.dumps(outputs, ensure_ascii=False, sort_keys=True, default=str)
+    assert hashlib.sha256(text.encode('utf-8')).hexdigest() == PINNED_DIGEST
+
+
+def test_evaluate_sleep_is_monotonic():
+    ranks = [EVALUATIONS.index(stats.evaluate_sleep(d)) for d in sorted(boundary_durations())]
+    assert ranks == sorted(ranks)
+
+
+@pytest.mark.parametrize('sleep_times', DATASETS, ids=IDS)
+@pytest.mark.parametrize('func', [stats.calculate_average, stats.calculate_overall_average])
+def test_average_properties(sleep_times, func):
+    n = len(sleep_times)
+    result = func(sleep_times)
+    if not n:
+        return
+    total = sum(item['duration'] for item in sleep_times)
+    assert 0 <= result['avg_minutes'] < 60
+    assert result['avg_hours'] == int(result['avg_duration'])
+    assert result['avg_duration'] == pytest.approx(total / n, abs=1e-9)
+    if n < 3:
+        assert result['evaluation'] in (None, '評価不可')
+
+
+@pytest.mark.parametrize('sleep_times', DATASETS, ids=IDS)
+@pytest.mark.parametrize('func, first_day', [(stats.calculate_weekly_average, 'monday'),
+                                             (stats.calculate_monthly_average, 'first')])
+def test_period_average_properties(sleep_times, func, first_day):
+    n = len(sleep_times)
+    total = sum(item['duration'] for item in sleep_times)
+    periods = func(sleep_times)
+    assert sum(p['record_days'] for p in periods) == n
+    # 新しい順に並んでいる
+    assert all(a['start_date'] > b['start_date'] for a, b in zip(periods, periods[1:]))
+    # 期間ごとの平均から全体の合計に戻る
+    assert sum(p['avg_duration'] * p['record_days'] for p in periods) == pytest.approx(total, abs=1e-6 * max(n, 1))
+    if first_day == 'monday':
+        assert all(p['start_date'].weekday() == 0 for p in periods)
+    else:
+        assert all(p['start_date'].day == 1 for p in periods)
+
+
+@pytest.mark.parametrize('sleep_times', DATASETS, ids=IDS)
+def test_diff_properties(sleep_times):
+    n = len(sleep_times)
+    sorted_times = sorted(sleep_times, key=lambda x: x['date'], reverse=True)
+    if n >= 2:
+        assert stats.calculate_comparisons(sleep_times)['yesterday'] == stats.calculate_diff(sorted_times, 0, 1)
+    for i in range(min(n, 50)):
+        forward = stats.calculate_diff(sorted_times, 0, i)
+        backward = stats.calculate_diff(sorted_times, i, 0)
+        # 差の大きさは向きによらず、両方向とも増加になることはない
+        assert (forward['diff_hours'], forward['diff_minutes']) == (backward['diff_hours'], backward['diff_minutes'])
+        assert not (forward['is_increase'] and backward['is_increase'])
+
+    revised = stats.revise_previous_day_comparison(sleep_times)
+    assert len(revised) == n
+    if n:
+        assert revised[0] == '-'
+
+
+@pytest.mark.parametrize('sleep_times', DATASETS, ids=IDS)
+def test_aggregation_matches_stats(sleep_times):
+    # 画面の集計に使っている列データの集計が基準実装と完全に同じ結果になる
+    columns = aggregation.SessionColumns.from_sleep_times(sleep_times)
+    assert aggregation.average(columns, stats.evaluate_sleep) == stats.calculate_average(sleep_times)
+    assert aggregation.overall_average(columns, stats.evaluate_sleep) == stats.calculate_overall_average(sleep_times)
+    assert aggregation.comparisons(columns) == stats.calculate_comparisons(sleep_times)
+
+
+@pytest.mark.parametrize('rows', comparison_datasets())
+def test_comparisons_match_stats(rows):
+    sleep_times = to_sleep_times(rows)
+    columns = aggregation.SessionColumns.from_rows(rows)
+    expected = stats.calculate_comparisons(sleep_times)
+    # 累積和・曜日ごとの配列を作る前と後で同じ結果になる
+    assert comparisons.comparisons(SleepIndex.from_columns(columns)) == expected
+    index = SleepIndex.from_columns(columns).prepare()
+    assert comparisons.comparisons(index) == expected
+
+    # 基準日を過去にずらしたときは、その日までの記録だけで比べたのと同じになる
+    for item in sleep_times[:5]:
+        earlier = [other for other in sleep_times if other['date'] <= item['date']]
+        assert comparisons.comparisons(index, item['date'].toordinal()) == stats.calculate_comparisons(earlier)
+
+
+@pytest.mark.parametrize('rows', comparison_datasets())
+def test_comparison_windows(rows):
+    # 任意の期間の件数・合計が、全件を数えた結果と一致する
+    sleep_times = to_sleep_times(rows)
+    if not sleep_times:
+        return
+    index = SleepIndex.from_columns(aggregation.SessionColumns.from_rows(rows)).prepare()
+    ordinals = [item['date'].toordinal() for item in sleep_times]
+    rng = random.Random(len(rows))
+    for _ in range(30):
+        first = rng.randrange(min(ordinals) - 10, max(ordinals) + 10)
+        last = first + rng.randrange(0, 400)
+        inside = [item['duration'] for item, o in zip(sleep_times, ordinals) if first <= o <= last]
+        count, total = index.window(first, last)
+        assert count == len(inside)
+        assert total == pytest.approx(sum(inside), abs=1e-6)
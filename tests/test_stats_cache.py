@@ -0,0 +1,90 @@
+"""睡眠統計のキャッシュの無効化（別のプロセス・別のインスタンスからの書き込み）"""
+import sqlite3
+import threading
+import time
+
+from attendance_system.data_versions import create_user_versions, get_user_version
+from attendance_system.sleep_sessions import refresh_user_sessions
+from attendance_system.stats_cache import LRUCache, SQLiteCacheBackend, StatsCache
+from conftest import BASE_URL, register_and_login
+
+
+def _version_db(path):
+    conn = sqlite3.connect(path)
+    conn.execute('CREATE TABLE records (id INTEGER PRIMARY KEY, user_id INTEGER, action TEXT, timestamp TEXT, '
+                 'memo TEXT, is_deleted INTEGER DEFAULT 0, local_date TEXT, likes_count INTEGER DEFAULT 0)')
+    conn.execute('CREATE TABLE sleep_sessions (user_id INTEGER)')
+    create_user_versions(conn)
+    conn.commit()
+    return conn
+
+
+def test_db_version_invalidates_other_instances(tmp_path):
+    # ワーカーごとのプロセス内キャッシュでも、別のプロセスの書き込み（DB のトリガー）で読まれなくなる
+    path = str(tmp_path / 'main.db')
+    writer = _version_db(path)
+    caches = [StatsCache(LRUCache(), version=lambda user_id: get_user_version(sqlite3.connect(path), user_id))
+              for _ in range(2)]
+    assert [cache.get_or_compute(1, 'p', lambda: 'old') for cache in caches] == ['old', 'old']
+
+    writer.execute("INSERT INTO records (user_id, action, timestamp) VALUES (1, 'sleep', 't')")
+    writer.commit()
+    assert [cache.get_or_compute(1, 'p', lambda: 'new') for cache in caches] == ['new', 'new']
+    # ほかのユーザーと、いいね数だけの更新は影響しない
+    assert caches[0].get_or_compute(2, 'p', lambda: 'other') == 'other'
+    writer.execute('UPDATE records SET likes_count = 3 WHERE user_id = 1')
+    writer.commit()
+    assert caches[0].get_or_compute(1, 'p', lambda: 'newer') == 'new'
+    writer.execute('UPDATE records SET is_deleted = 1 WHERE user_id = 1')
+    writer.commit()
+    assert caches[1].get_or_compute(1, 'p', lambda: 'deleted') == 'deleted'
+
+
+def test_shared_generation_invalidates_other_instances(tmp_path):
+    path = str(tmp_path / 'cache.db')
+    first, second = (StatsCache(LRUCache(), SQLiteCacheBackend(path, ttl=0.05)) for _ in range(2))
+    assert first.get_or_compute(1, 'p', lambda: 'old') == 'old'
+    assert second.get_or_compute(1, 'p', lambda: 'unused') == 'old'
+    first.invalidate_user(1)
+    # second のプロセス内キャッシュに残っている値は、世代が変わったので使われない
+    assert second.get_or_compute(1, 'p', lambda: 'new') == 'new'
+    # 世代番号はキャッシュの TTL が過ぎても 0 に戻らない
+    time.sleep(0.1)
+    assert second.shared.get_counter('gen:1') == 1
+
+
+def test_shared_generation_increments_atomically(tmp_path):
+    path = str(tmp_path / 'cache.db')
+    SQLiteCacheBackend(path)
+
+    def bump():
+        cache = StatsCache(LRUCache(), SQLiteCacheBackend(path))
+        for _ in range(50):
+            cache.invalidate_user(1)
+
+    threads = [threading.Thread(target=bump) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert SQLiteCacheBackend(path).get_counter('gen:1') == 400
+
+
+def test_route_sees_write_from_another_process(app_module):
+    client = app_module.app.test_client()
+    register_and_login(client, 'cache-other-process')
+    assert client.get(BASE_URL + '/api/sleep_data?period=daily').get_json() == []
+
+    # 別のプロセス（スケジューラー・ほかのワーカー・CLI）の書き込みは invalidate_user を呼ばない
+    conn = sqlite3.connect(app_module.DATABASE_PATH)
+    conn.row_factory = sqlite3.Row
+    user_id = conn.execute("SELECT id FROM users WHERE username = 'cache-other-process'").fetchone()[0]
+    conn.executemany('''
+        INSERT INTO records (user_id, action, timestamp, memo, local_date) VALUES (?, ?, ?, '', ?)
+    ''', [(user_id, 'sleep', '2001-01-01T23:00:00+09:00', '2001-01-01'),
+          (user_id, 'wake_up', '2001-01-02T07:00:00+09:00', '2001-01-02')])
+    refresh_user_sessions(conn, user_id)
+    conn.commit()
+    conn.close()
+    data = client.get(BASE_URL + '/api/sleep_data?period=daily').get_json()
+    assert [item['duration'] for item in data] == [8.0]
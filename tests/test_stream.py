@@ -0,0 +1,92 @@
+"""/api/stream（Server-Sent Events）と再接続時の Last-Event-ID"""
+import pytest
+
+from attendance_system.events import EventBroker
+from conftest import BASE_URL, register_and_login
+
+
+def test_reconnect_with_matching_id_replays_missed_events():
+    broker = EventBroker()
+    first = broker.publish('record', {'n': 1})
+    broker.publish('like', {'n': 2})
+    broker.publish('delete', {'n': 3})
+    events, overflowed = broker.subscribe(first).get(timeout=0)
+    assert [event['data']['n'] for event in events] == [2, 3]
+    assert not overflowed
+    # 最新の ID なら送るものはなく、取り直しも不要
+    latest = broker.publish('record', {'n': 4})
+    assert broker.subscribe(latest).get(timeout=0) == ([], False)
+
+
+@pytest.mark.parametrize('last_event_id', ['other-1', '3', 'garbage', ''])
+def test_reconnect_with_foreign_id_requests_resync(last_event_id):
+    # 別のワーカー・再起動前のプロセスの ID（エポックが違う）では続きを送れない
+    broker = EventBroker()
+    broker.publish('record', {})
+    assert broker.subscribe(last_event_id).get(timeout=0) == ([], True)
+
+
+def test_reconnect_with_stale_or_future_id_requests_resync():
+    broker = EventBroker(history_size=3)
+    first = broker.publish('record', {})
+    for _ in range(5):
+        broker.publish('record', {})
+    # 履歴から消えた範囲
+    assert broker.subscribe(first).get(timeout=0) == ([], True)
+    # このプロセスがまだ出していない ID
+    assert broker.subscribe(f'{broker.epoch}-100').get(timeout=0) == ([], True)
+    # 新しいプロセスではまだ何も出していないので、以前の連番はすべて範囲外
+    assert EventBroker().subscribe(first).get(timeout=0) == ([], True)
+
+
+def test_epoch_changes_after_fork(monkeypatch):
+    broker = EventBroker()
+    event_id = broker.publish('record', {})
+    monkeypatch.setattr('os.getpid', lambda: -1)
+    assert broker.subscribe(event_id).get(timeout=0) == ([], True)
+    assert not broker.publish('record', {}).startswith(event_id.rsplit('-', 1)[0])
+
+
+@pytest.fixture
+def stream(app_module, monkeypatch):
+    monkeypatch.setattr(app_module, 'STREAM_HEARTBEAT', 0.05)
+    client = app_module.app.test_client()
+    register_and_login(client, 'streamer')
+    responses = []
+
+    def open_stream(last_event_id=None):
+        headers = {'Last-Event-ID': last_event_id} if last_event_id is not None else {}
+        response = client.get(BASE_URL + '/api/stream', headers=headers, buffered=False)
+        responses.append(response)
+        assert response.status_code == 200
+        assert response.mimetype == 'text/event-stream'
+        chunks = iter(response.response)
+        assert next(chunks) == b'retry: 5000\n\n'
+        return chunks
+
+    yield open_stream
+    for response in responses:
+        response.close()
+
+
+def test_stream_replays_after_matching_id(app_module, stream):
+    first = app_module.event_broker.publish('like', {'record_id': 1})
+    second = app_module.event_broker.publish('like', {'record_id': 2})
+    chunk = next(stream(first)).decode('utf-8')
+    assert chunk.startswith(f'id: {second}\nevent: like\n')
+    assert '"record_id":2' in chunk
+
+
+@pytest.mark.parametrize('last_event_id', ['0123456789ab-1', '1'])
+def test_stream_sends_resync_for_foreign_id(app_module, stream, last_event_id):
+    app_module.event_broker.publish('like', {'record_id': 1})
+    assert next(stream(last_event_id)) == b'event: resync\ndata: {}\n\n'
+
+
+def test_stream_sends_new_events(app_module, stream):
+    chunks = stream()
+    event_id = app_module.event_broker.publish('delete', {'id': 5})
+    chunk = next(chunks)
+    while chunk == b': keepalive\n\n':
+        chunk = next(chunks)
+    assert chunk == f'id: {event_id}\nevent: delete\ndata: {{"id":5}}\n\n'.encode('utf-8')
@@ -0,0 +1,39 @@
+"""週別平均の週の区切り（ISO 週）
+
+user-017 で「暦年 + ISO 週番号・%W の開始日」から ISO 週に変えた表示上の変更を固定する。
+"""
+from datetime import date
+
+from attendance_system import rollups, stats
+from attendance_system.sleep_sessions import load_sleep_times
+from test_rollups import insert_sessions
+
+
+def sleep_time(d, hours=7.0):
+    return {'date': d, 'duration': hours, 'hours': int(hours), 'minutes': 0,
+            'week': d.isocalendar()[1], 'month': d.month, 'year': d.year}
+
+
+def test_week_across_new_year_is_one_iso_week():
+    # 2024/12/30（月）～2025/01/05（日）は 2025-W01 の1週間
+    weeks = stats.calculate_weekly_average([sleep_time(date(2024, 12, 30)), sleep_time(date(2025, 1, 5))])
+    assert [(w['week_key'], w['start_date'], w['record_days']) for w in weeks] == \
+        [('2025-W01', date(2024, 12, 30), 2)]
+    assert weeks[0]['period'] == '2024/12/30～2025/01/05'
+
+
+def test_week_starts_on_monday():
+    # 以前は 2025/01/06 から始まる週として表示されていた
+    weeks = stats.calculate_weekly_average([sleep_time(date(2025, 1, 2))])
+    assert weeks[0]['start_date'] == date(2024, 12, 30)
+    assert weeks[0]['start_date'].weekday() == 0
+
+
+def test_rollups_use_the_same_weeks(db):
+    days = ['2020-12-31', '2021-01-03', '2021-01-04', '2026-12-31', '2027-01-01', '2027-01-04']
+    user_id = insert_sessions(db, 'weeks', [(d, 7 * 3600) for d in days])
+    expected = stats.calculate_weekly_average(load_sleep_times(db, user_id))
+    actual = rollups.weekly_averages(db, user_id, stats.evaluate_sleep)
+    assert [(w['week_key'], w['start_date'], w['record_days']) for w in actual] == \
+        [(w['week_key'], w['start_date'], w['record_days']) for w in expected]
+    assert [w['week_key'] for w in actual] == ['2027-W01', '2026-W53', '2021-W01', '2020-W53']
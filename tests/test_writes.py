@@ -0,0 +1,46 @@
+"""高並列モード（SQLITE_HIGH_CONCURRENCY）で書き込みがすべて書き込みキューを通ること"""
+import pytest
+
+from conftest import BASE_URL, register_and_login
+
+
+@pytest.fixture
+def write_queue(app_module, monkeypatch):
+    monkeypatch.setitem(app_module.app.config, 'SQLITE_HIGH_CONCURRENCY', True)
+    queue = app_module.get_write_queue()
+    yield queue
+    queue.stop()
+    monkeypatch.setattr(app_module, '_write_queue', None)
+
+
+def _user(app_module, username):
+    with app_module.app.app_context():
+        return app_module.get_db_connection().execute(
+            'SELECT id, password FROM users WHERE username = ?', (username,)).fetchone()
+
+
+def test_account_and_bulk_writes_use_write_queue(app_module, write_queue):
+    client = app_module.app.test_client()
+    completed = write_queue.stats()['completed']
+
+    register_and_login(client, 'queued')
+    assert _user(app_module, 'queued') is not None
+    client.post(BASE_URL + '/register', data={'username': 'queued', 'password': 'p'})
+    client.post(BASE_URL + '/reset_password', data={'username': 'queued', 'new_password': 'q'})
+    assert _user(app_module, 'queued')['password'] == app_module.hash_password('q')
+
+    csv_text = ('action,timestamp,memo\n'
+                'sleep,2001-01-01T23:00:00+09:00,\n'
+                'wake_up,2001-01-02T07:00:00+09:00,\n')
+    response = client.post(BASE_URL + '/api/records/bulk?format=csv', data=csv_text, content_type='text/csv')
+    assert response.get_json()['summary'] == {'inserted': 2, 'duplicate': 0, 'invalid': 0}
+
+    admin = app_module.app.test_client()
+    admin.post(BASE_URL + '/login', data={'username': 'admin', 'password': 'admin'})
+    admin.post(BASE_URL + f"/delete_user/{_user(app_module, 'queued')['id']}")
+    assert _user(app_module, 'queued') is None
+
+    # 登録・登録済みの確認・パスワード変更・一括登録（1バッチ）・ユーザー削除
+    stats = write_queue.stats()
+    assert stats['completed'] - completed == 5
+    assert stats['failed'] == 0